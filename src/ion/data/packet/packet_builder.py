@@ -36,7 +36,7 @@ class DataPacketBuilder(object):
         data = samples.copy()
         data["data"] = data_array
         new_packet = DataPacket(ts_created=get_ion_ts(), data=data)
-        for attr in new_packet.__dict__.keys():
+        for attr in new_packet._get_fields().keys():
             if attr in ('data', 'ts_created'):
                 continue
             if attr in kwargs:
@@ -165,7 +165,7 @@ class EventPersister(SimpleProcess):
                 log.exception("Error processing events in plugin %s", plugin_name)
 
     def _log_events(self, events):
-        events_str = pprint.pformat([event.__dict__ for event in events]) if events else ""
+        events_str = pprint.pformat([event._get_fields() for event in events]) if events else ""
         log.warn("EVENTS:\n%s", events_str)
 
 
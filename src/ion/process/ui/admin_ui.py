@@ -1121,7 +1121,7 @@ def get_typed_value(value, schema_entry=None, targettype=None):
 def get_value_dict(obj, ignore_fields=None):
     ignore_fields = ignore_fields or []
     if isinstance(obj, IonObjectBase):
-        obj_dict = obj.__dict__
+        obj_dict = obj._get_fields()
     else:
         obj_dict = obj
     val_dict = {}
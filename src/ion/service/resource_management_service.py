@@ -146,7 +146,7 @@ class ResourceManagementService(BaseResourceManagementService):
             raise BadRequest("Illegal argument type: attribute_filter")
 
         if not id_only and attr_filter:
-            filtered_res = [dict(__noion__=True, **{k: v for k, v in obj.__dict__.iteritems() if k in attr_filter or k in {"_id", "type_"}}) for obj in query_results]
+            filtered_res = [dict(__noion__=True, **{k: v for k, v in obj._get_fields().iteritems() if k in attr_filter or k in {"_id", "type_"}}) for obj in query_results]
             return filtered_res
         return query_results
 
@@ -261,7 +261,7 @@ class ResourceManagementService(BaseResourceManagementService):
         res_list.extend(res_objs)
 
         def get_core_attrs(resource):
-            res_attr = {k:v for k, v in resource.__dict__.iteritems() if k in self.CORE_ATTRIBUTES}
+            res_attr = {k:v for k, v in resource._get_fields().iteritems() if k in self.CORE_ATTRIBUTES}
             # HACK: Cannot use type_ because that would treat the dict as IonObject and add back all attributes
             res_attr["type__"] = resource.type_
             return res_attr
@@ -72,7 +72,7 @@ class GeoUtils(object):
                            depth_min="geospatial_vertical_min",
                            depth_max="geospatial_vertical_max")
 
-        gb_box = GeoUtils.calc_bounding_box_for_boxes([gb.__dict__ for gb in geo_bounds_list if gb],
+        gb_box = GeoUtils.calc_bounding_box_for_boxes([gb._get_fields() for gb in geo_bounds_list if gb],
                                                       key_mapping=key_mapping, map_output=True)
 
         geo_bounds = GeospatialBounds(**gb_box)
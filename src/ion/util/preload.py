@@ -258,7 +258,12 @@ class Preloader(object):
                 for attr in ('alt_ids','_id','_rev','type_'):
                     if attr in obj_fields:
                         del obj_fields[attr]
-                existing_obj.__dict__.update(obj_fields)
+                for attr in list(obj_fields.keys()):
+                    if attr not in existing_obj._schema:
+                        log.warn("Skipping unknown field in %s edit: %s", objtype, attr)
+                        del obj_fields[attr]
+                for attr, value in obj_fields.iteritems():
+                    setattr(existing_obj, attr, value)
                 log.trace("Update object type %s using field names %s", objtype, obj_fields.keys())
                 obj = existing_obj
             else:
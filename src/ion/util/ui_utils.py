@@ -12,7 +12,7 @@ import json
 import simplejson
 
 from pyon.public import BadRequest, OT, get_ion_ts_millis
-from pyon.util.containers import get_datetime
+from pyon.util.containers import get_datetime, ion_object_encoder
 
 from interface.objects import ActorIdentity, SecurityToken, TokenTypeEnum
 
@@ -40,7 +40,7 @@ json_dumps = json.dumps
 json_loads = simplejson.loads   # Faster loading than regular json
 
 def encode_ion_object(obj):
-    return obj.__dict__
+    return ion_object_encoder(obj)
 
 
 # -------------------------------------------------------------------------
@@ -471,7 +471,8 @@ class LocalRouterCapability(ContainerCapability):
         self.container.local_router = None
     def start(self):
         # internal router for local transports
-        self.container.local_router = LocalRouter(bootstrap.get_sys_name())
+        self.container.local_router = LocalRouter(bootstrap.get_sys_name(),
+                                                  throughput_mode=CFG.get_safe("container.messaging.local_router.throughput_mode", False))
         self.container.local_router.start()
         self.container.local_router.ready.wait(timeout=2)
     def stop(self):
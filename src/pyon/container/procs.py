@@ -34,7 +34,7 @@ from pyon.core import (PROCTYPE_SERVICE, PROCTYPE_AGENT, PROCTYPE_IMMEDIATE, PRO
 from pyon.core.bootstrap import CFG
 from pyon.core.exception import ContainerConfigError, BadRequest, NotFound
 from pyon.core.thread import ThreadManager
-from pyon.ion.endpoint import ProcessRPCServer
+from pyon.ion.endpoint import ProcessRPCServer, ProcessRPCResponseEndpointUnit
 from pyon.ion.event import EventPublisher
 from pyon.ion.process import IonProcessThreadManager, IonProcessError
 from pyon.ion.resource import OT, PRED, RT
@@ -65,6 +65,9 @@ class ProcManager(object):
         # mapping of greenlets we spawn to process_instances for error handling
         self._spawned_proc_to_process = {}
 
+        # Service RPC servers by (exchange, queue) for same-container RPC, rebuilt on (un)register
+        self._local_rpc_servers = None
+
         # Effective execution engine config (after merging in child process overrides)
         self.ee_cfg = self._get_execution_engine_config()
 
@@ -884,6 +887,7 @@ class ProcManager(object):
             log.warn("Process name already registered in container: %s" % name)
         self.procs_by_name[name] = process_instance
         self.procs[process_instance.id] = process_instance
+        self._local_rpc_servers = None
 
         # Add Process to resource registry
         process_instance.errcause = "registering"
@@ -973,6 +977,30 @@ class ProcManager(object):
         if do_notifications:
             self._call_proc_state_changed(process_instance, ProcessStateEnum.TERMINATED)
 
+    def get_local_rpc_server(self, exchange, queue):
+        """
+        Returns the RPC server of a service process in this container listening on the given
+        exchange and queue, or None. Used for same-container RPC on every request, thus the
+        lookup map is only rebuilt when processes are registered or unregistered.
+        """
+        servers = self._local_rpc_servers
+        if servers is None:
+            servers = {}
+            for proc in self.procs.values():
+                if proc.process_type != PROCTYPE_SERVICE:
+                    continue
+                for listener in getattr(getattr(proc, '_process', None), 'listeners', []):
+                    if type(listener) is ProcessRPCServer and listener.endpoint_unit_type is ProcessRPCResponseEndpointUnit:
+                        servers.setdefault((listener._recv_name.exchange, listener._recv_name.queue), listener)
+            self._local_rpc_servers = servers
+
+        server = servers.get((exchange, queue), None)
+        if server is not None and server not in getattr(server._process._process, 'listeners', []):
+            # Listener was removed from its process after the map was built
+            self._local_rpc_servers = None
+            return self.get_local_rpc_server(exchange, queue)
+        return server
+
     def _unregister_process(self, process_id, process_instance):
         # Remove process registration in resource registry
         if process_instance._proc_res_id:
@@ -1008,6 +1036,7 @@ class ProcManager(object):
 
         # Remove internal registration in container
         del self.procs[process_id]
+        self._local_rpc_servers = None
         if process_instance._proc_name in self.procs_by_name:
             del self.procs_by_name[process_instance._proc_name]
         else:
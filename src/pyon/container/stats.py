@@ -86,12 +86,18 @@ class ContainerStatsManager(object):
         from pyon.ion.process import set_process_stats_callback
         set_process_stats_callback(self._proc_callback)
 
+        from pyon.core.interceptor.compress import set_compress_stats_callback
+        set_compress_stats_callback(self._compress_callback)
+
     def _deactivate_collection(self):
         from ion.service.service_gateway import sg_instance
         if sg_instance:
             # This container may not run the service gateway
             sg_instance.register_request_callback(None)
 
+        from pyon.core.interceptor.compress import set_compress_stats_callback
+        set_compress_stats_callback(None)
+
         from pyon.ion.process import set_process_stats_callback
         set_process_stats_callback(None)
 
@@ -119,17 +125,23 @@ class ContainerStatsManager(object):
         self._call_callbacks("PROC", "op_complete", kwargs)
 
     def _msg_in_callback(self, msg, headers, env):
-        log_entry = dict(status="RECV %s bytes" % len(msg), headers=headers, env=env,
-                         content_length=len(msg), content=str(msg)[:self.SAVE_MSG_MAX])
+        # Same-container RPC messages are not encoded
+        msg_len = len(msg) if isinstance(msg, basestring) else 0
+        log_entry = dict(status="RECV %s bytes" % msg_len, headers=headers, env=env,
+                         content_length=msg_len, content=str(msg)[:self.SAVE_MSG_MAX])
         CallTracer.log_scope_call("MSG.in", log_entry, include_stack=False)
         self._call_callbacks("MSG", "in", log_entry)
 
     def _msg_out_callback(self, msg, headers, env):
-        log_entry = dict(status="SENT %s bytes" % len(msg), headers=headers, env=env,
-                         content_length=len(msg), content=str(msg)[:self.SAVE_MSG_MAX])
+        msg_len = len(msg) if isinstance(msg, basestring) else 0
+        log_entry = dict(status="SENT %s bytes" % msg_len, headers=headers, env=env,
+                         content_length=msg_len, content=str(msg)[:self.SAVE_MSG_MAX])
         CallTracer.log_scope_call("MSG.out", log_entry, include_stack=False)
         self._call_callbacks("MSG", "out", log_entry)
 
+    def _compress_callback(self, action, stats):
+        self._call_callbacks("MSG", action, stats)
+
     def _db_callback(self, scope, log_entry):
         CallTracer.log_scope_call(scope, log_entry, include_stack=True)
         self._call_callbacks("DB", scope, log_entry)
@@ -13,6 +13,7 @@ from pyon.core.governance import get_system_actor_header, get_system_actor
 from pyon.core.governance.governance_dispatcher import GovernanceDispatcher
 from pyon.core.governance.policy.policy_decision import PolicyDecisionPointManager
 from pyon.core.interceptor.interceptor import Invocation
+from pyon.ion.endpoint import security_header_cache
 from pyon.ion.event import EventSubscriber
 from pyon.ion.resource import RT, OT
 from pyon.util.containers import get_ion_ts, named_any
@@ -194,6 +195,7 @@ class GovernanceController(object):
         self._ensure_system_actor()
 
         log.info("Received policy event: %s", policy_event)
+        security_header_cache.clear()
 
         if policy_event.type_ == OT.ResourcePolicyEvent:
             self.resource_policy_event_callback(policy_event, *args, **kwargs)
@@ -209,7 +211,7 @@ class GovernanceController(object):
     def service_policy_event_callback(self, service_policy_event, *args, **kwargs):
         """The ServicePolicyEvent handler
         """
-        log.debug('Service policy event: %s', str(service_policy_event.__dict__))
+        log.debug('Service policy event: %s', str(service_policy_event._get_fields()))
 
         policy_id = service_policy_event.origin
         service_name = service_policy_event.service_name
@@ -228,7 +230,7 @@ class GovernanceController(object):
     def resource_policy_event_callback(self, resource_policy_event, *args, **kwargs):
         """The ResourcePolicyEvent handler
         """
-        log.debug('Resource policy event: %s', str(resource_policy_event.__dict__))
+        log.debug('Resource policy event: %s', str(resource_policy_event._get_fields()))
 
         policy_id = resource_policy_event.origin
         resource_id = resource_policy_event.resource_id
@@ -241,6 +243,7 @@ class GovernanceController(object):
         Reload by getting policy for each of the container's processes and common policy.
         """
         log.info('Resetting policy cache')
+        security_header_cache.clear()
 
         # First remove all cached polices and operation precondition functions
         self._clear_container_policy_caches()
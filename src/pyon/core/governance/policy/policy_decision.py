@@ -24,6 +24,7 @@ from pyon.core.exception import NotFound
 from pyon.core.governance import SUPERUSER_ROLE, ANONYMOUS_ACTOR, DECORATOR_OP_VERB
 from pyon.core.governance.governance_dispatcher import GovernanceDispatcher
 from pyon.core.registry import is_ion_object, message_classes, get_class_decorator_value
+from pyon.core.interceptor.interceptor import materialize_payload
 from pyon.util.log import log
 
 
@@ -322,7 +323,8 @@ class PolicyDecisionPointManager(object):
                 pass
 
         # Create generic attributes for each of the primitive message parameter types to be available in XACML rules
-        # and evaluation functions
+        # and evaluation functions. Rules may inspect message content, so decode a lazy payload here.
+        invocation.message = materialize_payload(invocation.message)
         parameter_dict = {'message': invocation.message,
                           'headers': invocation.headers,
                           'annotations': invocation.message_annotations}
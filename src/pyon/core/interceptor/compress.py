@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""Messaging interceptor to compress large encoded message bodies"""
+
+from collections import OrderedDict
+import time
+import zlib
+
+from pyon.core.exception import BadRequest
+from pyon.core.interceptor.interceptor import Interceptor, Invocation
+from pyon.util.containers import get_safe
+from pyon.util.log import log
+
+try:
+    import lz4.block
+    has_lz4 = True
+except ImportError:
+    has_lz4 = False
+
+
+MSG_HEADER_COMPRESSION = "compression"
+MSG_HEADER_ACCEPT_COMPRESSION = "accept-compression"
+
+# Outgoing compression modes
+COMPRESS_NEVER = "never"          # Never compress, only decompress incoming messages
+COMPRESS_NEGOTIATE = "negotiate"  # Announce support; compress only replies to requests that announced support
+COMPRESS_ALWAYS = "always"        # Compress all messages above threshold (requires all receivers to support it)
+
+# Callback hook for compression stats. Signature: def callback(action, stats)
+stats_callback = None
+
+
+def _get_codecs():
+    codecs = dict(zlib=(zlib.compress, zlib.decompress))
+    if has_lz4:
+        codecs["lz4"] = (lambda data, level: lz4.block.compress(data), lz4.block.decompress)
+    return codecs
+
+
+class CompressInterceptor(Interceptor):
+    """
+    Compresses encoded message bodies above a size threshold and tags them with a header.
+    Received messages with the header are decompressed transparently.
+    Must be placed after the encode interceptor in the outgoing stack and before it in the incoming stack.
+    """
+    MAX_PENDING_REPLIES = 10000
+
+    def __init__(self):
+        self.mode = COMPRESS_NEVER
+        self.threshold = 65536
+        self.codec = "zlib"
+        self.level = 1
+        self._codecs = _get_codecs()
+        self._accepted_convs = OrderedDict()   # conv-id of received requests announcing support
+
+    def configure(self, config):
+        self.mode = get_safe(config, "mode", COMPRESS_NEVER)
+        if self.mode not in (COMPRESS_NEVER, COMPRESS_NEGOTIATE, COMPRESS_ALWAYS):
+            raise BadRequest("Unknown CompressInterceptor mode: %s" % self.mode)
+        self.threshold = int(get_safe(config, "threshold", 65536))
+        self.level = int(get_safe(config, "level", 1))
+        self.codec = get_safe(config, "codec", "zlib")
+        if self.codec not in self._codecs:
+            log.warn("CompressInterceptor codec %s not available - using zlib", self.codec)
+            self.codec = "zlib"
+        log.debug("CompressInterceptor enabled, mode=%s, codec=%s, threshold=%s", self.mode, self.codec, self.threshold)
+
+    def is_applicable(self, endpoint, path):
+        # Incoming messages may always be compressed by the sender
+        return path == Invocation.PATH_IN or self.mode != COMPRESS_NEVER
+
+    def outgoing(self, invocation):
+        if self.mode == COMPRESS_NEVER:
+            return invocation
+
+        headers = invocation.headers
+        if self.mode == COMPRESS_NEGOTIATE:
+            codec = self._accepted_convs.pop(headers.get("conv-id", None), None) if self._accepted_convs else None
+            if headers.get("performative", None) == "request":
+                headers[MSG_HEADER_ACCEPT_COMPRESSION] = ",".join(sorted(self._codecs))
+        else:
+            codec = self.codec
+
+        if codec and len(invocation.message) > self.threshold:
+            self._compress(invocation, codec)
+
+        return invocation
+
+    def incoming(self, invocation):
+        headers = invocation.headers
+        if MSG_HEADER_COMPRESSION in headers:
+            self._decompress(invocation, headers.pop(MSG_HEADER_COMPRESSION))
+
+        if self.mode == COMPRESS_NEGOTIATE and MSG_HEADER_ACCEPT_COMPRESSION in headers and "conv-id" in headers:
+            accepted = headers[MSG_HEADER_ACCEPT_COMPRESSION].split(",")
+            codec = self.codec if self.codec in accepted else "zlib"
+            self._accepted_convs[headers["conv-id"]] = codec
+            if len(self._accepted_convs) > self.MAX_PENDING_REPLIES:
+                self._accepted_convs.popitem(last=False)
+
+        return invocation
+
+    def _compress(self, invocation, codec):
+        start_time = time.time()
+        raw_size = len(invocation.message)
+        compress_func = self._codecs[codec][0]
+        compressed = compress_func(invocation.message, self.level)
+        if len(compressed) >= raw_size:
+            return
+        invocation.message = compressed
+        invocation.headers[MSG_HEADER_COMPRESSION] = codec
+
+        if stats_callback:
+            stats_callback("compress", dict(codec=codec, raw_size=raw_size, size=len(compressed),
+                                            ratio=float(raw_size) / len(compressed),
+                                            time=time.time() - start_time))
+
+    def _decompress(self, invocation, codec):
+        if codec not in self._codecs:
+            raise BadRequest("Unsupported message compression: %s" % codec)
+        start_time = time.time()
+        size = len(invocation.message)
+        invocation.message = self._codecs[codec][1](invocation.message)
+
+        if stats_callback:
+            stats_callback("decompress", dict(codec=codec, raw_size=len(invocation.message), size=size,
+                                              ratio=float(len(invocation.message)) / size,
+                                              time=time.time() - start_time))
+
+
+def set_compress_stats_callback(stats_cb):
+    """ Sets a callback function (hook) to push stats after a message compression. """
+    global stats_callback
+    if stats_cb is None:
+        pass
+    elif stats_callback:
+        log.warn("Stats callback already defined")
+    stats_callback = stats_cb
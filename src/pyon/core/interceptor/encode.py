@@ -3,13 +3,15 @@
 """Messaging object encoder/decoder for IonObjects and numpy data"""
 
 import msgpack
+import struct
 import sys
 from ast import literal_eval
 
 from pyon.core.bootstrap import get_obj_registry
 from pyon.core.exception import BadRequest
-from pyon.core.interceptor.interceptor import Interceptor
-from pyon.core.object import IonObjectBase, IonMessageObjectBase
+from pyon.core.interceptor.interceptor import Interceptor, LazyPayload
+from pyon.core.object import IonObjectBase, IonMessageObjectBase, LazyIonObjectMixin, BUILT_IN_ATTRS
+from pyon.net.chunking import get_chunked_message_size
 from pyon.util.containers import get_safe, DotDict
 from pyon.util.log import log
 
@@ -35,6 +37,11 @@ class EncodeTypes(object):
     NPVAL = 'n'
 
 
+class EncodeExtTypes(object):
+    """msgpack extension type codes"""
+    NPARRAY = 1
+
+
 # Global lazy load reference to the Pyon object registry (we be set on first use, not on load).
 # Note: We need this here so that the decode_ion/encode_ion functions can be imported (i.e. be static).
 obj_registry = None
@@ -55,15 +62,13 @@ def decode_ion(obj):
         if obj_registry is None:
             obj_registry = get_obj_registry()
 
-        ion_obj = obj_registry.new(obj["type_"])
         for k, v in obj.iteritems():
             # unicode translate to utf8
             # Note: This is not recursive within dicts/list or any other types
             if isinstance(v, unicode):
-                v = v.encode('utf8')
-            if k != "type_":
-                setattr(ion_obj, k, v)
-        return ion_obj
+                obj[k] = v.encode('utf8')
+        # The decoded dict becomes the instance attributes, with defaults for missing fields
+        return obj_registry.new_from_fields(obj["type_"], obj)
 
     if 't' not in obj:
         return obj
@@ -114,7 +119,7 @@ def encode_ion(obj):
         # There must be a type_ in here so that the object can be decoded
         if not isinstance(obj, IonMessageObjectBase) and not hasattr(obj, "type_"):
             log.error("IonObject with no type_: %s", obj)
-        return obj.__dict__
+        return obj._get_fields()
 
     if isinstance(obj, list):
         return {'t': EncodeTypes.LIST, 'o': tuple(obj)}
@@ -147,14 +152,216 @@ def encode_ion(obj):
     raise TypeError('Unknown type "%s" in user specified encoder: "%s"' % (type(obj), obj))
 
 
+def encode_ion_ext(obj):
+    """
+    msgpack object hook like encode_ion, but encoding numpy arrays as msgpack extension type.
+    """
+    if has_numpy and isinstance(obj, np.ndarray):
+        return encode_ndarray_ext(obj)
+
+    return encode_ion(obj)
+
+
+def encode_ndarray_ext(obj):
+    """
+    Encodes a numpy array as msgpack extension type. The ext data is a length prefixed
+    msgpack header (dtype descr, shape) followed by the raw array buffer.
+    The array data is copied twice: into the ext data str (msgpack ExtType requires a str) and by
+    msgpack into the packed message, as with tostring() in encode_ion.
+    Supports simple and structured dtypes. Object arrays are encoded by encode_ion.
+    """
+    dtype = obj.dtype
+    if dtype.hasobject:
+        return encode_ion(obj)
+    if dtype.fields:
+        descr = dtype.descr
+        if not all(field[0] for field in descr):
+            # Unnamed padding fields do not survive the descr round trip
+            return encode_ion(obj)
+    else:
+        descr = dtype.str
+    if not obj.flags.c_contiguous:
+        obj = np.ascontiguousarray(obj)
+
+    header = msgpack.packb((descr, obj.shape))
+    return msgpack.ExtType(EncodeExtTypes.NPARRAY, buffer(struct.pack("<I", len(header)) + header) + buffer(obj))
+
+
+def decode_ion_ext(code, data):
+    """
+    msgpack ext hook to decode numpy arrays. Returns a read-only np.frombuffer view over the
+    ext data, which msgpack unpacks into a new str. This is one copy of the array data, where
+    decode_ion copies it twice (msgpack str, then np.fromstring).
+    """
+    if code == EncodeExtTypes.NPARRAY:
+        if not has_numpy:
+            raise BadRequest("Missing numpy")
+        header_len = struct.unpack_from("<I", data)[0]
+        descr, shape = msgpack.unpackb(data[4:4 + header_len])
+        dtype = np.dtype(_descr_to_dtype_spec(descr))
+        if len(data) == 4 + header_len:
+            return np.zeros(shape, dtype=dtype)
+        return np.frombuffer(data, dtype=dtype, offset=4 + header_len).reshape(shape)
+
+    return msgpack.ExtType(code, data)
+
+
+def _descr_to_dtype_spec(descr):
+    """Turns a msgpack decoded dtype descr (lists instead of tuples) back into a dtype spec"""
+    if not isinstance(descr, list):
+        return descr
+    spec = []
+    for field in descr:
+        name = tuple(field[0]) if isinstance(field[0], list) else field[0]
+        field_spec = [name, _descr_to_dtype_spec(field[1])]
+        if len(field) > 2:
+            field_spec.append(tuple(field[2]))
+        spec.append(tuple(field_spec))
+    return spec
+
+
+class SchemaCodec(object):
+    """
+    Schema-compiled msgpack codec for IonObjects and numpy types.
+    Instead of running the generic isinstance chain of encode_ion for every value and
+    instantiating decoded IonObjects through the registry with per-field setattr, this codec
+    compiles one encoder per class and one decoder per IonObject type from the class _schema.
+    Encoders are dispatched by exact class, decoders by type_ name. Compilation happens
+    eagerly for all registered types via compile_all() or lazily on first use of a type.
+    Produces and accepts the same wire format as encode_ion/decode_ion (or encode_ion_ext
+    for numpy arrays if numpy_ext is set).
+    """
+
+    def __init__(self, numpy_ext=False):
+        self._encoders = {}     # Maps class to encoder function
+        self._decoders = {}     # Maps IonObject type name to compiled decoder tuple
+        self._new_obj = object.__new__
+
+        self._encoders[set] = lambda obj: {'t': EncodeTypes.SET, 'o': tuple(obj)}
+        self._encoders[complex] = lambda obj: {'t': EncodeTypes.COMPLEX, 'o': (obj.real, obj.imag)}
+        self._encoders[slice] = lambda obj: {'t': EncodeTypes.SLICE, 'o': (obj.start, obj.stop, obj.step)}
+        if has_numpy:
+            self._encoders[np.ndarray] = encode_ndarray_ext if numpy_ext else encode_ion
+            self._encoders[np.dtype] = encode_ion
+
+    def compile_all(self):
+        """Compiles encoders and decoders for all object and message types known to the registry"""
+        from pyon.core.registry import model_classes, message_classes
+        for type_name, clzz in model_classes.iteritems():
+            if not issubclass(clzz, IonObjectBase):
+                continue
+            self._compile_encoder(clzz)
+            self._compile_decoder(type_name)
+        for clzz in message_classes.itervalues():
+            self._compile_encoder(clzz)
+        log.debug("SchemaCodec compiled %s encoders, %s decoders", len(self._encoders), len(self._decoders))
+
+    def encode(self, obj):
+        """msgpack default hook (see encode_ion)"""
+        encoder = self._encoders.get(obj.__class__, None)
+        if encoder is None:
+            if not isinstance(obj, IonObjectBase):
+                return encode_ion(obj)
+            encoder = self._compile_encoder(obj.__class__)
+        return encoder(obj)
+
+    def decode(self, obj):
+        """msgpack object hook (see decode_ion)"""
+        if "type_" in obj:
+            if "__noion__" in obj:
+                obj.pop("__noion__")
+                return obj
+            decoder = self._decoders.get(obj["type_"], None) or self._compile_decoder(obj["type_"])
+            if decoder is True:
+                return decode_ion(obj)
+
+            # Compiled decoder: class, required schema keys, allowed keys
+            clzz, schema_keys, allowed_keys = decoder
+            if not schema_keys <= obj.viewkeys() <= allowed_keys:
+                # Missing fields need constructor defaults, extra fields need setattr semantics
+                return decode_ion(obj)
+
+            # Unpacked msgpack raw values are str already (no unicode translate needed),
+            # so the decoded dict can directly become the instance attributes
+            ion_obj = self._new_obj(clzz)
+            ion_obj._set_fields(obj)
+            return ion_obj
+
+        if 't' not in obj:
+            return obj
+
+        return decode_ion(obj)
+
+    def _compile_encoder(self, clzz):
+        if not clzz.__dictoffset__ or issubclass(clzz, LazyIonObjectMixin):
+            # Classes generated with __slots__ and lazy objects (deserialized by _get_fields)
+            def encode_obj(obj):
+                fields = obj._get_fields()
+                if "type_" not in fields and not isinstance(obj, IonMessageObjectBase):
+                    log.error("IonObject with no type_: %s", obj)
+                return fields
+        elif issubclass(clzz, IonMessageObjectBase):
+            def encode_obj(obj):
+                return obj.__dict__
+        else:
+            def encode_obj(obj):
+                fields = obj.__dict__
+                if "type_" not in fields:
+                    log.error("IonObject with no type_: %s", obj)
+                return fields
+
+        self._encoders[clzz] = encode_obj
+        return encode_obj
+
+    def _compile_decoder(self, type_name):
+        from pyon.core.registry import model_classes
+        clzz = model_classes.get(type_name, None)
+        if clzz is None or not issubclass(clzz, IonObjectBase):
+            # Not a known object type (marked True) - decode_ion resolves it (or fails) on every occurrence
+            decoder = True
+        else:
+            schema_keys = frozenset(clzz._schema)
+            decoder = (clzz, schema_keys, schema_keys | BUILT_IN_ATTRS)
+
+        self._decoders[type_name] = decoder
+        return decoder
+
+
+def copy_message(msg):
+    """
+    Returns a copy of a message as a receiver gets it via the broker, by msgpack encoding and decoding
+    it with the IonObject/numpy hooks. Isolates messages delivered within the container at lower CPU
+    cost than a deepcopy, with the same value types (e.g. tuples become lists) as remote delivery.
+    """
+    return msgpack.unpackb(msgpack.packb(msg, default=encode_ion),
+                           object_hook=decode_ion, ext_hook=decode_ion_ext, use_list=1)
+
+
 class EncodeInterceptor(Interceptor):
 
     def __init__(self):
         self.max_message_size = sys.maxint  # Will be set appropriately from interceptor config
+        self._encode_hook = encode_ion
+        self._decode_hook = decode_ion
+        self.lazy_decode = False
 
     def configure(self, config):
         self.max_message_size = get_safe(config, 'max_message_size', 20000000)
-        log.debug("EncodeInterceptor enabled")
+        codec = get_safe(config, 'codec', 'default')
+        numpy_ext = get_safe(config, 'numpy_ext', False) is True
+        if codec == 'schema':
+            schema_codec = SchemaCodec(numpy_ext=numpy_ext)
+            if get_obj_registry() is not None:
+                schema_codec.compile_all()
+            self._encode_hook = schema_codec.encode
+            self._decode_hook = schema_codec.decode
+        elif codec == 'default':
+            if numpy_ext:
+                self._encode_hook = encode_ion_ext
+        else:
+            raise BadRequest("Unknown EncodeInterceptor codec: %s" % codec)
+        self.lazy_decode = get_safe(config, 'lazy_decode', False) is True
+        log.debug("EncodeInterceptor enabled, codec=%s, numpy_ext=%s, lazy_decode=%s", codec, numpy_ext, self.lazy_decode)
 
     def outgoing(self, invocation):
         payload = invocation.message
@@ -168,7 +375,7 @@ class EncodeInterceptor(Interceptor):
 
         # Msgpack the content to binary str - does nested IonObject encoding
         try:
-            invocation.message = msgpack.packb(payload, default=encode_ion)
+            invocation.message = msgpack.packb(payload, default=self._encode_hook)
         except Exception:
             log.error("Illegal type in IonObject attributes: %s", payload)
             raise BadRequest("Illegal type in IonObject attributes")
@@ -181,16 +388,26 @@ class EncodeInterceptor(Interceptor):
 
         msg_size = len(invocation.message)
         if msg_size > self.max_message_size:
-            raise BadRequest('The message size %s is larger than the max_message_size value of %s' % (
-                msg_size, self.max_message_size))
+            # Messages sent in fragments have their own limit
+            chunked_size = get_chunked_message_size(invocation.headers)
+            if chunked_size is None or msg_size > chunked_size:
+                raise BadRequest('The message size %s is larger than the max_message_size value of %s' % (
+                    msg_size, chunked_size or self.max_message_size))
 
         return invocation
 
 
     def incoming(self, invocation):
         # Un-Msgpack the content from binary string - does IonObject decoding
-        invocation.message = msgpack.unpackb(invocation.message, object_hook=decode_ion, use_list=1)
+        if self.lazy_decode:
+            # Defer decoding until the endpoint consumes the message (after governance and expiry checks)
+            invocation.message = LazyPayload(invocation.message, self._unpack)
+        else:
+            invocation.message = self._unpack(invocation.message)
 
         # At this point there could be a recursive unicode treatment, if necessary
 
         return invocation
+
+    def _unpack(self, raw_msg):
+        return msgpack.unpackb(raw_msg, object_hook=self._decode_hook, ext_hook=decode_ion_ext, use_list=1)
@@ -100,6 +100,48 @@ class Invocation(object):
         return value.strip()
 
 
+class LazyPayload(object):
+    """
+    Message payload whose decoding is deferred until first accessed via materialize().
+    Allows consumers that only look at headers (governance, expiry checks, discarded replies)
+    to skip the decode cost. Post-decode functions receive and return the decoded payload.
+    """
+    __slots__ = ('raw', '_decode_func', '_post_decode', '_value', '_decoded')
+
+    def __init__(self, raw, decode_func):
+        self.raw = raw
+        self._decode_func = decode_func
+        self._post_decode = []
+        self._value = None
+        self._decoded = False
+
+    @property
+    def decoded(self):
+        return self._decoded
+
+    def add_post_decode(self, func):
+        if self._decoded:
+            self._value = func(self._value)
+        else:
+            self._post_decode.append(func)
+
+    def materialize(self):
+        if not self._decoded:
+            value = self._decode_func(self.raw)
+            for func in self._post_decode:
+                value = func(value)
+            self._value, self._decoded = value, True
+            self.raw = self._decode_func = self._post_decode = None
+        return self._value
+
+
+def materialize_payload(payload):
+    """Returns the decoded message payload, decoding a LazyPayload if necessary"""
+    if type(payload) is LazyPayload:
+        return payload.materialize()
+    return payload
+
+
 class Interceptor(object):
     """
     Basic interceptor model.
@@ -113,9 +155,32 @@ class Interceptor(object):
     def incoming(self, invocation):
         pass
 
+    def is_applicable(self, endpoint, path):
+        """
+        Returns False if this interceptor is a no-op for the given endpoint and path (incoming/outgoing).
+        Called once when an endpoint compiles its interceptor pipelines, not per message.
+        """
+        return True
+
 
 def process_interceptors(interceptors, invocation):
     for interceptor in interceptors:
         func = getattr(interceptor, invocation.path)
         invocation = func(invocation)
     return invocation
+
+
+def compile_interceptors(interceptors, path, endpoint=None):
+    """
+    Compiles an interceptor stack into a pipeline, a flat list of bound interceptor functions for the
+    given path, skipping interceptors that declare themselves not applicable to the endpoint.
+    """
+    return [getattr(interceptor, path) for interceptor in interceptors
+            if not hasattr(interceptor, "is_applicable") or interceptor.is_applicable(endpoint, path)]
+
+
+def process_pipeline(pipeline, invocation):
+    """ Runs an invocation through a pipeline compiled by compile_interceptors """
+    for func in pipeline:
+        invocation = func(invocation)
+    return invocation
@@ -3,12 +3,15 @@
 __author__ = 'Luke Campbell <lcampbell@asascience.com>'
 
 import unittest
+from mock import patch
 from nose.plugins.attrib import attr
 
+from pyon.core.bootstrap import CFG
 from pyon.util.unit_test import PyonTestCase
-from pyon.core.interceptor.encode import EncodeInterceptor
+from pyon.core.interceptor.encode import EncodeInterceptor, copy_message
+from pyon.core.interceptor.compress import CompressInterceptor
 from pyon.core.interceptor.validate import ValidateInterceptor
-from pyon.core.interceptor.interceptor import Invocation
+from pyon.core.interceptor.interceptor import Invocation, LazyPayload, materialize_payload, compile_interceptors, process_pipeline
 from pyon.public import IonObject, DotDict, BadRequest
 
 try:
@@ -62,6 +65,42 @@ class InterceptorTest(PyonTestCase):
         for d in c:
             self.assertTrue((a==d).all())
 
+    @unittest.skipIf(not _have_numpy, 'No numpy')
+    def test_numpy_ext(self):
+        for codec in ("default", "schema"):
+            encode = EncodeInterceptor()
+            encode.configure({"codec": codec, "numpy_ext": True})
+
+            packet_dt = np.dtype([("time", "i8"), ("temp", "f8"), ("name", "S8"), ("vec", "f4", (3,))])
+            packet_array = np.zeros(4, dtype=packet_dt)
+            packet_array["time"] = [1, 2, 3, 4]
+            packet_array["temp"] = [1.5, 2.5, 3.5, 4.5]
+            packet_array["name"] = "abc"
+            packet_array["vec"][1] = [1, 2, 3]
+
+            arrays = [np.array([90, 8010, 3, 14112, 3.14159265358979323846264], dtype='float32'),
+                      np.arange(24, dtype='>i4').reshape(2, 3, 4),
+                      np.arange(24, dtype='int16').reshape(4, 6)[:, ::2],     # Not contiguous
+                      np.array(5.5),
+                      np.zeros((0, 3), dtype='uint8'),
+                      packet_array]
+
+            invoke = Invocation()
+            invoke.message = {"arrays": arrays, "obj": IonObject("DataPacket", data={"data": packet_array})}
+            received = encode.incoming(encode.outgoing(invoke))
+            b = received.message
+
+            for a, d in zip(arrays, b["arrays"]):
+                self.assertEquals(a.dtype, d.dtype)
+                self.assertEquals(a.shape, d.shape)
+                self.assertTrue((a == d).all())
+            self.assertTrue((b["obj"].data["data"] == packet_array).all())
+            self.assertEquals(b["obj"].data["data"].dtype, packet_dt)
+
+            # Arrays are views on the unpacked ext data, not copies of it
+            self.assertFalse(b["arrays"][1].flags.owndata)
+            self.assertFalse(b["arrays"][1].flags.writeable)
+
     def test_set(self):
         a = {1,2}
         invoke = Invocation()
@@ -74,6 +113,19 @@ class InterceptorTest(PyonTestCase):
 
         self.assertEquals(a,b)
 
+    def test_copy_message(self):
+        obj = IonObject("Resource", name="res", alt_ids=["PRE:1"])
+        msg = {"obj": obj, "tuple": (1, 2), "set": {3}, "nested": [{"a": DotDict(b=1)}]}
+        msg_copy = copy_message(msg)
+
+        # Same values and types as received via the broker, no shared objects
+        self.assertEquals(msg_copy, {"obj": obj, "tuple": [1, 2], "set": {3}, "nested": [{"a": {"b": 1}}]})
+        self.assertIsNot(msg_copy["obj"], obj)
+        self.assertIsNot(msg_copy["obj"].alt_ids, obj.alt_ids)
+        self.assertIs(type(msg_copy["nested"][0]["a"]), dict)
+
+        self.assertRaises(TypeError, copy_message, {"obj": object()})
+
     def test_scalars(self):
         a = np.uint64(312)
         invoke = Invocation()
@@ -397,3 +449,174 @@ class InterceptorTest(PyonTestCase):
         self.assertEquals(msg_encoded1, msg_encoded2)
         self.assertIsInstance(msg_rec1["configuration"], dict)
         self.assertIsInstance(msg_rec2["configuration"], dict)
+
+    def test_schema_codec(self):
+        encode = EncodeInterceptor()
+        encode.configure({"codec": "schema"})
+        default_encode = EncodeInterceptor()
+
+        res_obj = IonObject("ActorIdentity", name="actor1", alt_ids=["PRE:1"], addl={"key": [1, 2]})
+        res_obj._id = "id1"
+        msg = {"objects": [res_obj, IonObject("Resource", name=u"res\u20ac")],
+               "set": {1, 2}, "slice": slice(1, 5, 2), "complex": complex(1, 2)}
+
+        invoke = Invocation()
+        invoke.message = msg
+        mangled = encode.outgoing(invoke)
+        schema_msg_encoded = mangled.message
+        received = encode.incoming(mangled)
+        b = received.message
+
+        # Wire format is identical to the default codec
+        invoke = Invocation()
+        invoke.message = msg
+        self.assertEquals(default_encode.outgoing(invoke).message, schema_msg_encoded)
+
+        self.assertEquals(b["set"], {1, 2})
+        self.assertEquals(b["slice"], slice(1, 5, 2))
+        self.assertEquals(b["complex"], complex(1, 2))
+        obj1, obj2 = b["objects"]
+        self.assertEquals(type(obj1).__name__, "ActorIdentity")
+        self.assertEquals(obj1, res_obj)
+        self.assertEquals(obj1._id, "id1")
+        self.assertEquals(obj1.addl, {"key": [1, 2]})
+        self.assertIsInstance(obj2.name, str)
+        self.assertEquals(obj2.name, u"res\u20ac".encode("utf8"))
+
+        # Object with missing fields gets defaults
+        invoke = Invocation()
+        invoke.message = {"type_": "Resource", "name": "partial"}
+        received = encode.incoming(encode.outgoing(invoke))
+        self.assertEquals(received.message.name, "partial")
+        self.assertEquals(received.message.lcstate, "DRAFT")
+
+        # Masked dicts are not decoded
+        invoke = Invocation()
+        invoke.message = {"type_": "Resource", "__noion__": True}
+        received = encode.incoming(encode.outgoing(invoke))
+        self.assertEquals(received.message, {"type_": "Resource"})
+
+        with self.assertRaises(BadRequest):
+            EncodeInterceptor().configure({"codec": "unknown"})
+
+    def test_compress(self):
+        encode = EncodeInterceptor()
+        compress = CompressInterceptor()
+        compress.configure({"mode": "always", "threshold": 1000})
+
+        stats = []
+        from pyon.core.interceptor import compress as compress_mod
+        compress_mod.set_compress_stats_callback(lambda action, st: stats.append((action, st)))
+        self.addCleanup(compress_mod.set_compress_stats_callback, None)
+
+        # Small messages are not compressed
+        invoke = Invocation()
+        invoke.message = {"key": "value"}
+        mangled = compress.outgoing(encode.outgoing(invoke))
+        self.assertNotIn("compression", mangled.headers)
+
+        large_msg = {"key": "value" * 1000, "obj": IonObject("Resource", name="res1")}
+        invoke = Invocation()
+        invoke.message = large_msg
+        mangled = compress.outgoing(encode.outgoing(invoke))
+        self.assertEquals(mangled.headers["compression"], "zlib")
+        self.assertLess(len(mangled.message), 1000)
+
+        receiver = CompressInterceptor()
+        receiver.configure({})
+        received = encode.incoming(receiver.incoming(mangled))
+        self.assertEquals(received.message, large_msg)
+        self.assertNotIn("compression", received.headers)
+
+        self.assertEquals([action for action, st in stats], ["compress", "decompress"])
+        self.assertGreater(stats[0][1]["ratio"], 10)
+
+        invoke = Invocation()
+        invoke.message = "data"
+        invoke.headers["compression"] = "unknown"
+        with self.assertRaises(BadRequest):
+            receiver.incoming(invoke)
+
+    def test_compress_negotiate(self):
+        client, server = CompressInterceptor(), CompressInterceptor()
+        client.configure({"mode": "negotiate", "threshold": 10})
+        server.configure({"mode": "negotiate", "threshold": 10})
+
+        # Request announces support
+        invoke = Invocation(message="x" * 100, headers={"performative": "request", "conv-id": "c1"})
+        request = client.outgoing(invoke)
+        self.assertIn("zlib", request.headers["accept-compression"])
+        self.assertNotIn("compression", request.headers)
+        server.incoming(request)
+
+        # Reply to announcing request is compressed
+        reply = server.outgoing(Invocation(message="y" * 100, headers={"performative": "inform-result", "conv-id": "c1"}))
+        self.assertEquals(reply.headers["compression"], "zlib")
+        self.assertEquals(client.incoming(reply).message, "y" * 100)
+
+        # Reply to a request without support is not compressed
+        server.incoming(Invocation(message="x" * 100, headers={"performative": "request", "conv-id": "c2"}))
+        reply = server.outgoing(Invocation(message="y" * 100, headers={"performative": "inform-result", "conv-id": "c2"}))
+        self.assertNotIn("compression", reply.headers)
+
+    def test_lazy_decode(self):
+        encode = EncodeInterceptor()
+        encode.configure({"lazy_decode": True})
+        validate_interceptor = ValidateInterceptor()
+        validate_interceptor.configure({"enabled": True})
+
+        obj = IonObject('Deco_Example', {"list1": [1], "list2": ["One element"], "dict1": {"key1": 1}, "dict2": {"key1": 1}, "us_phone_number": "555-555-5555"})
+        invoke = encode.outgoing(Invocation(message={"obj": obj, "val": 5}))
+        invoke.headers["raise-exception"] = True
+
+        received = validate_interceptor.incoming(encode.incoming(invoke))
+        self.assertIsInstance(received.message, LazyPayload)
+        self.assertFalse(received.message.decoded)
+
+        # Validation is deferred until the payload is decoded
+        with self.assertRaises(BadRequest):
+            materialize_payload(received.message)
+
+        obj.an_important_value = "good value"
+        invoke = encode.outgoing(Invocation(message={"obj": obj, "val": 5}))
+        received = validate_interceptor.incoming(encode.incoming(invoke))
+        payload = materialize_payload(received.message)
+        self.assertEquals(payload["val"], 5)
+        self.assertEquals(payload["obj"].an_important_value, "good value")
+        self.assertTrue(received.message.decoded)
+        self.assertIs(materialize_payload(received.message), payload)
+        self.assertIs(materialize_payload(payload), payload)
+
+    def test_compile_interceptors(self):
+        encode = EncodeInterceptor()
+        encode.configure({})
+        compress = CompressInterceptor()
+        compress.configure({"mode": "never"})
+        validate_interceptor = ValidateInterceptor()
+        validate_interceptor.configure({"enabled": True})
+
+        out_pipeline = compile_interceptors([validate_interceptor, encode, compress], Invocation.PATH_OUT)
+        self.assertEquals(out_pipeline, [encode.outgoing])
+        in_pipeline = compile_interceptors([compress, encode, validate_interceptor], Invocation.PATH_IN)
+        self.assertEquals(in_pipeline, [compress.incoming, encode.incoming, validate_interceptor.incoming])
+
+        invoke = process_pipeline(out_pipeline, Invocation(message={"val": 5}))
+        received = process_pipeline(in_pipeline, invoke)
+        self.assertEquals(received.message, {"val": 5})
+
+        validate_interceptor.enabled = False
+        self.assertEquals(compile_interceptors([validate_interceptor], Invocation.PATH_IN), [])
+
+    def test_max_message_size_chunked(self):
+        encode = EncodeInterceptor()
+        encode.configure({"max_message_size": 100})
+        big_msg = {"data": "x" * 200}
+        self.assertRaises(BadRequest, encode.outgoing, Invocation(message=big_msg, headers={"performative": "inform-result"}))
+
+        with patch.dict(CFG, {"container": {"messaging": {"chunking": {"enabled": True, "max_message_size": 1000}}}}):
+            invoke = encode.outgoing(Invocation(message=big_msg, headers={"performative": "inform-result"}))
+            self.assertGreater(len(invoke.message), 100)
+
+            # requests are not chunked, so the regular limit applies
+            self.assertRaises(BadRequest, encode.outgoing, Invocation(message=big_msg, headers={"performative": "request"}))
+            self.assertRaises(BadRequest, encode.outgoing, Invocation(message={"data": "x" * 2000}, headers={"performative": "inform-result"}))
@@ -330,6 +330,8 @@ class ObjectModelGenerator:
         '''
         Walk the data model definition yaml files.  Generate
         corresponding classes in the objects.py file.
+        Note: _validate is not generated here; pyon.core.object.generate_validator builds
+        each class' validator from its final _schema on first use.
         '''
 
         # Delimit the break between the enum classes and
@@ -461,6 +463,8 @@ class ObjectModelGenerator:
                     for init_line in init_lines:
                         self.dataobject_output_text += init_line
                 if len(current_class_schema) > 0:
+                    if opts.slots:
+                        self.dataobject_output_text += self._get_slots_line(field_details, super_class)
                     if schema_extended:
                         self.dataobject_output_text += current_class_schema + "\n              }.items())\n"
                     else:
@@ -510,6 +514,8 @@ class ObjectModelGenerator:
             for init_line in init_lines:
                 self.dataobject_output_text += init_line
         if len(current_class_schema) > 0:
+            if opts.slots:
+                self.dataobject_output_text += self._get_slots_line(field_details, super_class)
             if schema_extended:
                 self.dataobject_output_text += current_class_schema + "\n              }.items())\n"
             else:
@@ -677,6 +683,19 @@ class ObjectModelGenerator:
                 output[key] = self._associations[key]
         return output
 
+    def _get_slots_line(self, field_details, super_class):
+        """
+        Returns the __slots__ class attribute for a class with given own fields. Root classes
+        get slots for the built-in attributes, subclasses only for fields not in the base class.
+        """
+        if super_class == "IonObjectBase":
+            slots = ["type_", "_id", "_rev", "blame_"]
+        else:
+            slots = []
+        super_fields = self.class_args_dict.get(super_class, {}).get("fields", [])
+        slots.extend(fd[0] for fd in field_details if fd[0] not in super_fields and fd[0] not in slots)
+        return "\n    __slots__ = (" + "".join("'" + slot + "', " for slot in slots) + ")\n"
+
     # Determine if class is object or resource or event
     def _get_class_type(self, clzzname):
         while clzzname != "IonObjectBase":
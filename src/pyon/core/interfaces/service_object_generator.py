@@ -163,6 +163,11 @@ ${methods}
     def ${name}(${args}, headers=None, timeout=None):
         ${methoddocstring}
         return self.request(IonObject('${req_in_obj_name}', **{$req_in_obj_args}), op='${name}', headers=headers, timeout=timeout)
+
+    def ${name}_async(${args}, headers=None, timeout=None):
+        """Sends a ${name} request without waiting. Returns an AsyncResult for the response.
+        """
+        return self.request_async(IonObject('${req_in_obj_name}', **{$req_in_obj_args}), op='${name}', headers=headers, timeout=timeout)
 ''',
     'obj_arg': "'${name}': ${name} or ${default}",
     'obj_arg_no_def': "'${name}': ${name}",
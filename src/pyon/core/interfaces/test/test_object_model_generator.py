@@ -6,7 +6,7 @@ import os
 import sys
 import argparse
 
-from pyon.core.interfaces.object_model_generator import ObjectModelGenerator
+from pyon.core.interfaces.object_model_generator import ObjectModelGenerator, enums_by_name
 from pyon.util.containers import get_default_sysname
 from pyon.util.int_test import IonIntegrationTestCase
 from nose.plugins.attrib import attr
@@ -26,6 +26,9 @@ class ObjectModelGenerateTest(IonIntegrationTestCase):
         self.opts.objectdoc = True
         self.opts.read_from_yaml_file = True
         self.opts.dryrun = True
+        self.opts.slots = False
+        # Enum definitions are collected globally and must not be redefined
+        enums_by_name.clear()
 
         self.model_object = ObjectModelGenerator(system_name=self.opts.system_name, read_from_yaml_file=self.opts.read_from_yaml_file)
 
@@ -34,3 +37,23 @@ class ObjectModelGenerateTest(IonIntegrationTestCase):
             self.model_object.generate(self.opts)
         except:
             self.fail("object_model_generator failed")
+
+    def test_object_gen_slots(self):
+        self.opts.objectdoc = False
+        self.opts.slots = True
+        self.model_object.generate(self.opts)
+
+        objects_ns = {}
+        exec compile(self.model_object.dataobject_output_text, "objects.py", "exec") in objects_ns
+        res_cls, info_cls = objects_ns["Resource"], objects_ns["InformationResource"]
+        self.assertIn("type_", res_cls.__slots__)
+        self.assertIn("name", res_cls.__slots__)
+        self.assertNotIn("name", info_cls.__slots__)
+
+        res_obj = info_cls(name="slotted")
+        self.assertFalse(hasattr(res_obj, "__dict__"))
+        self.assertEqual(res_obj._get_fields()["name"], "slotted")
+        res_obj._id = "ID1"
+        self.assertEqual(res_obj._get_fields()["_id"], "ID1")
+        with self.assertRaises(AttributeError):
+            res_obj.not_a_field = 1
@@ -13,6 +13,9 @@ from pyon.core.exception import BadRequest
 
 BUILT_IN_ATTRS = {'_id', '_rev', 'type_', 'blame_'}
 
+# Key in the instance __dict__ of lazy IonObjects for the fields not yet deserialized
+LAZY_FIELDS_ATTR = "__lazy_fields__"
+
 # Validation decorators
 DECO_VALIDATE_REQUIRED = 'Required'
 DECO_VALIDATE_CONTENT_TYPE = 'ContentType'
@@ -25,15 +28,18 @@ class IonObjectBase(object):
     """
     Base class for all ION objects. This base class provides a common ancestor of all types
     that can be evaluated using isinstance. It also provides some helpers and schema validation.
-    An instance keeps all first level schema attributes inside the object's __dict__.
+    An instance keeps all first level schema attributes inside the object's __dict__, or in
+    __slots__ if the classes were generated with slots. Use _get_fields to access them as dict.
     The interface generator will create subclasses of this base class with additional fields,
     such as _schema, and _class_info and __init__ functions with subtype attributes.
     """
+    __slots__ = ()
     _schema = {}
     _class_info = {}
 
     def __str__(self):
-        ds = ", ".join("%s=%r" % (k, self.__dict__[k]) for k in sorted(self.__dict__.keys()) if k != "type_")
+        fields = self._get_fields()
+        ds = ", ".join("%s=%r" % (k, fields[k]) for k in sorted(fields.keys()) if k != "type_")
         return "%s(%s)" % (self.__class__.__name__, ds)
 
     def __repr__(self):
@@ -41,7 +47,7 @@ class IonObjectBase(object):
 
     def __eq__(self, other):
         if type(other) == type(self):
-            if other.__dict__ == self.__dict__:
+            if other._get_fields() == self._get_fields():
                 return True
         return False
 
@@ -57,12 +63,60 @@ class IonObjectBase(object):
     def has_key(self, key):
         return hasattr(self, key)
 
+    def _get_fields(self):
+        """
+        Returns the set attributes as dict. This is the instance __dict__, or a new dict if the
+        class uses __slots__, in which case changes to the dict do not change the object.
+        """
+        try:
+            return self.__dict__
+        except AttributeError:
+            fields = {}
+            for key in get_slot_names(type(self)):
+                value = getattr(self, key, _MISSING)
+                if value is not _MISSING:
+                    fields[key] = value
+            return fields
+
+    def _set_fields(self, fields):
+        """
+        Replaces the attributes with the given dict, without setattr validation.
+        """
+        try:
+            object.__setattr__(self, "__dict__", fields)
+        except AttributeError:
+            for key in get_slot_names(type(self)):
+                if key in fields:
+                    object.__setattr__(self, key, fields[key])
+                elif hasattr(self, key):
+                    object.__delattr__(self, key)
+
+    def __getstate__(self):
+        return self._get_fields()
+
+    def __setstate__(self, state):
+        try:
+            self.__dict__.update(state)
+        except AttributeError:
+            self._set_fields(state)
+
     def _validate(self, validate_objects=True):
         """
         Compare fields to the schema and raise AttributeError if mismatched.
         Named _validate instead of validate because the data may have a field named "validate".
+        Uses a validator function generated from the schema on first use of the class.
+        """
+        try:
+            validator = _validators[type(self)]
+        except KeyError:
+            validator = get_validator(type(self))
+        validator(self, validate_objects)
+
+    def _validate_generic(self, validate_objects=True):
         """
-        fields, schema = self.__dict__, self._schema
+        Same as _validate, but walks the schema on every call instead of using a generated validator.
+        """
+        fields, schema = self._get_fields(), self._schema
 
         # Check for extra fields not defined in the schema
         extra_fields = fields.viewkeys() - schema.viewkeys() - BUILT_IN_ATTRS
@@ -85,18 +139,21 @@ class IonObjectBase(object):
             schema_val_decos = schema_val.get('decorators', {})
 
             # Side effect - Correct any float or long types that got downgraded to int
-            if isinstance(fields[key], int):
+            field_val = fields[key]
+            if isinstance(field_val, int):
                 if schema_val_type == 'float':
-                    fields[key] = float(fields[key])
+                    field_val = float(field_val)
                 elif schema_val_type == 'long':
-                    fields[key] = long(fields[key])
+                    field_val = long(field_val)
 
             # Side effect - Work around for OrderedDict vs dict issue
-            if type(fields[key]) == dict and schema_val_type == 'OrderedDict':
-                fields[key] = OrderedDict(fields[key])
+            elif type(field_val) == dict and schema_val_type == 'OrderedDict':
+                field_val = OrderedDict(field_val)
+
+            if field_val is not fields[key]:
+                setattr(self, key, field_val)
 
             # Basic type checking
-            field_val = fields[key]
             field_val_type = type(field_val).__name__
             #log.debug("Validating %s: %s: %s: %s" % (key, schema_val_type, schema_val_decos, field_val))
 
@@ -105,56 +162,9 @@ class IonObjectBase(object):
                 pass
 
             elif field_val_type != schema_val_type:
-
-                # If the schema type is None, all types are allowed
-                if schema_val_type == 'NoneType':
-                    continue
-
-                # Allow unicode instead of str. This may be too lenient.
-                if schema_val_type == 'str' and field_val_type == 'unicode':
-                    continue
-
-                # Already checked for required above.  Assume optional and continue
-                if field_val is None:
-                    continue
-
-                # Allow unicode instead of str. This may be too lenient.
-                if schema_val_type == 'str' and field_val_type == 'unicode':
-                    continue
-
-                # IonObjects are ok for dict fields too!
-                if isinstance(field_val, IonObjectBase) and schema_val_type == 'OrderedDict':
-                    continue
-
-                # Check for inheritance
-                if self._check_inheritance_chain(type(field_val), schema_val_type):
-                    continue
-
-                # Check enum types
-                from pyon.core.registry import enum_classes
-                if isinstance(field_val, int) and schema_val_type in enum_classes:
-                    if field_val in enum_classes[schema_val_type]._str_map:
-                        continue
-                    raise AttributeError("Invalid enum value '%d' for field '%s.%s', should be between 1 and %d" %
-                            (fields[key], type(self).__name__, key, len(enum_classes(schema_val_type)._str_map)))
-
-                # Tuple allowed for list type (Msgpack decodes list to tuples)
-                if type(field_val) == tuple and schema_val_type == 'list':
-                    continue
-
-                # IonObject allowed for dict type
-                if isinstance(field_val, IonObjectBase) and schema_val_type == 'dict':
-                    #log.warn('Please convert generic dict attribute type to abstract type for field "%s.%s"' % (type(self).__name__, key))
-                    continue
-
-                # Special case check for ION object being passed where default type is dict or str
-                if DECO_VALIDATE_CONTENT_TYPE in schema_val_decos:
-                    if isinstance(field_val, IonObjectBase) and schema_val_type in ('dict', 'str'):
-                        self._check_content(key, field_val, schema_val_decos[DECO_VALIDATE_CONTENT_TYPE])
-                        continue
-
-                raise AttributeError("Invalid type '%s' for field '%s.%s', should be '%s'" %
-                        (field_val_type, type(self).__name__, key, schema_val_type))
+                # Either the value is acceptable without further checks or an error is raised
+                self._check_type_mismatch(key, field_val, schema_val_type, schema_val_decos)
+                continue
 
             if field_val_type == 'str' and DECO_VALIDATE_VALUE_PATTERN in schema_val_decos:
                 self._check_string_pattern_match(key, field_val, schema_val_decos[DECO_VALIDATE_VALUE_PATTERN])
@@ -190,6 +200,59 @@ class IonObjectBase(object):
                         if isinstance(subval, IonObjectBase):
                             subval._validate()
 
+    def _check_type_mismatch(self, key, field_val, schema_val_type, schema_val_decos):
+        """
+        Checks a field value whose type name differs from the schema type.
+        Returns if the value is acceptable as is and raises AttributeError otherwise.
+        """
+        field_val_type = type(field_val).__name__
+
+        # If the schema type is None, all types are allowed
+        if schema_val_type == 'NoneType':
+            return
+
+        # Allow unicode instead of str. This may be too lenient.
+        if schema_val_type == 'str' and field_val_type == 'unicode':
+            return
+
+        # Already checked for required above.  Assume optional and continue
+        if field_val is None:
+            return
+
+        # IonObjects are ok for dict fields too!
+        if isinstance(field_val, IonObjectBase) and schema_val_type == 'OrderedDict':
+            return
+
+        # Check for inheritance
+        if self._check_inheritance_chain(type(field_val), schema_val_type):
+            return
+
+        # Check enum types
+        from pyon.core.registry import enum_classes
+        if isinstance(field_val, int) and schema_val_type in enum_classes:
+            if field_val in enum_classes[schema_val_type]._str_map:
+                return
+            raise AttributeError("Invalid enum value '%d' for field '%s.%s', should be between 1 and %d" %
+                    (field_val, type(self).__name__, key, len(enum_classes[schema_val_type]._str_map)))
+
+        # Tuple allowed for list type (Msgpack decodes list to tuples)
+        if type(field_val) == tuple and schema_val_type == 'list':
+            return
+
+        # IonObject allowed for dict type
+        if isinstance(field_val, IonObjectBase) and schema_val_type == 'dict':
+            #log.warn('Please convert generic dict attribute type to abstract type for field "%s.%s"' % (type(self).__name__, key))
+            return
+
+        # Special case check for ION object being passed where default type is dict or str
+        if DECO_VALIDATE_CONTENT_TYPE in schema_val_decos:
+            if isinstance(field_val, IonObjectBase) and schema_val_type in ('dict', 'str'):
+                self._check_content(key, field_val, schema_val_decos[DECO_VALIDATE_CONTENT_TYPE])
+                return
+
+        raise AttributeError("Invalid type '%s' for field '%s.%s', should be '%s'" %
+                (field_val_type, type(self).__name__, key, schema_val_type))
+
     def _get_type(self):
         return self.__class__.__name__
 
@@ -203,12 +266,13 @@ class IonObjectBase(object):
         Method that allows self object attributes to be updated with other object.
         Other object must be of same type or super type.
         """
+        other_fields = other._get_fields()
         if type(other) != type(self):
             bases = inspect.getmro(self.__class__)
             if other.__class__ not in bases:
                 raise BadRequest("Object %s and %s do not have compatible types for update" % (type(self).__name__, type(other).__name__))
-        for key in other.__dict__:
-            setattr(self, key, other.__dict__[key])
+        for key in other_fields:
+            setattr(self, key, other_fields[key])
 
     # --- Decorator methods
 
@@ -322,6 +386,255 @@ class IonMessageObjectBase(IonObjectBase):
     pass
 
 
+class LazyIonObjectMixin(object):
+    """
+    Mixin for lazy IonObjects, as created by IonObjectDeserializer.deserialize_lazy.
+    Some fields are kept in persisted form (in the instance __dict__ under LAZY_FIELDS_ATTR) and
+    deserialized on first access. A lazy object is an instance of a subclass of its object class
+    with the same name (see get_lazy_class). It becomes an instance of the object class itself
+    once all fields are deserialized, which happens on access to all fields, comparison,
+    encoding, validation and copy.
+    """
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        # Only called for attributes not found, such as fields not yet deserialized
+        lazy_fields = self.__dict__.get(LAZY_FIELDS_ATTR, None)
+        if lazy_fields is None or name not in lazy_fields[1]:
+            raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+        transform, lazy_values = lazy_fields
+        value = self.__dict__[name] = transform(lazy_values.pop(name))
+        if not lazy_values:
+            self._materialize()
+        return value
+
+    def __setattr__(self, name, value):
+        lazy_fields = self.__dict__.get(LAZY_FIELDS_ATTR, None)
+        if lazy_fields is not None:
+            lazy_fields[1].pop(name, None)
+        self._object_class.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        lazy_fields = self.__dict__.get(LAZY_FIELDS_ATTR, None)
+        if lazy_fields is not None and name in lazy_fields[1]:
+            del lazy_fields[1][name]
+            return
+        self._object_class.__delattr__(self, name)
+
+    def __eq__(self, other):
+        self._materialize()
+        if isinstance(other, LazyIonObjectMixin):
+            other._materialize()
+        return self == other
+
+    def __reduce_ex__(self, protocol):
+        self._materialize()
+        return self.__reduce_ex__(protocol)
+
+    def _get_fields(self):
+        self._materialize()
+        return self._get_fields()
+
+    def _get_extends(self):
+        self._materialize()
+        return self._get_extends()
+
+    def _validate(self, validate_objects=True):
+        self._materialize()
+        return self._validate(validate_objects)
+
+    def _materialize(self):
+        """
+        Deserializes all remaining fields and makes this an instance of the object class.
+        """
+        fields = self.__dict__
+        lazy_fields = fields.pop(LAZY_FIELDS_ATTR, None)
+        if lazy_fields is not None:
+            transform, lazy_values = lazy_fields
+            for key, value in lazy_values.iteritems():
+                fields[key] = transform(value)
+        object.__setattr__(self, "__class__", self._object_class)
+
+
+_lazy_classes = {}      # IonObject class -> lazy subclass
+
+
+def get_lazy_class(cls):
+    """
+    Returns the lazy subclass of an IonObject class, creating it if it does not exist yet.
+    The object class must be the first base for a compatible instance layout, so the mixin
+    methods are set on the lazy class directly to take precedence.
+    """
+    lazy_cls = _lazy_classes.get(cls, None)
+    if lazy_cls is None:
+        cls_dict = dict(LazyIonObjectMixin.__dict__, __module__=cls.__module__, _object_class=cls)
+        lazy_cls = _lazy_classes[cls] = type(cls.__name__, (cls, LazyIonObjectMixin), cls_dict)
+    return lazy_cls
+
+
+# --- Generated validators
+
+_validators = {}        # IonObject class -> generated validator function
+_slot_names = {}        # IonObject class -> names of all its __slots__
+
+# Schema type names that are checked by exact type
+VALIDATE_TYPES = dict(str=str, unicode=unicode, int=int, long=long, float=float, bool=bool, list=list,
+                      dict=dict, tuple=tuple, set=set, OrderedDict=OrderedDict, NoneType=type(None))
+# Schema types whose values can't contain IonObjects
+VALIDATE_SCALAR_TYPES = {'str', 'unicode', 'int', 'long', 'float', 'bool', 'NoneType'}
+
+_MISSING = object()
+
+
+def get_slot_names(cls):
+    """
+    Returns the names of all __slots__ of a class and its base classes.
+    """
+    slot_names = _slot_names.get(cls, None)
+    if slot_names is None:
+        slot_names = []
+        for base_cls in reversed(cls.__mro__):
+            slots = base_cls.__dict__.get("__slots__", ())
+            slot_names.extend([slots] if isinstance(slots, basestring) else slots)
+        slot_names = _slot_names[cls] = tuple(slot_names)
+    return slot_names
+
+
+def get_validator(cls):
+    """
+    Returns the validator function for an IonObject class, generating it if it does not exist yet.
+    """
+    validator = _validators.get(cls, None)
+    if validator is None:
+        validator = _validators[cls] = generate_validator(cls)
+    return validator
+
+
+def generate_validator(cls):
+    """
+    Generates a validator function for an IonObject class from its schema. The function performs
+    the same checks and side effects as IonObjectBase._validate_generic with straight-line code per
+    field, with type checks, enum values, regular expressions, value ranges and content types
+    evaluated once here instead of on every call.
+    Validators are generated at runtime rather than emitted into interface/objects.py by
+    object_model_generator, so they need no interface regeneration, include inherited fields
+    and also cover IonObject classes not built by the generator.
+    """
+    from pyon.core.registry import enum_classes
+    schema = cls._schema
+    namespace = dict(VALIDATE_TYPES, _MISSING=_MISSING, _allowed=frozenset(schema) | BUILT_IN_ATTRS,
+                     _raise_extra_fields=_raise_extra_fields, _check_collection_types=_check_collection_types,
+                     _validate_children=_validate_children)
+    func_name = "_validate_%s" % cls.__name__
+    has_slots = not cls.__dictoffset__
+    lines = ["def %s(self, validate_objects=True):" % func_name,
+             "    fields = self._get_fields()" if has_slots else "    fields = self.__dict__",
+             "    if not _allowed.issuperset(fields):",
+             "        _raise_extra_fields(fields, _allowed)"]
+
+    for key in sorted(schema):
+        if DECO_VALIDATE_REQUIRED in schema[key].get('decorators', {}):
+            lines.append("    if fields.get(%r) is None:" % key)
+            lines.append("        raise AttributeError(%r)" % ("Value required for '%s'" % key))
+
+    for i, key in enumerate(sorted(schema)):
+        schema_type = schema[key]['type']
+        decos = schema[key].get('decorators', {})
+        namespace["_decos%s" % i] = decos
+        lines.append("    v = fields.get(%r, _MISSING)" % key)
+        lines.append("    if v is not _MISSING:")
+
+        # Side effects - Correct downgraded float and long types, OrderedDict vs dict
+        set_line = "            setattr(self, %r, v)" % key if has_slots else "            fields[%r] = v" % key
+        if schema_type in ('float', 'long'):
+            lines.append("        if isinstance(v, int):")
+            lines.append("            v = %s(v)" % schema_type)
+            lines.append(set_line)
+        elif schema_type == 'OrderedDict':
+            lines.append("        if type(v) is dict:")
+            lines.append("            v = OrderedDict(v)")
+            lines.append(set_line)
+
+        if schema_type == 'int':
+            lines.append("        if type(v) is int or type(v) is long:")
+        elif schema_type in VALIDATE_TYPES:
+            lines.append("        if type(v) is %s:" % schema_type)
+        elif schema_type in enum_classes:
+            namespace["_enum%s" % i] = frozenset(enum_classes[schema_type]._str_map)
+            lines.append("        if isinstance(v, int) and v in _enum%s:" % i)
+            lines.append("            pass")
+            lines.append("        elif type(v).__name__ == %r:" % schema_type)
+        else:
+            lines.append("        if type(v).__name__ == %r:" % schema_type)
+
+        checks = []
+        if schema_type == 'str' and DECO_VALIDATE_VALUE_PATTERN in decos:
+            namespace["_pattern%s" % i] = re.compile(decos[DECO_VALIDATE_VALUE_PATTERN])
+            checks.append("if not _pattern%s.match(v):" % i)
+            checks.append("    self._check_string_pattern_match(%r, v, _decos%s[%r])" % (key, i, DECO_VALIDATE_VALUE_PATTERN))
+
+        if schema_type in ('int', 'float', 'long') and DECO_VALIDATE_VALUE_RANGE in decos:
+            range_parts = decos[DECO_VALIDATE_VALUE_RANGE].split(',', 1)
+            namespace["_min%s" % i] = ast.literal_eval(range_parts[0].strip())
+            namespace["_max%s" % i] = ast.literal_eval(range_parts[-1].strip())
+            checks.append("if v < _min%s or v > _max%s:" % (i, i))
+            checks.append("    self._check_numeric_value_range(%r, v, _decos%s[%r])" % (key, i, DECO_VALIDATE_VALUE_RANGE))
+
+        if DECO_VALIDATE_CONTENT_TYPE in decos:
+            namespace["_content%s" % i] = frozenset(t.strip() for t in decos[DECO_VALIDATE_CONTENT_TYPE].split(','))
+            if schema_type == 'list':
+                checks.append("_check_collection_types(self, %r, v, _content%s, _decos%s[%r])" % (key, i, i, DECO_VALIDATE_CONTENT_TYPE))
+            elif schema_type in ('dict', 'OrderedDict'):
+                checks.append("_check_collection_types(self, %r, v.values(), _content%s, _decos%s[%r])" % (key, i, i, DECO_VALIDATE_CONTENT_TYPE))
+            else:
+                checks.append("if type(v).__name__ not in _content%s:" % i)
+                checks.append("    self._check_content(%r, v, _decos%s[%r])" % (key, i, DECO_VALIDATE_CONTENT_TYPE))
+
+        if DECO_VALIDATE_CONTENT_COUNT in decos and schema_type in ('list', 'dict', 'OrderedDict'):
+            count_parts = decos[DECO_VALIDATE_CONTENT_COUNT].split(',', 1)
+            namespace["_mincount%s" % i] = ast.literal_eval(count_parts[0].strip())
+            namespace["_maxcount%s" % i] = ast.literal_eval(count_parts[-1].strip())
+            checks.append("if len(v) < _mincount%s or len(v) > _maxcount%s:" % (i, i))
+            checks.append("    self._check_collection_length(%r, len(v), _decos%s[%r])" % (key, i, DECO_VALIDATE_CONTENT_COUNT))
+
+        if schema_type not in VALIDATE_SCALAR_TYPES and schema_type not in enum_classes:
+            checks.append("if validate_objects:")
+            checks.append("    _validate_children(v)")
+
+        lines.extend("            " + line for line in checks or ["pass"])
+        lines.append("        else:")
+        lines.append("            self._check_type_mismatch(%r, v, %r, _decos%s)" % (key, schema_type, i))
+
+    exec compile("\n".join(lines) + "\n", "<validator %s>" % cls.__name__, "exec") in namespace
+    return namespace[func_name]
+
+
+def _raise_extra_fields(fields, allowed):
+    raise AttributeError("Invalid field(s): %r" % (list(fields.viewkeys() - allowed)))
+
+
+def _check_collection_types(obj, key, values, type_names, content_types):
+    """ Checks the values of a collection, with the full type check only for values of other types """
+    for value in values:
+        if type(value).__name__ not in type_names:
+            obj._check_collection_content(key, [value], content_types)
+
+
+def _validate_children(field_val):
+    """ Validates an IonObject field value or the IonObjects in a first level collection """
+    if isinstance(field_val, IonObjectBase):
+        field_val._validate()
+    elif isinstance(field_val, Mapping):
+        for subkey in field_val:
+            subval = field_val[subkey]
+            if isinstance(subval, IonObjectBase):
+                subval._validate()
+    elif isinstance(field_val, Iterable):
+        for subval in field_val:
+            if isinstance(subval, IonObjectBase):
+                subval._validate()
+
+
 def walk(o, cb, modify_key_value='value'):
     """
     Utility method to do recursive walking of a possible iterable (incl dicts) and return a
@@ -344,7 +657,7 @@ def walk(o, cb, modify_key_value='value'):
         return [walk(x, cb, modify_key_value) for x in newo]
     elif isinstance(newo, IonObjectBase):
         # Special case for IonObjects
-        fields, set_fields = newo.__dict__, newo._schema
+        set_fields = newo._schema
 
         for fieldname in set_fields:
             fieldval = getattr(newo, fieldname)
@@ -389,7 +702,7 @@ class IonObjectSerializer(IonObjectSerializationBase):
         def _transform(obj):
 
             if isinstance(obj, IonObjectBase):
-                res = {k:v for k, v in obj.__dict__.iteritems() if k in obj._schema or k in BUILT_IN_ATTRS}
+                res = {k:v for k, v in obj._get_fields().iteritems() if k in obj._schema or k in BUILT_IN_ATTRS}
                 if not 'type_' in res:
                     res['type_'] = obj._get_type()
 
@@ -441,27 +754,51 @@ class IonObjectDeserializer(IonObjectSerializationBase):
             objc  = obj
             otype = objc['type_'].encode('ascii')   # Correct?
 
-            # don't supply a dict - we want the object to initialize with all its defaults intact,
-            # which preserves things like IonEnumObject and invokes the setattr behavior we want there.
-            ion_obj = self._obj_registry.new(otype)
-
             # get outdated attributes in data that are not defined in the current schema
-            extra_attributes = objc.viewkeys() - ion_obj._schema.viewkeys() - BUILT_IN_ATTRS
+            schema = self._obj_registry.get_schema(otype)
+            extra_attributes = objc.viewkeys() - schema.viewkeys() - BUILT_IN_ATTRS
             for extra in extra_attributes:
                 objc.pop(extra)
                 log.info('discard %s not in current schema' % extra)
 
-            for k, v in objc.iteritems():
-                # unicode translate to utf8
-                if isinstance(v, unicode):
-                    v = str(v.encode('utf8'))
-                if k != "type_":
-                    setattr(ion_obj, k, v)
+            # unicode translate to utf8. Missing fields get their defaults
+            fields = {k: str(v.encode('utf8')) if isinstance(v, unicode) else v for k, v in objc.iteritems()}
+            ion_obj = self._obj_registry.new_from_fields(otype, fields)
 
             return ion_obj
 
         return obj
 
+    def deserialize_lazy(self, obj):
+        """
+        Deserializes a persisted IonObject dict into a lazy IonObject (see LazyIonObjectMixin).
+        Fields with dict or list values are kept as persisted and deserialized on first access.
+        The given dict is not modified.
+        """
+        if not isinstance(obj, dict) or "type_" not in obj:
+            return self.deserialize(obj)
+
+        # Placeholders for lazy fields, so that no defaults are created for them
+        fields = {k: None if type(v) in (dict, list) else v for k, v in obj.iteritems()}
+        lazy_values = {k: v for k, v in obj.iteritems() if type(v) in (dict, list)}
+        ion_obj = self._transform(fields)
+        if not lazy_values:
+            return ion_obj
+        if not type(ion_obj).__dictoffset__:
+            # Classes generated with __slots__ can't keep persisted values
+            for key, value in lazy_values.iteritems():
+                if hasattr(ion_obj, key):
+                    setattr(ion_obj, key, self.deserialize(value))
+            return ion_obj
+
+        # Lazy fields not in the current schema were discarded
+        ion_fields = ion_obj.__dict__
+        lazy_values = {k: v for k, v in lazy_values.iteritems() if ion_fields.pop(k, _MISSING) is not _MISSING}
+        if lazy_values:
+            ion_fields[LAZY_FIELDS_ATTR] = (self.deserialize, lazy_values)
+            object.__setattr__(ion_obj, "__class__", get_lazy_class(type(ion_obj)))
+        return ion_obj
+
 
 class IonObjectBlameDeserializer(IonObjectDeserializer):
 
@@ -471,12 +808,7 @@ class IonObjectBlameDeserializer(IonObjectDeserializer):
             objc    = in_obj.copy()
             type    = objc['type_'].encode('ascii')
 
-            # don't supply a dict - we want the object to initialize with all its defaults intact,
-            # which preserves things like IonEnumObject and invokes the setattr behavior we want there.
-            ion_obj = self._obj_registry.new(type)
-            for k, v in objc.iteritems():
-                if k != "type_":
-                    setattr(ion_obj, k, v)
+            ion_obj = self._obj_registry.new_from_fields(type, objc)
 
             return ion_obj
 
@@ -4,9 +4,10 @@ __author__ = 'Adam Smith, Tom Lennan'
 
 import inspect
 from copy import deepcopy
+from types import NoneType
 
 from pyon.core.exception import NotFound
-from pyon.core.object import walk
+from pyon.core.object import walk, IonObjectBase, IonMessageObjectBase, BUILT_IN_ATTRS
 
 import interface.objects
 import interface.messages
@@ -117,6 +118,88 @@ def get_class_decorator_value(class_obj, decorator):
     return None
 
 
+# --- Generated object factories
+
+_factories = {}         # IonObject class -> (new function, load function, allowed keys) or None
+
+# Value types that are used without copy
+IMMUTABLE_TYPES = {str, unicode, int, long, float, bool, NoneType}
+
+
+def get_factory(cls):
+    """
+    Returns the factory functions for an IonObject class, generating them if they do not exist yet,
+    together with the allowed keys of the schema fields and built-in attributes.
+    Returns None for classes that are not generated object classes.
+    """
+    try:
+        return _factories[cls]
+    except KeyError:
+        factory = _factories[cls] = generate_factory(cls) if is_generated_class(cls) else None
+        return factory
+
+
+def is_generated_class(cls):
+    return issubclass(cls, IonObjectBase) and not issubclass(cls, IonMessageObjectBase) and \
+        cls.__module__ == interface.objects.__name__
+
+
+def generate_factory(cls):
+    """
+    Generates two functions that create an instance of a generated object class without calling
+    __init__. The new function takes the same keyword args as __init__ with the same semantics:
+    collection and object fields given as falsy value get the default. The load function takes
+    a dict with all values, including built-in attributes, that becomes the instance attributes
+    with defaults added for missing fields.
+    Collection defaults are created fresh for every instance, nested object defaults through the
+    factory of their class and only if the field is not given.
+    """
+    schema = cls._schema
+    namespace = dict(_new_obj=object.__new__, _setattr=object.__setattr__, _cls=cls, _deepcopy=deepcopy)
+    has_slots = not cls.__dictoffset__
+    args, field_lines = [], ["        'type_': %r," % cls.__name__]
+    load_lines = ["def _load_%s(values):" % cls.__name__,
+                  "    fields = values",
+                  "    fields['type_'] = %r" % cls.__name__]
+
+    for i, (key, schema_val) in enumerate(sorted(schema.iteritems())):
+        default = schema_val['default']
+        if not isinstance(default, (list, dict, tuple, IonObjectBase)):
+            # Same as the shared __init__ default value
+            namespace["_default%s" % i] = default
+            args.append("%s=_default%s" % (key, i))
+            field_lines.append("        %r: %s," % (key, key))
+            load_lines.append("    if %r not in fields:" % key)
+            load_lines.append("        fields[%r] = _default%s" % (key, i))
+            continue
+
+        default_factory = get_factory(type(default)) if isinstance(default, IonObjectBase) else None
+        if default_factory:
+            namespace["_new%s" % i] = default_factory[0]
+            default_expr = "_new%s()" % i
+        elif type(default) in (list, dict) and not default:
+            default_expr = "[]" if type(default) is list else "{}"
+        else:
+            namespace["_default%s" % i] = default
+            default_expr = "_deepcopy(_default%s)" % i
+        args.append("%s=None" % key)
+        field_lines.append("        %r: %s or %s," % (key, key, default_expr))
+        load_lines.append("    if %r not in fields:" % key)
+        load_lines.append("        fields[%r] = %s" % (key, default_expr))
+
+    # Named __init__ for the same TypeError messages on illegal args
+    new_lines = ["def __init__(%s):" % ", ".join(args),
+                 "    fields = {"] + field_lines + ["    }"]
+    for lines in (new_lines, load_lines):
+        lines.append("    obj = _new_obj(_cls)")
+        lines.append("    obj._set_fields(fields)" if has_slots else "    _setattr(obj, '__dict__', fields)")
+        lines.append("    return obj")
+
+    source = "\n".join(new_lines) + "\n\n" + "\n".join(load_lines) + "\n"
+    exec compile(source, "<factory %s>" % cls.__name__, "exec") in namespace
+    return namespace["__init__"], namespace["_load_%s" % cls.__name__], frozenset(schema) | BUILT_IN_ATTRS
+
+
 class IonObjectRegistry(object):
     """
     In memory registry for all ION object types and factory for creating new object instances.
@@ -136,6 +219,12 @@ class IonObjectRegistry(object):
         for name, clzz in classes:
             message_classes[name] = clzz
 
+        # Combined lookup with the same precedence as the individual dicts
+        self._classes = dict(enum_classes)
+        self._classes.update(message_classes)
+        self._classes.update(model_classes)
+        self._setattr_classes = set()
+
         from pyon.core.bootstrap import CFG
         self.validate_setattr = CFG.get_safe('container.objects.validate.setattr', False)
 
@@ -146,44 +235,90 @@ class IonObjectRegistry(object):
         @param _dict   A dict/DotDict/derivative with initial values
         @param kwargs  Additional initial values
         """
-        if _def in model_classes:
-            clzz = model_classes[_def]
-        elif _def in message_classes:
-            clzz = message_classes[_def]
-        elif _def in enum_classes:
-            clzz = enum_classes[_def]
-        else:
+        clzz = self._classes.get(_def, None)
+        if clzz is None:
             raise NotFound("No matching class found for name %s" % _def)
 
         # Conditionally override the __setattr__ method to include additional client side validation
-        if self.validate_setattr:
-            def validating_setattr(self, name, value):
-                from pyon.core.object import BUILT_IN_ATTRS
-                if name not in self._schema and name not in BUILT_IN_ATTRS:
-                    raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
-                self.__dict__[name] = value
-            setattrmethod = validating_setattr
-            setattr(clzz, "__setattr__", setattrmethod)
+        if self.validate_setattr and clzz not in self._setattr_classes:
+            self._set_validating_setattr(clzz)
+
+        factory = get_factory(clzz)
+        if factory is None:
+            if _dict:
+                # Traverse input parameters looking for dict values being passed in as
+                # the init values of complex types.  Instantiate new object and substitute
+                # into the argument dict.
+                tmpdict = deepcopy(_dict)
+
+                for key in tmpdict:
+                    if key in clzz._schema:
+                        if isinstance(tmpdict[key], dict) and clzz._schema[key]["type"] in model_classes:
+                            obj_param = self.new(clzz._schema[key]["type"], tmpdict[key])
+                            tmpdict[key] = obj_param
+                    else:
+                        raise AttributeError("'%s' object has no attribute '%s'" % (clzz.__name__, key))
+
+                # Apply dict values, then override with kwargs
+                keywordargs = tmpdict
+                keywordargs.update(kwargs)
+                obj = clzz(**keywordargs)
+            else:
+                obj = clzz(**kwargs)
+            return obj
 
         if _dict:
-            # Traverse input parameters looking for dict values being passed in as
-            # the init values of complex types.  Instantiate new object and substitute
-            # into the argument dict.
-            tmpdict = deepcopy(_dict)
-
-            for key in tmpdict:
-                if key in clzz._schema:
-                    if isinstance(tmpdict[key], dict) and clzz._schema[key]["type"] in model_classes:
-                        obj_param = self.new(clzz._schema[key]["type"], tmpdict[key])
-                        tmpdict[key] = obj_param
-                else:
+            # Copy given values that can be modified and instantiate nested objects given as dict
+            schema = clzz._schema
+            values = {}
+            for key, value in _dict.iteritems():
+                if key not in schema:
                     raise AttributeError("'%s' object has no attribute '%s'" % (clzz.__name__, key))
-
-            # Apply dict values, then override with kwargs
-            keywordargs = tmpdict
-            keywordargs.update(kwargs)
-            obj = clzz(**keywordargs)
-        else:
-            obj = clzz(**kwargs)
-
-        return obj
+                if type(value) not in IMMUTABLE_TYPES:
+                    if isinstance(value, dict) and schema[key]["type"] in model_classes:
+                        value = self.new(schema[key]["type"], value)
+                    else:
+                        value = deepcopy(value)
+                values[key] = value
+            values.update(kwargs)
+            return factory[0](**values)
+
+        return factory[0](**kwargs)
+
+    def new_from_fields(self, _def, fields):
+        """Instantiates an IonObject based on given object type name with all given field values,
+        such as decoded or persisted values. In contrast to new(), built-in attributes are set and
+        given values are used as is, and only missing fields get their defaults.
+        @param _def    Name of object type
+        @param fields  A dict with attribute values. Becomes the instance attributes if possible
+        """
+        clzz = self._classes.get(_def, None)
+        factory = get_factory(clzz) if clzz is not None else None
+        if factory:
+            # Extra fields can only be kept in the instance __dict__ without setattr validation
+            if factory[2].issuperset(fields) or (clzz.__dictoffset__ and not self.validate_setattr):
+                if self.validate_setattr and clzz not in self._setattr_classes:
+                    self._set_validating_setattr(clzz)
+                return factory[1](fields)
+
+        # Not a generated object class, or extra fields that need setattr semantics
+        ion_obj = self.new(_def)
+        for key, value in fields.iteritems():
+            if key != "type_":
+                setattr(ion_obj, key, value)
+        return ion_obj
+
+    def get_schema(self, _def):
+        """Returns the schema of an object type"""
+        clzz = self._classes.get(_def, None)
+        if clzz is None:
+            raise NotFound("No matching class found for name %s" % _def)
+        return clzz._schema
+
+    def _set_validating_setattr(self, clzz):
+        def validating_setattr(self, name, value):
+            if name not in self._schema and name not in BUILT_IN_ATTRS:
+                raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+            object.__setattr__(self, name, value)
+        setattr(clzz, "__setattr__", validating_setattr)
+        self._setattr_classes.add(clzz)
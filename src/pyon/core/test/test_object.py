@@ -24,6 +24,49 @@ class ObjectTest(IonIntegrationTestCase):
         self.assertEqual(obj.name, '')
         self.assertEqual(obj.time, "1341269890404")
 
+    def test_new_factory(self):
+        from pyon.core.registry import model_classes, get_factory
+
+        # Generated factories create the same objects as the generated __init__
+        for type_name, clzz in model_classes.iteritems():
+            factory = get_factory(clzz)
+            if factory is None:
+                continue
+            for obj in (factory[0](), factory[1]({}), self.registry.new(type_name)):
+                self.assertEqual(obj, clzz())
+                self.assertEqual({k: type(v) for k, v in obj._get_fields().iteritems()},
+                                 {k: type(v) for k, v in clzz()._get_fields().iteritems()})
+
+        obj1, obj2 = self.registry.new('ResourceContainer'), self.registry.new('ResourceContainer')
+        self.assertIsNot(obj1.resource, obj2.resource)
+        self.assertIsNot(obj1.lcstate_transitions, obj2.lcstate_transitions)
+
+        init_dict = dict(name="Res", alt_ids=["PRE:1"], addl=dict(key=["value"]))
+        obj = self.registry.new('Resource', init_dict, description="Desc")
+        self.assertEqual(obj.name, "Res")
+        self.assertEqual(obj.description, "Desc")
+        obj.addl["key"].append("other")
+        self.assertEqual(init_dict["addl"], dict(key=["value"]))
+        self.assertEqual(self.registry.new('Resource', alt_ids=None).alt_ids, [])
+
+        obj = self.registry.new('ResourceContainer', dict(resource=dict(name="Nested")))
+        self.assertEqual(type(obj.resource), model_classes['Resource'])
+        self.assertEqual(obj.resource.name, "Nested")
+
+        self.assertRaises(AttributeError, self.registry.new, 'Resource', dict(extra_field=5))
+        self.assertRaises(TypeError, self.registry.new, 'Resource', extra_field=5)
+
+        # Load from decoded or persisted fields: values as is, defaults for missing fields
+        obj = self.registry.new_from_fields('ResourceContainer', dict(type_=u'ResourceContainer', _id="ID1", resource=None))
+        self.assertEqual(obj.type_, 'ResourceContainer')
+        self.assertEqual(obj._id, "ID1")
+        self.assertIsNone(obj.resource)
+        self.assertEqual(obj.lcstate_transitions, {})
+
+        # setattr validation is enabled in this test
+        with self.assertRaises(AttributeError):
+            self.registry.new_from_fields('Resource', dict(type_='Resource', extra_field=5))
+
     def test_validate(self):
         obj = self.registry.new('SampleObject')
         self.name = 'monkey'
@@ -64,6 +107,129 @@ class ObjectTest(IonIntegrationTestCase):
         msg_obj.object = IonObject("Association")
         self.assertRaises(AttributeError, msg_obj._validate)
 
+    def test_generated_validator(self):
+        from collections import OrderedDict
+        from pyon.core.object import IonObjectBase, get_validator
+
+        class ValidateObject(IonObjectBase):
+            _schema = {
+                'name': {'type': 'str', 'default': '', 'decorators': {'Required': ''}},
+                'code': {'type': 'str', 'default': 'CTD', 'decorators': {'ValuePattern': '(^(CAM|CO2|CTD)$)'}},
+                'port': {'type': 'int', 'default': 0, 'decorators': {'ValueRange': '0,65535'}},
+                'ratio': {'type': 'float', 'default': 2.0, 'decorators': {'ValueRange': '1.234,5.0'}},
+                'big': {'type': 'long', 'default': 0L, 'decorators': {}},
+                'day': {'type': 'SampleEnum', 'default': 1, 'decorators': {}},
+                'any_val': {'type': 'NoneType', 'default': None, 'decorators': {}},
+                'values': {'type': 'list', 'default': [1], 'decorators': {'ContentType': 'int,float', 'ContentCount': '1,2'}},
+                'attrs': {'type': 'OrderedDict', 'default': OrderedDict(), 'decorators': {'ContentType': 'str'}},
+                'addl': {'type': 'dict', 'default': {}, 'decorators': {}},
+                'content': {'type': 'str', 'default': '', 'decorators': {'ContentType': 'str, Resource'}},
+                'resource': {'type': 'InformationResource', 'default': None, 'decorators': {}},
+            }
+
+            def __init__(self):
+                for key, field in self._schema.iteritems():
+                    setattr(self, key, field['default'])
+
+        validator = get_validator(ValidateObject)
+        self.assertIs(get_validator(ValidateObject), validator)
+
+        cases = [('name', 'monkey'), ('name', u'monkey'), ('name', None), ('name', 3),
+                 ('code', 'CO2'), ('code', 'XYZ'), ('code', u'XYZ'),
+                 ('port', 80), ('port', 80L), ('port', -1), ('port', 70000L), ('port', True), ('port', 1.5),
+                 ('ratio', 3), ('ratio', 4.5), ('ratio', 6), ('ratio', 0.5), ('ratio', '3'),
+                 ('big', 5), ('big', 5L), ('big', 5.0),
+                 ('day', 3), ('day', 8), ('day', 3L), ('day', 3.0), ('day', None), ('day', True),
+                 ('any_val', None), ('any_val', 'x'), ('any_val', [1]),
+                 ('values', [1, 2.0]), ('values', []), ('values', [1, 2, 3]), ('values', [1, 'x']), ('values', (1, 'x')),
+                 ('values', [True]), ('values', 'abc'),
+                 ('attrs', {'a': 'b'}), ('attrs', {'a': 1}), ('attrs', OrderedDict(a='b')), ('attrs', IonObject('Resource')),
+                 ('addl', {'a': IonObject('Resource', name='x')}), ('addl', {'a': IonObject('Resource', name=5)}),
+                 ('addl', IonObject('Resource')), ('addl', [IonObject('Resource', name=5)]),
+                 ('content', 'x'), ('content', IonObject('Resource')), ('content', IonObject('InformationResource')),
+                 ('content', IonObject('Association')), ('content', 5),
+                 ('resource', IonObject('InformationResource')), ('resource', IonObject('TestInstrument')),
+                 ('resource', IonObject('InformationResource', name=5)), ('resource', IonObject('Resource')),
+                 ('resource', {}), ('extra_field', 5), ('_id', 'abc')]
+
+        for key, value in cases:
+            results = []
+            for validate_func in (ValidateObject._validate_generic, ValidateObject._validate):
+                obj = ValidateObject()
+                obj.__dict__[key] = value
+                try:
+                    validate_func(obj)
+                    results.append((None, obj.__dict__))
+                except AttributeError as ae:
+                    results.append((str(ae), obj.__dict__))
+            self.assertEqual(results[0], results[1], "Different result for %s=%r: %s" % (key, value, results))
+
+        obj = ValidateObject()
+        obj.ratio = 3
+        obj.big = 5
+        obj.attrs = {'a': 'b'}
+        obj._validate()
+        self.assertEqual(type(obj.ratio), float)
+        self.assertEqual(type(obj.big), long)
+        self.assertEqual(type(obj.attrs), OrderedDict)
+
+        obj = ValidateObject()
+        obj.addl = {'a': IonObject('Resource', name=5)}
+        obj._validate(validate_objects=False)
+        self.assertRaises(AttributeError, obj._validate)
+
+    def test_deserialize_lazy(self):
+        import copy
+        from pyon.core.object import IonObjectSerializer, IonObjectDeserializer, LAZY_FIELDS_ATTR
+        from pyon.core.interceptor.encode import encode_ion
+        from pyon.core.registry import model_classes
+        serializer, deserializer = IonObjectSerializer(), IonObjectDeserializer(obj_registry=self.registry)
+
+        res_obj = IonObject("ExtendedResource", dict(resource=dict(name="Res", addl=dict(child=IonObject("Resource")))),
+                            _id="ID1", policies=["POL1"])
+        res_doc = serializer.serialize(res_obj)
+        res_doc["old_field"] = dict(key="value")
+        orig_doc = copy.deepcopy(res_doc)
+
+        lazy_obj = deserializer.deserialize_lazy(res_doc)
+        self.assertEqual(res_doc, orig_doc)
+        self.assertIsInstance(lazy_obj, model_classes["ExtendedResource"])
+        self.assertEqual(lazy_obj.type_, "ExtendedResource")
+        self.assertEqual(lazy_obj._get_type(), "ExtendedResource")
+        self.assertEqual(lazy_obj._id, "ID1")
+        self.assertIn("resource", lazy_obj.__dict__[LAZY_FIELDS_ATTR][1])
+        self.assertFalse(hasattr(lazy_obj, "old_field"))
+
+        # Fields are deserialized on first access
+        self.assertEqual(type(lazy_obj.resource), model_classes["Resource"])
+        self.assertEqual(type(lazy_obj.resource.addl["child"]), model_classes["Resource"])
+        self.assertNotIn("resource", lazy_obj.__dict__[LAZY_FIELDS_ATTR][1])
+        self.assertEqual(lazy_obj, res_obj)
+        self.assertIs(type(lazy_obj), model_classes["ExtendedResource"])
+
+        lazy_obj = deserializer.deserialize_lazy(orig_doc)
+        self.assertEqual(res_obj, lazy_obj)
+        self.assertIs(type(lazy_obj), model_classes["ExtendedResource"])
+
+        lazy_obj = deserializer.deserialize_lazy(orig_doc)
+        self.assertEqual(encode_ion(lazy_obj), encode_ion(res_obj))
+        lazy_obj = deserializer.deserialize_lazy(orig_doc)
+        self.assertEqual(copy.deepcopy(lazy_obj), res_obj)
+        self.assertIs(type(copy.deepcopy(lazy_obj)), model_classes["ExtendedResource"])
+        lazy_obj = deserializer.deserialize_lazy(orig_doc)
+        lazy_obj._validate()
+        self.assertIs(type(lazy_obj), model_classes["ExtendedResource"])
+
+        # Set fields are not overwritten by deserialization
+        lazy_obj = deserializer.deserialize_lazy(orig_doc)
+        lazy_obj.policies = ["POL2"]
+        self.assertEqual(lazy_obj._get_fields()["policies"], ["POL2"])
+
+        # setattr validation is enabled in this test
+        lazy_obj = deserializer.deserialize_lazy(orig_doc)
+        with self.assertRaises(AttributeError):
+            lazy_obj.extra_field = 5
+
     def test_bootstrap(self):
         """ Use the factory and singleton from bootstrap.py/public.py """
         obj = IonObject('SampleObject')
@@ -185,6 +185,78 @@ class ObjectPerfTest(IonUnitTestCase):
         with time_it("recursive_utf8encode1"):
             recursive_encode1(o2)
 
+    def test_validate(self):
+        objs = []
+        for i in xrange(1000):
+            res_obj = IonObject("InformationResource", name="TestObject %s" % i, description="Test object",
+                                addl={"key%s" % j: str(j) for j in xrange(5)})
+            sample_obj = IonObject("SampleObject", name="Sample %s" % i, an_int=i, q_float=i,
+                                   a_list=[IonObject("Resource", name="Child")], abstract_val=res_obj)
+            objs.extend([res_obj, sample_obj])
+
+        # First call generates the validators
+        for obj in objs[:2]:
+            obj._validate()
+
+        for i in xrange(3):
+            t1 = time.time()
+            for obj in objs:
+                obj._validate_generic()
+            t2 = time.time()
+            for obj in objs:
+                obj._validate()
+            t3 = time.time()
+            log.info("Validate %s objects: generic=%1.7f, generated=%1.7f (%1.1fx)",
+                     len(objs), t2-t1, t3-t2, (t2-t1) / max(t3-t2, 1e-6))
+
+    def test_new(self):
+        from pyon.core.bootstrap import get_obj_registry
+        from pyon.core.interceptor.encode import decode_ion
+        obj_registry = get_obj_registry()
+        res_dict = dict(type_="ExtendedResource", _id="ID1", ts_created="1341269890404", computed=None,
+                        resource=IonObject("InformationResource", name="Res", alt_ids=["PRE:1"]))
+
+        with time_it("IonObject 10k, kwargs"):
+            for i in xrange(10000):
+                IonObject("InformationResource", name="TestObject %s" % i, description="Test object")
+        with time_it("IonObject 10k, dict"):
+            for i in xrange(10000):
+                IonObject("ExtendedResource", dict(resource=dict(name="TestObject %s" % i)))
+        with time_it("new_from_fields 10k"):
+            for i in xrange(10000):
+                obj_registry.new_from_fields("ExtendedResource", dict(res_dict))
+        with time_it("decode_ion 10k"):
+            for i in xrange(10000):
+                decode_ion(dict(res_dict))
+
+    def test_slots_memory(self):
+        import sys
+        from interface.objects import Resource
+        from pyon.core.object import BUILT_IN_ATTRS
+
+        # Same class as generated with object_model_generator --slots
+        SlotsResource = type("Resource", (IonObjectBase,), dict(
+            __slots__=tuple(BUILT_IN_ATTRS) + tuple(Resource._schema),
+            __init__=Resource.__dict__["__init__"], _schema=Resource._schema, _class_info=Resource._class_info))
+
+        def get_size(obj):
+            return sys.getsizeof(obj) + (sys.getsizeof(obj.__dict__) if hasattr(obj, "__dict__") else 0)
+
+        sizes = {}
+        for clzz in (Resource, SlotsResource):
+            with time_it("create 100k %s" % ("slots" if clzz is SlotsResource else "dict")):
+                res_list = [clzz(name="TestObject %s" % i) for i in xrange(100000)]
+            for i, res_obj in enumerate(res_list):
+                res_obj._id = "ID%s" % i
+            sizes[clzz] = sum(get_size(res_obj) for res_obj in res_list)
+            res_obj._validate()
+            del res_list
+
+        log.info("Instance memory for 100k resources: dict=%s, slots=%s bytes (%1.1fx)",
+                 sizes[Resource], sizes[SlotsResource], float(sizes[Resource]) / sizes[SlotsResource])
+        self.assertLess(sizes[SlotsResource], sizes[Resource])
+
+
 def count_objs(obj):
     counters = {}
     def _count(obj):
@@ -221,6 +293,9 @@ class MessagingPerfTest(IonUnitTestCase):
             with time_it(name + ", deserialize"):
                 os2 = _io_deserializer.deserialize(os)
 
+            with time_it(name + ", deserialize_lazy"):
+                os2 = _io_deserializer.deserialize_lazy(os)
+
             count_objs(os)
 
             if has_ion:
@@ -303,6 +378,19 @@ class MessagingPerfTest(IonUnitTestCase):
 
         count_objs(invocation.message)
 
+        schema_encode = EncodeInterceptor()
+        schema_encode.configure({"codec": "schema"})
+        invocation = Invocation()
+        invocation.message = test_obj1
+
+        with time_it("ion object, schema codec encode"):
+            schema_encode.outgoing(invocation)
+
+        with time_it("ion object, schema codec decode"):
+            schema_encode.incoming(invocation)
+
+        self.assertEquals(invocation.message, test_obj1)
+
         # ION
         with time_it("create ion unicode"):
             test_obj1 = create_test_object(2, 200, do_ion=True, do_list=False, do_dict=True, obj_validate=False, uvals=True, ukeys=True)
@@ -8,9 +8,6 @@ import contextlib
 import getpass
 import os.path
 from uuid import uuid4
-# Note: standard json is faster than simplejson for dumps
-# See https://confluence.oceanobservatories.org/display/CIDev/Container+Messaging+Performance
-import json
 
 try:
     import psycopg2
@@ -25,6 +22,7 @@ from pyon.core.exception import BadRequest, Conflict, NotFound, Inconsistent
 from pyon.datastore.datastore_common import DataStore, get_obj_geospatial_bounds, get_obj_geospatial_point, \
     get_obj_temporal_bounds, get_obj_vertical_bounds, get_obj_geometry
 from pyon.datastore.datastore_query import DQ
+from pyon.datastore.postgresql.pg_json import create_json_typecasters, get_json_codec
 from pyon.datastore.postgresql.pg_util import PostgresConnectionPool, StatementBuilder, psycopg2_connect, TracingCursor
 from pyon.util.containers import create_basic_identifier
 from pyon.util.tracer import CallTracer
@@ -92,6 +90,15 @@ class PostgresDataStore(DataStore):
         self._call_tracer = DBCallTracer(scope="DB." + (self.datastore_name or "_"))
         self.cursor_args = dict(cursor_factory=TracingCursor, tracer=self._call_tracer)
 
+        # JSON codec of the container, unless this datastore is configured with a different one,
+        # whose typecasters are registered for the datastore's cursors only
+        self.json_codec = get_json_codec()
+        if self.config.get('json_codec', None):
+            json_codec = get_json_codec(self.config['json_codec'])
+            if json_codec is not self.json_codec:
+                self.json_codec = json_codec
+                self.cursor_args["json_typecasters"] = create_json_typecasters(json_codec)
+
         # Make sure database exists and set connection
         dsn = "host=%s port=%s dbname=%s user=%s password=%s connect_timeout=5 application_name=%s" % (
             self.host, self.port, self.database, self.username, self.password, "%s:%s" % ("ion", self.datastore_name))
@@ -481,7 +488,7 @@ class PostgresDataStore(DataStore):
                     doc["_id"] = object_id
 
                 doc["_rev"] = "1"
-                doc_json = json.dumps(doc)
+                doc_json = self.json_codec.dumps(doc)
 
                 extra_cols, table = self._get_extra_cols(doc, qual_ds_name, self.profile)
 
@@ -549,7 +556,7 @@ class PostgresDataStore(DataStore):
                         doc["_id"] = object_id
 
                     doc["_rev"] = "1"
-                    doc_json = json.dumps(doc)
+                    doc_json = self.json_codec.dumps(doc)
 
                     if i>0:
                         sb.append(",")
@@ -644,7 +651,7 @@ class PostgresDataStore(DataStore):
     def _update_doc(self, cur, table, doc):
         old_rev = int(doc["_rev"])
         doc["_rev"] = str(old_rev+1)
-        doc_json = json.dumps(doc)
+        doc_json = self.json_codec.dumps(doc)
 
         extra_cols, table = self._get_extra_cols(doc, table, self.profile)
 
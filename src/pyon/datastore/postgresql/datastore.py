@@ -34,6 +34,8 @@ class PostgresPyonDataStore(PostgresDataStore):
         # IonObject Serializers
         self._io_serializer = IonObjectSerializer()
         self._io_deserializer = IonObjectDeserializer(obj_registry=get_obj_registry())
+        # Read objects deserialize nested fields on first access
+        self.lazy_objects = CFG.get_safe("container.datastore.lazy_objects", False) is True
 
     # -------------------------------------------------------------------------
     # Couch document operations
@@ -786,5 +788,7 @@ class PostgresPyonDataStore(PostgresDataStore):
         if obj_dict is None:
             return None
 
+        if self.lazy_objects:
+            return self._io_deserializer.deserialize_lazy(obj_dict)
         ion_object = self._io_deserializer.deserialize(obj_dict)
         return ion_object
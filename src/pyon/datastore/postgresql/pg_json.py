@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+""" Pluggable JSON codec for the PostgreSQL datastore (document serialization and psycopg2 read typecasters) """
+
+# Note: standard json is faster than simplejson for dumps, simplejson is faster for loads
+# and returns str instead of unicode for ASCII strings, which Pyon relies on.
+import json
+import simplejson
+
+from putil.logging import log
+
+from pyon.core.bootstrap import CFG
+
+AUTO_CODEC = "auto"
+DEFAULT_CODEC = "default"
+
+
+def _load_default():
+    return json.dumps, simplejson.loads
+
+def _load_simplejson():
+    return simplejson.dumps, simplejson.loads
+
+def _load_ujson():
+    import ujson
+    return ujson.dumps, ujson.loads
+
+# Known codec backends by name. Loaders raise ImportError if the library is not present
+JSON_CODEC_LOADERS = {
+    DEFAULT_CODEC: _load_default,
+    "simplejson": _load_simplejson,
+    "ujson": _load_ujson,
+}
+
+# Backends tried in auto mode, fastest first. Must end with the reference codec
+AUTO_CODEC_ORDER = ["ujson", DEFAULT_CODEC]
+
+# Documents used to check that a backend is byte-for-byte compatible with the reference codec
+PROBE_DOCS = [
+    {"_id": "4d1a8f6c2b7e4e3f9a0b", "_rev": "1", "type_": "Resource", "name": "probe", "description": "",
+     "ts_created": "1400000000000", "lcstate": "DEPLOYED", "addl": {}, "alt_ids": ["PRE:probe"]},
+    {"int": 1, "neg": -42, "long": 2**70, "float": 1.1, "sum": 0.1 + 0.2, "big": 1e100, "small": 1e-7,
+     "whole": 3.0, "true": True, "false": False, "none": None, "list": [], "nested": {"a": [{"b": [[]]}]}},
+    {"slash": "a/b", "quote": 'say "hi"', "backslash": "c:\\dir", "ctrl": "tab\tnl\ncr\rnul\x00",
+     "utf8": "caf\xc3\xa9", "unicode": u"caf\u00e9 \u2603", "astral": u"\U0001f600", "empty": ""},
+    [1, "two", 3.5, None, [True, False], {"k": "v"}],
+    "string",
+    u"unicode \u00fc",
+    12345,
+    -0.5,
+    None,
+]
+
+
+class JsonCodec(object):
+    """ A pair of JSON dumps and loads functions used for datastore documents """
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __str__(self):
+        return "JsonCodec(%s)" % self.name
+
+
+def _typed(value):
+    """ Returns a comparable structure that distinguishes types (e.g. str vs unicode, int vs float) """
+    if isinstance(value, dict):
+        return dict, sorted((_typed(k), _typed(v)) for k, v in value.iteritems())
+    elif isinstance(value, (list, tuple)):
+        return type(value), [_typed(v) for v in value]
+    elif type(value) is long:
+        return int, value
+    return type(value), value
+
+
+def is_dumps_compatible(dumps, ref_dumps=json.dumps, probe_docs=None):
+    """ Returns True if dumps produces the same bytes as the reference for all probe documents """
+    try:
+        for doc in probe_docs or PROBE_DOCS:
+            ref_json = ref_dumps(doc)
+            doc_json = dumps(doc)
+            if type(doc_json) is not type(ref_json) or doc_json != ref_json:
+                return False
+    except Exception:
+        return False
+    return True
+
+
+def is_loads_compatible(loads, ref_loads=simplejson.loads, ref_dumps=json.dumps, probe_docs=None):
+    """ Returns True if loads produces the same values and types as the reference for all probe documents """
+    try:
+        for doc in probe_docs or PROBE_DOCS:
+            doc_json = ref_dumps(doc)
+            if _typed(loads(doc_json)) != _typed(ref_loads(doc_json)):
+                return False
+    except Exception:
+        return False
+    return True
+
+
+def load_json_codec(name):
+    """ Returns the JsonCodec for a named backend. Raises ImportError if not available """
+    if name not in JSON_CODEC_LOADERS:
+        raise ValueError("Unknown JSON codec: %s" % name)
+    dumps, loads = JSON_CODEC_LOADERS[name]()
+    return JsonCodec(name, dumps, loads)
+
+
+def create_json_codec(name=AUTO_CODEC):
+    """
+    Returns a JsonCodec. In auto mode, picks the first available backend per direction (dumps, loads)
+    that is compatible with the reference codec. A named backend is used as is, even if not compatible.
+    """
+    if name and name != AUTO_CODEC:
+        codec = load_json_codec(name)
+        if not is_dumps_compatible(codec.dumps) or not is_loads_compatible(codec.loads):
+            log.warn("JSON codec '%s' is not compatible with the default codec", name)
+        return codec
+
+    dumps_name, loads_name, dumps, loads = None, None, None, None
+    for codec_name in AUTO_CODEC_ORDER:
+        try:
+            codec = load_json_codec(codec_name)
+        except ImportError:
+            continue
+        if dumps is None and is_dumps_compatible(codec.dumps):
+            dumps_name, dumps = codec_name, codec.dumps
+        if loads is None and is_loads_compatible(codec.loads):
+            loads_name, loads = codec_name, codec.loads
+        if dumps and loads:
+            break
+    if dumps is None or loads is None:
+        raise ImportError("No usable JSON codec found")
+
+    codec_name = dumps_name if dumps_name == loads_name else "%s/%s" % (dumps_name, loads_name)
+    return JsonCodec(codec_name, dumps, loads)
+
+
+# Type oids of json and jsonb values and their arrays: (oid, array oid, name)
+JSON_TYPE_OIDS = [(114, 199, "JSON"), (3802, 3807, "JSONB")]
+
+
+def create_json_typecasters(codec):
+    """ Returns psycopg2 typecasters that read json and jsonb result values (and arrays) with the codec """
+    from psycopg2.extensions import new_type, new_array_type
+    loads = codec.loads
+
+    def typecast_json(value, cur):
+        if value is None:
+            return None
+        return loads(value)
+
+    typecasters = []
+    for oid, array_oid, name in JSON_TYPE_OIDS:
+        typecaster = new_type((oid,), name, typecast_json)
+        typecasters.append(typecaster)
+        typecasters.append(new_array_type((array_oid,), name + "ARRAY", typecaster))
+    return typecasters
+
+
+def register_json_typecasters(codec, conn_or_curs=None):
+    """ Registers the codec's json and jsonb typecasters for a connection or cursor, or globally if None """
+    from psycopg2.extensions import register_type
+    for typecaster in create_json_typecasters(codec):
+        register_type(typecaster, conn_or_curs)
+
+
+_json_codecs = {}           # Codec config name -> JsonCodec, created (and probed) once
+_container_codec = None
+
+def get_json_codec(name=None):
+    """
+    Returns the JsonCodec for a backend name (or auto), created once per name. Without a name,
+    returns the container codec configured in server.postgresql.json_codec, which is registered
+    for psycopg2 result values globally on first use.
+    """
+    global _container_codec
+    if name is None:
+        if _container_codec is None:
+            codec = get_json_codec(CFG.get_safe("server.postgresql.json_codec") or AUTO_CODEC)
+            try:
+                register_json_typecasters(codec)
+            except ImportError:
+                log.warn("psycopg2 not available - cannot register JSON typecasters")
+            _container_codec = codec
+            log.debug("Using datastore %s", codec)
+        return _container_codec
+
+    codec = _json_codecs.get(name, None)
+    if codec is None:
+        codec = _json_codecs[name] = create_json_codec(name)
+    return codec
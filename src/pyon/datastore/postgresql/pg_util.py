@@ -9,7 +9,6 @@ import gevent
 from gevent.queue import Queue
 from gevent.socket import wait_read, wait_write
 import sys
-import simplejson as json
 import time
 import threading
 
@@ -19,10 +18,11 @@ try:
     from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
     from psycopg2.extensions import connection as _connection
     from psycopg2.extensions import cursor as _cursor
-    from psycopg2.extras import register_default_json
 except ImportError:
     print "PostgreSQL imports not available!"
 
+from pyon.datastore.postgresql.pg_json import DEFAULT_CODEC, load_json_codec, register_json_typecasters
+
 
 # Gevent Monkey patching
 def gevent_wait_callback(conn, timeout=None):
@@ -42,8 +42,9 @@ def gevent_wait_callback(conn, timeout=None):
 extensions.set_wait_callback(gevent_wait_callback)
 # End Gevent Monkey patching
 
-# Set JSON to Pyon default simplejson to get str instead of unicode in deserialization
-register_default_json(None, globally=True, loads=json.loads)
+# Set JSON to Pyon default simplejson to get str instead of unicode in deserialization.
+# The configured datastore codec replaces this when the first datastore is created
+register_json_typecasters(load_json_codec(DEFAULT_CODEC))
 
 
 # THREAD (GEVENT) LOCAL - Holds current transaction and per request stats
@@ -159,9 +160,12 @@ class DatabaseConnectionPool(object):
                 else:
                     conn.set_isolation_level(isolation_level)
             tracer = kwargs.pop("tracer", None)
+            json_typecasters = kwargs.pop("json_typecasters", None)
             cur = conn.cursor(*args, **kwargs)
             if isinstance(cur, TracingCursor):
                 cur._tracer = tracer
+            for typecaster in json_typecasters or ():
+                extensions.register_type(typecaster, cur)
             yield cur
         except:
             if conn.closed:
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+import json
+import simplejson
+
+from nose.plugins.attrib import attr
+from mock import patch
+
+from pyon.core.bootstrap import CFG
+from pyon.util.unit_test import IonUnitTestCase
+
+from pyon.datastore.postgresql import pg_json
+from pyon.datastore.postgresql.pg_json import JSON_CODEC_LOADERS, PROBE_DOCS, create_json_codec, load_json_codec, \
+    is_dumps_compatible, is_loads_compatible, get_json_codec, create_json_typecasters
+
+
+# Additional documents in the shape of persisted resources, associations and events
+COMPAT_DOCS = PROBE_DOCS + [
+    {"_id": "a1b2c3", "_rev": "3", "type_": "InstrumentDevice", "name": "CTD 1", "description": u"Sea\u2013Bird CTD",
+     "lcstate": "DEPLOYED", "availability": "AVAILABLE", "visibility": 1, "ts_created": "1400000000000",
+     "ts_updated": "1400000001234", "alt_ids": ["PRE:CTD1", "OOI:RS01SBPS-PC01A-4A-CTDPFA103"],
+     "addl": {"serial": "1234/5678", "calibration": [0.000123, 1.25e-05, 12345.6789, -2.0]},
+     "geospatial_bounds": {"type_": "GeospatialBounds", "geospatial_latitude_limit_north": 44.5,
+                           "geospatial_latitude_limit_south": 44.5, "geospatial_longitude_limit_east": -124.25,
+                           "geospatial_longitude_limit_west": -124.25},
+     "contacts": [{"type_": "ContactInformation", "individual_names_given": "J\xc3\xbcrgen", "email": "a@b.org",
+                   "phones": [], "roles": ["owner"]}]},
+    {"_id": "assoc1", "_rev": "1", "type_": "Association", "s": "a1b2c3", "st": "InstrumentDevice", "p": "hasModel",
+     "o": "d4e5f6", "ot": "InstrumentModel", "retired": False, "ts": "1400000000000", "attributes": {}},
+    {"_id": "evt1", "type_": "ResourceLifecycleEvent", "origin": "a1b2c3", "origin_type": "InstrumentDevice",
+     "sub_type": "DEPLOYED.AVAILABLE", "ts_created": "1400000000000", "base_types": ["ResourceEvent", "Event"],
+     "description": "", "actor_id": None, "old_state": "PLANNED", "new_state": "DEPLOYED"},
+    {"_id": "x" * 300, "values": range(200), "floats": [i / 7.0 for i in xrange(200)], "text": "lorem ipsum " * 500},
+]
+
+
+@attr('UNIT', group='datastore')
+class PostgresJsonCodecUnitTest(IonUnitTestCase):
+
+    def test_default_codec(self):
+        codec = load_json_codec("default")
+        for doc in COMPAT_DOCS:
+            doc_json = codec.dumps(doc)
+            self.assertEquals(doc_json, json.dumps(doc))
+            self.assertIs(type(doc_json), str)
+            self.assertEquals(pg_json._typed(codec.loads(doc_json)), pg_json._typed(simplejson.loads(doc_json)))
+
+        # Pyon relies on str (not unicode) for ASCII strings in read documents
+        doc = codec.loads(json.dumps(COMPAT_DOCS[0]))
+        self.assertIs(type(doc["_id"]), str)
+
+    def test_codec_compat(self):
+        """ Any available backend that passes the probe must be byte-for-byte compatible for all documents """
+        for codec_name in JSON_CODEC_LOADERS:
+            try:
+                codec = load_json_codec(codec_name)
+            except ImportError:
+                continue
+            if is_dumps_compatible(codec.dumps):
+                for doc in COMPAT_DOCS:
+                    self.assertEquals(codec.dumps(doc), json.dumps(doc), "dumps mismatch for %s" % codec_name)
+            if is_loads_compatible(codec.loads):
+                for doc in COMPAT_DOCS:
+                    doc_json = json.dumps(doc)
+                    self.assertEquals(pg_json._typed(codec.loads(doc_json)), pg_json._typed(simplejson.loads(doc_json)),
+                                      "loads mismatch for %s" % codec_name)
+
+        auto_codec = create_json_codec("auto")
+        for doc in COMPAT_DOCS:
+            doc_json = auto_codec.dumps(doc)
+            self.assertEquals(doc_json, json.dumps(doc))
+            self.assertEquals(pg_json._typed(auto_codec.loads(doc_json)), pg_json._typed(simplejson.loads(doc_json)))
+
+    def test_codec_select(self):
+        # Compact separators and unicode strings are not compatible
+        compact_dumps = lambda obj: json.dumps(obj, separators=(",", ":"))
+        self.assertFalse(is_dumps_compatible(compact_dumps))
+        self.assertFalse(is_loads_compatible(json.loads))
+        self.assertFalse(is_dumps_compatible(lambda obj: 1/0))
+        self.assertTrue(is_dumps_compatible(json.dumps))
+        self.assertTrue(is_loads_compatible(simplejson.loads))
+
+        def load_missing():
+            raise ImportError("not installed")
+
+        loaders = dict(JSON_CODEC_LOADERS, fast=lambda: (compact_dumps, simplejson.loads), missing=load_missing)
+        with patch.dict(JSON_CODEC_LOADERS, loaders), \
+                patch.object(pg_json, "AUTO_CODEC_ORDER", ["missing", "fast", "default"]):
+            codec = create_json_codec("auto")
+            self.assertEquals(codec.name, "default/fast")
+            self.assertIs(codec.dumps, json.dumps)
+            self.assertIs(codec.loads, simplejson.loads)
+
+            # Named codecs are used even if not compatible
+            codec = create_json_codec("fast")
+            self.assertEquals(codec.name, "fast")
+            self.assertIs(codec.dumps, compact_dumps)
+
+            with self.assertRaises(ImportError):
+                create_json_codec("missing")
+        with self.assertRaises(ValueError):
+            create_json_codec("unknown")
+
+    def test_get_codec(self):
+        with patch.object(pg_json, "_json_codecs", {}), patch.object(pg_json, "_container_codec", None), \
+                patch.object(pg_json, "register_json_typecasters") as register_mock, \
+                patch.dict(CFG.server.postgresql, json_codec="simplejson"):
+            # Container codec is resolved from config and registered globally once
+            codec = get_json_codec()
+            self.assertEquals(codec.name, "simplejson")
+            register_mock.assert_called_once_with(codec)
+            self.assertIs(get_json_codec(), codec)
+            self.assertIs(get_json_codec("simplejson"), codec)
+            self.assertEquals(register_mock.call_count, 1)
+
+            # Other codecs are created once per name and not registered
+            codec1 = get_json_codec("default")
+            self.assertEquals(codec1.name, "default")
+            self.assertIs(get_json_codec("default"), codec1)
+            self.assertIs(get_json_codec(), codec)
+            self.assertEquals(register_mock.call_count, 1)
+
+    def test_typecasters(self):
+        typecasters = create_json_typecasters(load_json_codec("default"))
+        self.assertEquals([tc.name for tc in typecasters], ["JSON", "JSONARRAY", "JSONB", "JSONBARRAY"])
+        self.assertEquals([tc.values for tc in typecasters], [(114,), (199,), (3802,), (3807,)])
+        doc = typecasters[0](json.dumps(PROBE_DOCS[0]), None)
+        self.assertEquals(doc, PROBE_DOCS[0])
+        self.assertIs(type(doc["_id"]), str)
+        self.assertIsNone(typecasters[2](None, None))
@@ -4,14 +4,22 @@
 
 __author__ = 'Michael Meisinger, David Stuebe, Dave Foster <dfoster@asascience.com>'
 
+from collections import OrderedDict
+from gevent.event import AsyncResult, Event
 from gevent.timeout import Timeout
 
 from pyon.core import MSG_HEADER_ACTOR, MSG_HEADER_VALID, MSG_HEADER_ROLES, MSG_HEADER_TOKENS
+from pyon.core.bootstrap import CFG
 from pyon.core.exception import Timeout as IonTimeout
+from pyon.core.interceptor.encode import copy_message
+from pyon.core.interceptor.interceptor import LazyPayload
 from pyon.net.transport import BaseTransport
-from pyon.net.endpoint import (Publisher, Subscriber, EndpointUnit, process_interceptors, RPCRequestEndpointUnit,
-        BaseEndpoint, RPCClient, RPCResponseEndpointUnit, RPCServer, PublisherEndpointUnit, SubscriberEndpointUnit)
+from pyon.net.endpoint import (Publisher, Subscriber, EndpointUnit, process_pipeline, RPCRequestEndpointUnit,
+        BaseEndpoint, RPCClient, RPCResponseEndpointUnit, RPCServer, PublisherEndpointUnit, SubscriberEndpointUnit,
+        get_local_interceptors, log_message, trigger_msg_in_callback, trigger_msg_out_callback)
 from pyon.ion.event import BaseEventSubscriberMixin
+from pyon.util.async import spawn
+from pyon.util.containers import get_ion_ts_millis, get_safe
 from pyon.util.log import log
 
 
@@ -19,6 +27,38 @@ from pyon.util.log import log
 # PROCESS LEVEL ENDPOINTS
 #
 
+class SecurityHeaderCache(object):
+    """
+    Caches security headers built from invocation contexts (the headers of the message a process is
+    handling), so that outgoing messages sent while handling one message merge a prebuilt template.
+    Entries are keyed by context identity and keep a reference to the context, so a recycled id never
+    matches. Contexts must not be modified once used. Cleared on policy changes.
+    """
+    def __init__(self, max_size=100):
+        self.max_size = max_size
+        self._cache = OrderedDict()     # id(context) -> (context, headers)
+
+    def get(self, context, build_func):
+        entry = self._cache.get(id(context), None)
+        if entry is not None and entry[0] is context:
+            return entry[1]
+        headers = build_func(context)
+        self._cache[id(context)] = (context, headers)
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return headers
+
+    def clear(self):
+        self._cache.clear()
+
+security_header_cache = SecurityHeaderCache()
+
+
+def get_process_prefetch_config(process):
+    """ Returns the adaptive prefetch override from a process' config (endpoint.adaptive_prefetch) or None """
+    return get_safe(getattr(process, "CFG", None), "endpoint.adaptive_prefetch")
+
+
 class ProcessEndpointUnitMixin(EndpointUnit):
     """
     Common-base mixin for Process related endpoints.
@@ -54,7 +94,7 @@ class ProcessEndpointUnitMixin(EndpointUnit):
         This is a request, so the order should be Message, Process
         """
         inv_one = EndpointUnit._intercept_msg_in(self, inv)
-        inv_two = process_interceptors(self.interceptors["process_incoming"] if "process_incoming" in self.interceptors else [], inv_one)
+        inv_two = process_pipeline(self.get_interceptor_pipeline("process_incoming"), inv_one)
         return inv_two
 
     def _intercept_msg_out(self, inv):
@@ -63,7 +103,7 @@ class ProcessEndpointUnitMixin(EndpointUnit):
 
         This is request, so the order should be Process, Message
         """
-        inv_one = process_interceptors(self.interceptors["process_outgoing"] if "process_outgoing" in self.interceptors else [], inv)
+        inv_one = process_pipeline(self.get_interceptor_pipeline("process_outgoing"), inv)
         inv_two = EndpointUnit._intercept_msg_out(self, inv_one)
 
         return inv_two
@@ -86,7 +126,10 @@ class ProcessEndpointUnitMixin(EndpointUnit):
         # Use received message headers context to set security attributes forward
         context = self.get_context()
         if isinstance(context, dict):
-            new_header = self.build_security_headers(context)
+            if CFG.get_safe('container.messaging.endpoint.cache_security_headers', False) is True:
+                new_header = security_header_cache.get(context, self.build_security_headers)
+            else:
+                new_header = self.build_security_headers(context)
             header.update(new_header)
         else:
             # no context? we're the originator of the message then
@@ -210,6 +253,44 @@ class ProcessRPCClient(RPCClient):
         newkwargs['process'] = self._process
         return RPCClient.create_endpoint(self, to_name, existing_channel, **newkwargs)
 
+    def request(self, msg, headers=None, op=None, timeout=None):
+        """
+        Request override that delivers directly to the target service if it runs in the same
+        container and the local shortcut is enabled. Otherwise sends via the broker.
+        """
+        server = None
+        if CFG.get_safe('container.messaging.rpc.local_shortcut', False) is True:
+            server = self._get_local_server()
+        if server is None:
+            return RPCClient.request(self, msg, headers=headers, op=op, timeout=timeout)
+
+        assert op
+        assert headers is None or isinstance(headers, dict)
+
+        headers = headers.copy() if headers is not None else {}
+        headers['op'] = op
+
+        ep_unit = ProcessLocalRPCRequestEndpointUnit(endpoint=self, process=self._process,
+                                                     interceptors=get_local_interceptors(self.interceptors))
+        ep_unit.attach_channel(LocalRPCChannel(server=server))
+        ep_unit.channel.connect(self._send_name)
+        retval, headers = ep_unit.send(msg, headers=headers, timeout=timeout)
+        return retval
+
+    def _get_local_server(self):
+        """
+        Returns the RPC server of a service process in this container listening on this client's
+        target name, or None.
+        """
+        if not self._process or not isinstance(self._send_name, BaseTransport):
+            return None
+        container = self._process.container or self._get_container_instance()
+        if not container or not getattr(container, 'proc_manager', None):
+            return None
+
+        self._ensure_node()
+        return container.proc_manager.get_local_rpc_server(self._send_name.exchange, self._send_name.queue)
+
 
 class ProcessRPCResponseEndpointUnit(ProcessEndpointUnitMixin, RPCResponseEndpointUnit):
     def __init__(self, process=None, routing_call=None, **kwargs):
@@ -239,6 +320,12 @@ class ProcessRPCResponseEndpointUnit(ProcessEndpointUnitMixin, RPCResponseEndpoi
     def message_received(self, msg, headers):
         """Hook for checking governance pre-conditions before calling a service operation
         """
+        if isinstance(msg, LazyPayload):
+            # Don't decode a message body that the process would discard for having exceeded reply-by
+            if 'reply-by' in headers and get_ion_ts_millis() >= int(headers['reply-by']):
+                raise IonTimeout("Reply-by time has already occurred (reply-by: %s)" % headers['reply-by'])
+            msg = msg.materialize()
+
         gc = self._routing_obj.container.governance_controller
         if gc:
             gc.check_process_operation_preconditions(self._routing_obj, msg, headers)
@@ -307,6 +394,9 @@ class ProcessRPCServer(RPCServer):
         if "service" not in kwargs:
             kwargs = kwargs.copy()
             kwargs['service'] = process
+        if "prefetch" not in kwargs and get_process_prefetch_config(process) is not None:
+            kwargs = kwargs.copy()
+            kwargs['prefetch'] = get_process_prefetch_config(process)
 
         RPCServer.__init__(self, **kwargs)
 
@@ -328,6 +418,103 @@ class ProcessRPCServer(RPCServer):
         return "ProcessRPCServer at %s:\n\trecv_name: %s\n\tprocess: %s" % (hex(id(self)), str(self._recv_name), str(self._process))
 
 
+# -----------------------------------------------------------------------------
+# SAME CONTAINER RPC
+#
+
+class LocalRPCChannel(object):
+    """
+    Stand-in channel for RPC requests to a ProcessRPCServer in the same container.
+    On the requester side, send delivers the request to the server in a new greenlet and the
+    response is set in reply. On the server side, send hands the response to the requester's channel.
+    Messages are copied via a msgpack encode/decode round trip unless disabled, so that both sides do not
+    share objects and see the same value types as via the broker.
+    """
+    _send_name = None
+    _recv_name = None
+
+    def __init__(self, server=None, requester_channel=None):
+        self._server = server
+        self._requester_channel = requester_channel
+        self._copy_msgs = CFG.get_safe('container.messaging.rpc.local_shortcut_copy', True) is True
+        self.reply = AsyncResult()
+        if requester_channel is not None:
+            self._send_name = requester_channel._send_name
+
+    def connect(self, name):
+        self._send_name = name
+
+    def send(self, data, headers=None):
+        if self._copy_msgs:
+            data = copy_message(data)
+        if self._requester_channel is not None:
+            self._requester_channel.reply.set((data, headers))
+        else:
+            spawn(self._deliver, data, dict(headers))
+
+    def _deliver(self, msg, headers):
+        server = self._server
+        ep_unit = ProcessLocalRPCResponseEndpointUnit(endpoint=server, process=server._process,
+                                                      routing_call=server.routing_call, routing_obj=server._service,
+                                                      interceptors=get_local_interceptors(server.interceptors))
+        ep_unit.attach_channel(LocalRPCChannel(requester_channel=self))
+
+        # Provide a hook for any message received
+        trigger_msg_in_callback(msg, headers, None, ep_unit)
+        log_message("MESSAGE RECV >>> RPC-request", msg, headers, server._recv_name, is_send=False)
+        try:
+            msg, headers = ep_unit.intercept_in(msg, headers)
+        except Exception:
+            return      # Error response was sent back by intercept_in
+        ep_unit._message_received(msg, headers)
+
+    def get_channel_id(self):
+        return None
+
+    def close(self):
+        ev = Event()
+        ev.set()
+        return ev
+
+
+class ProcessLocalRPCRequestEndpointUnit(ProcessRPCRequestEndpointUnit):
+    """
+    Requester side of a same-container RPC. Skips the broker and message encoding, but
+    applies the same interceptors (e.g. governance), timeouts and response error handling.
+    """
+
+    def _send_request(self, msg, headers=None, **kwargs):
+        if 'timeout' in kwargs and kwargs['timeout'] is not None:
+            timeout = kwargs['timeout']
+        else:
+            timeout = CFG.get_safe('container.messaging.timeout.receive', 10)
+        headers['reply-by'] = str(int(headers['ts']) + int(timeout * 1000))
+        log_message("MESSAGE SEND >>> RPC-request", msg, headers, is_send=True)
+
+        new_msg, new_headers = self.intercept_out(msg, headers)
+        trigger_msg_out_callback(new_msg, new_headers, self)
+        self.channel.send(new_msg, new_headers)
+        return timeout, new_headers
+
+    def _get_response(self, conv_id, timeout):
+        rmsg, rheaders = self.channel.reply.get(timeout=timeout)
+        trigger_msg_in_callback(rmsg, rheaders, None, self)
+        return self.intercept_in(rmsg, rheaders)
+
+
+class ProcessLocalRPCResponseEndpointUnit(ProcessRPCResponseEndpointUnit):
+    """
+    Server side of a same-container RPC. Hands the response back without message encoding.
+    """
+
+    def _send(self, msg, headers=None, **kwargs):
+        log_message("MESSAGE SEND <<< RPC-reply", msg, headers, is_send=True)
+        new_msg, new_headers = self.intercept_out(msg, headers)
+        trigger_msg_out_callback(new_msg, new_headers, self)
+        self.channel.send(new_msg, new_headers)
+        return new_msg, new_headers
+
+
 class ProcessPublisherEndpointUnit(ProcessEndpointUnitMixin, PublisherEndpointUnit):
     def __init__(self, process=None, **kwargs):
         ProcessEndpointUnitMixin.__init__(self, process=process)
@@ -427,6 +614,8 @@ class ProcessSubscriber(Subscriber):
         assert process
         self._process = process
         self._routing_call = routing_call
+        if "prefetch" not in kwargs and get_process_prefetch_config(process) is not None:
+            kwargs['prefetch'] = get_process_prefetch_config(process)
         Subscriber.__init__(self, **kwargs)
 
     @property
@@ -462,8 +651,20 @@ class ProcessEventSubscriber(ProcessSubscriber, BaseEventSubscriberMixin):
         log.debug("ProcessEventSubscriber events pattern %s", self.binding)
 
         ProcessSubscriber.__init__(self, from_name=self._ev_recv_name, binding=self.binding,
-                                   callback=callback, process=process, routing_call=routing_call,
-                                   auto_delete=self._auto_delete, **kwargs)
+                                   callback=self._filter_local_callback(callback), process=process,
+                                   routing_call=routing_call, auto_delete=self._auto_delete, **kwargs)
+
+    def activate(self):
+        ProcessSubscriber.activate(self)
+        self._register_local()
+
+    def deactivate(self):
+        self._unregister_local()
+        ProcessSubscriber.deactivate(self)
+
+    def close(self):
+        self._unregister_local()
+        ProcessSubscriber.close(self)
 
     def __str__(self):
         return "ProcessEventSubscriber at %s:\n\trecv_name: %s\n\tprocess: %s\n\tcb: %s" % (
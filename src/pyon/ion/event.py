@@ -4,6 +4,7 @@
 
 __author__ = 'Dave Foster <dfoster@asascience.com>, Michael Meisinger'
 
+import copy
 import functools
 import sys
 import traceback
@@ -15,10 +16,10 @@ from pyon.core.exception import BadRequest, IonException, StreamException
 from pyon.datastore.datastore import DataStore
 from pyon.datastore.datastore_query import QUERY_EXP_KEY, DatastoreQueryBuilder, DQ
 from pyon.ion.identifier import create_unique_event_id, create_simple_unique_id
-from pyon.net.endpoint import Publisher, Subscriber, BaseEndpoint
-from pyon.net.transport import XOTransport, NameTrio
+from pyon.net.endpoint import Publisher, Subscriber, BaseEndpoint, get_local_interceptors
+from pyon.net.transport import XOTransport, NameTrio, TopicTrie
 from pyon.util.async import spawn
-from pyon.util.containers import get_ion_ts_millis, is_valid_ts
+from pyon.util.containers import get_ion_ts, get_ion_ts_millis, is_valid_ts
 from pyon.util.log import log
 
 from interface.objects import Event
@@ -29,6 +30,9 @@ VALID_EVENT_TIME_PERIOD = 365 * 24 * 60 * 60 * 1000   # one year
 DEFAULT_SYSTEM_XS = "system"
 DEFAULT_EVENTS_XP = "events"
 
+# Header marking events published to the broker that were already delivered within the originating container
+MSG_HEADER_LOCAL_BUS = "local-event-bus"
+
 
 class EventError(IonException):
     status_code = 500
@@ -54,6 +58,7 @@ class EventPublisher(Publisher):
         self.event_type = event_type
         self.process = process
         self._events_xp = CFG.get_safe("exchange.core.events", DEFAULT_EVENTS_XP)
+        self._local_delivery = xp is None and local_event_bus.is_enabled()
 
         if bootstrap.container_instance and getattr(bootstrap.container_instance, 'event_repository', None):
             self.event_repo = bootstrap.container_instance.event_repository
@@ -154,8 +159,15 @@ class EventPublisher(Publisher):
         #Generate a unique ID for this event
         event_object._id = create_unique_event_id()
 
+        headers = None
+        if self._local_delivery:
+            if local_event_bus.deliver(topic, event_object, self._build_local_headers(event_object)):
+                headers = {MSG_HEADER_LOCAL_BUS: local_event_bus.bus_id}
+            if local_event_bus.is_local_only(event_object):
+                return event_object
+
         try:
-            self.publish(event_object, to_name=to_name)
+            self.publish(event_object, to_name=to_name, headers=headers)
         except Exception as ex:
             log.exception("Failed to publish event (%s): '%s'" % (ex.message, event_object))
             raise
@@ -163,6 +175,11 @@ class EventPublisher(Publisher):
         return event_object
 
 
+    def _build_local_headers(self, event_object):
+        """ Returns the headers of the event as built by this publisher's endpoint unit for the broker """
+        ep_unit = self.create_endpoint(existing_channel=LocalEventChannel())
+        return ep_unit._build_header(event_object, {})
+
     def publish_event(self, origin=None, event_type=None, **kwargs):
         """
         Publishes an event of given type for the given origin. Event_type defaults to an
@@ -199,6 +216,87 @@ class EventPublisher(Publisher):
 local_event_queues = []
 
 
+class LocalEventChannel(object):
+    """
+    Placeholder channel for endpoint units that deliver events within the container.
+    """
+    _send_name = None
+    _recv_name = None
+
+    def connect(self, name):
+        self._send_name = name
+
+    def get_channel_id(self):
+        return None
+
+    def close(self):
+        ev = gevent_event.Event()
+        ev.set()
+        return ev
+
+
+class LocalEventBus(object):
+    """
+    Container-local event bus. Dispatches published events directly to matching EventSubscribers
+    with an exclusive queue in the same container, using a TopicTrie with the subscribers' bindings.
+    Subscribers on named queues only receive events via the broker (thus not local only events).
+    Broker publication still happens (unless the event type is configured local only), with a header
+    so that locally registered subscribers ignore the broker copy of an event they already received.
+    """
+
+    def __init__(self):
+        self.bus_id = create_simple_unique_id()
+        self._trie = TopicTrie()
+        self._bindings = {}     # subscriber -> list of bindings
+
+    def is_enabled(self):
+        return CFG.get_safe("container.messaging.events.local_delivery", False) is True
+
+    def is_local_only(self, event_object):
+        local_only = CFG.get_safe("container.messaging.events.local_only", None)
+        if not local_only:
+            return False
+        local_only = set(local_only)
+        return event_object._get_type() in local_only or any(bt in local_only for bt in event_object.base_types or [])
+
+    def is_registered(self, subscriber):
+        return subscriber in self._bindings
+
+    def add_subscriber(self, subscriber, binding):
+        bindings = self._bindings.setdefault(subscriber, [])
+        if binding not in bindings:
+            bindings.append(binding)
+            self._trie.add_topic_tree(binding, subscriber)
+
+    def remove_subscriber(self, subscriber, binding=None):
+        bindings = self._bindings.get(subscriber, None)
+        if bindings is None:
+            return
+        for sub_binding in list(bindings):
+            if binding is None or sub_binding == binding:
+                bindings.remove(sub_binding)
+                self._trie.remove_topic_tree(sub_binding, subscriber)
+        if binding is None:
+            del self._bindings[subscriber]
+
+    def deliver(self, topic, event_object, headers=None):
+        """
+        Delivers the event to all matching local subscribers, each in its own greenlet and with
+        its own copy of the event object and headers (as built by the publisher).
+        @retval the number of subscribers the event was delivered to
+        """
+        if not self._bindings:
+            return 0
+        headers = headers or {'ts': get_ion_ts()}
+        subscribers = self._trie.get_all_matches(topic)
+        for subscriber in subscribers:
+            spawn(subscriber._deliver_local, copy.deepcopy(event_object), dict(headers))
+        return len(subscribers)
+
+
+local_event_bus = LocalEventBus()
+
+
 class BaseEventSubscriberMixin(object):
     """
     A mixin class for Event subscribers to facilitate inheritance.
@@ -242,11 +340,17 @@ class BaseEventSubscriberMixin(object):
             auto_delete = True
         self._auto_delete = auto_delete
 
+        # Only subscribers with an exclusive (generated) queue receive events locally. Named queues may be
+        # shared with other consumers (work queues, other containers) that must get each event only once.
+        self._local_delivery = queue_name is None and (xp_name is None or xp_name == self._events_xp) and \
+            local_event_bus.is_enabled()
+
         xp_name = xp_name or self._events_xp
         if pattern:
             binding = pattern
         else:
             binding = self._topic(event_type, origin, sub_type, origin_type)
+        self._local_bindings = [binding]
 
         # create queue_name if none passed in
         if queue_name is None:
@@ -287,6 +391,9 @@ class BaseEventSubscriberMixin(object):
             self._ev_recv_name.bind(binding)
         else:
             raise BadRequest("Non XO event subscriber not supported")
+        self._local_bindings.append(binding)
+        if local_event_bus.is_registered(self):
+            local_event_bus.add_subscriber(self, binding)
 
     def remove_event_subscription(self, event_type=None, origin=None, sub_type=None, origin_type=None):
         """ Remove an event subscription based on given characteristics. """
@@ -295,6 +402,43 @@ class BaseEventSubscriberMixin(object):
             self._ev_recv_name.unbind(binding)
         else:
             raise BadRequest("Non XO event subscriber not supported")
+        if binding in self._local_bindings:
+            self._local_bindings.remove(binding)
+        local_event_bus.remove_subscriber(self, binding)
+
+    def _filter_local_callback(self, callback):
+        """ Wraps the subscriber callback to skip broker copies of events already delivered locally. """
+        if not self._local_delivery or callback is None:
+            return callback
+
+        def filtered_callback(msg, headers):
+            if headers.get(MSG_HEADER_LOCAL_BUS, None) == local_event_bus.bus_id and local_event_bus.is_registered(self):
+                return
+            return callback(msg, headers)
+        return filtered_callback
+
+    def _register_local(self):
+        if self._local_delivery:
+            for binding in self._local_bindings:
+                local_event_bus.add_subscriber(self, binding)
+
+    def _unregister_local(self):
+        local_event_bus.remove_subscriber(self)
+
+    def _deliver_local(self, event_object, headers):
+        """ Receives an event from the local event bus, applying the non-encoding incoming interceptors. """
+        try:
+            ep_unit = self.create_endpoint(existing_channel=LocalEventChannel(),
+                                           interceptors=get_local_interceptors(self.interceptors))
+            msg, headers = ep_unit.intercept_in(event_object, headers)
+            ep_unit._message_received(msg, headers)
+        except Exception:
+            log.exception("Error delivering local event to %s", self)
+
+
+def _get_event_origin(event, headers):
+    """ Dispatch key for concurrent event processing, ordering events per origin """
+    return getattr(event, "origin", None)
 
 
 class EventSubscriber(Subscriber, BaseEventSubscriberMixin):
@@ -312,8 +456,11 @@ class EventSubscriber(Subscriber, BaseEventSubscriberMixin):
         can cross-pollute messages if a named queue is used.
 
         Note: an EventSubscriber needs to be closed to free broker resources
+        With dispatch_size > 1, events of the same origin are processed in order by default.
         """
         self._cbthread = None
+        if kwargs.get("dispatch_size", 0) > 1:
+            kwargs.setdefault("dispatch_key", _get_event_origin)
 
         # sets self._ev_recv_name, self.binding
         BaseEventSubscriberMixin.__init__(self, xp_name=xp_name, event_type=event_type, origin=origin,
@@ -325,7 +472,7 @@ class EventSubscriber(Subscriber, BaseEventSubscriberMixin):
         from_name = self._get_from_name()
         binding   = self._get_binding()
 
-        Subscriber.__init__(self, from_name=from_name, binding=binding, callback=callback,
+        Subscriber.__init__(self, from_name=from_name, binding=binding, callback=self._filter_local_callback(callback),
                             auto_delete=self._auto_delete, **kwargs)
 
     def _get_from_name(self):
@@ -342,6 +489,18 @@ class EventSubscriber(Subscriber, BaseEventSubscriberMixin):
         """
         return self.binding
 
+    def activate(self):
+        Subscriber.activate(self)
+        self._register_local()
+
+    def deactivate(self):
+        self._unregister_local()
+        Subscriber.deactivate(self)
+
+    def close(self):
+        self._unregister_local()
+        Subscriber.close(self)
+
     def start(self):
         """
         Pass in a subscriber here, this will make it listen in a background greenlet.
@@ -399,7 +558,11 @@ class EventRepository(object):
         log.trace("Store event persistently %s", event)
         if not isinstance(event, Event):
             raise BadRequest("event must be type Event, not %s" % type(event))
-        event_id = event.__dict__.pop("_id", None)
+        try:
+            event_id = event._id
+            del event._id
+        except AttributeError:
+            event_id = None
         new_event_id, _ = self.event_store.create(event, event_id)
         return new_event_id
 
@@ -3,11 +3,17 @@
 __author__ = 'Dave Foster <dfoster@asascience.com>'
 
 from pyon.net import endpoint
-from pyon.ion.endpoint import ProcessEndpointUnitMixin, ProcessRPCRequestEndpointUnit, ProcessRPCClient, ProcessRPCResponseEndpointUnit, ProcessRPCServer, ProcessPublisherEndpointUnit, ProcessPublisher, ProcessSubscriberEndpointUnit, ProcessSubscriber
+from pyon.ion.endpoint import ProcessEndpointUnitMixin, ProcessRPCRequestEndpointUnit, ProcessRPCClient, ProcessRPCResponseEndpointUnit, ProcessRPCServer, ProcessPublisherEndpointUnit, ProcessPublisher, ProcessSubscriberEndpointUnit, ProcessSubscriber, \
+    SecurityHeaderCache, security_header_cache
 from mock import Mock, sentinel, patch, ANY, call, MagicMock
 from pyon.net.channel import SendChannel
 from pyon.util.unit_test import PyonTestCase
-from pyon.core.exception import Unauthorized
+from pyon.core.exception import Unauthorized, NotFound, BadRequest
+from pyon.core.interceptor.encode import EncodeInterceptor
+from pyon.core.interceptor.interceptor import Interceptor
+from pyon.net.transport import BaseTransport, NameTrio
+from pyon.util.context import LocalContextMixin
+from pyon.container.procs import ProcManager
 from nose.plugins.attrib import attr
 
 sentinel_interceptors = {'message_incoming': sentinel.msg_incoming,
@@ -31,8 +37,9 @@ class TestProcessEndpointUnitMixin(PyonTestCase):
 
         mockbi.assert_called_once_with(ep, process=sentinel.proc, invother=sentinel.anything)
 
-    @patch('pyon.ion.endpoint.process_interceptors')
-    @patch('pyon.net.endpoint.process_interceptors')
+    @patch('pyon.net.endpoint.compile_interceptor_stack', Mock(side_effect=lambda ints, stack, ep: ints[stack]))
+    @patch('pyon.ion.endpoint.process_pipeline')
+    @patch('pyon.net.endpoint.process_pipeline')
     def test__intercept_msg_in(self, mocknpi, mockipi):
         mockipi.return_value = sentinel.inv2
         mocknpi.return_value = sentinel.inv2
@@ -43,8 +50,9 @@ class TestProcessEndpointUnitMixin(PyonTestCase):
         mocknpi.assert_has_calls([call(sentinel.msg_incoming, sentinel.inv)])
         mockipi.assert_has_calls([call(sentinel.proc_incoming, sentinel.inv2)])
 
-    @patch('pyon.ion.endpoint.process_interceptors')
-    @patch('pyon.net.endpoint.process_interceptors')
+    @patch('pyon.net.endpoint.compile_interceptor_stack', Mock(side_effect=lambda ints, stack, ep: ints[stack]))
+    @patch('pyon.ion.endpoint.process_pipeline')
+    @patch('pyon.net.endpoint.process_pipeline')
     def test__intercept_msg_out(self, mocknpi, mockipi):
         mockipi.return_value = sentinel.inv2
         mocknpi.return_value = sentinel.inv2
@@ -119,6 +127,47 @@ class TestProcessEndpointUnitMixin(PyonTestCase):
         self.assertEquals(header['expiry'], sentinel.expiry)
         self.assertEquals(header['origin-container-id'], sentinel.container_id)
 
+    @patch.dict('pyon.ion.endpoint.CFG', {'container': {'messaging': {'endpoint': {'cache_security_headers': True}}}})
+    @patch('pyon.net.endpoint.get_ion_ts', Mock(return_value=sentinel.ts))
+    def test__build_header_cached_security_headers(self):
+        security_header_cache.clear()
+        context = {'ion-actor-id': sentinel.ion_actor_id, 'conv-id': sentinel.conv_id}
+        procmock = Mock()
+        procmock.get_context.return_value = context
+
+        ep = ProcessEndpointUnitMixin(process=procmock)
+        ep.channel = Mock(spec=SendChannel)
+        with patch.object(ProcessEndpointUnitMixin, 'build_security_headers',
+                          Mock(side_effect=ProcessEndpointUnitMixin.build_security_headers)) as mockbsh:
+            header1 = ep._build_header(sentinel.raw_msg, {})
+            header2 = ProcessEndpointUnitMixin(process=procmock)._build_header(sentinel.raw_msg, {})
+            self.assertEquals(mockbsh.call_count, 1)
+            self.assertEquals(header2['ion-actor-id'], sentinel.ion_actor_id)
+            self.assertEquals(header2['original-conv-id'], sentinel.conv_id)
+            self.assertEquals(header1, header2)
+
+            # a different context (new inbound message) builds new headers
+            procmock.get_context.return_value = dict(context, **{'ion-actor-id': sentinel.other_actor})
+            header3 = ep._build_header(sentinel.raw_msg, {})
+            self.assertEquals(header3['ion-actor-id'], sentinel.other_actor)
+            self.assertEquals(mockbsh.call_count, 2)
+
+            # invalidated (e.g. on policy change)
+            procmock.get_context.return_value = context
+            security_header_cache.clear()
+            ep._build_header(sentinel.raw_msg, {})
+            self.assertEquals(mockbsh.call_count, 3)
+
+    def test_security_header_cache_size(self):
+        cache = SecurityHeaderCache(max_size=2)
+        contexts = [{'ion-actor-id': str(i)} for i in xrange(3)]
+        for ctx in contexts:
+            cache.get(ctx, ProcessEndpointUnitMixin.build_security_headers)
+        build_func = Mock(return_value=sentinel.headers)
+        self.assertEquals(cache.get(contexts[2], build_func), {'ion-actor-id': '2'})
+        self.assertEquals(cache.get(contexts[0], build_func), sentinel.headers)
+        self.assertEquals(build_func.call_count, 1)
+
 @attr('UNIT')
 class TestProcessRPCRequestEndpointUnit(PyonTestCase):
 
@@ -158,6 +207,118 @@ class TestProcessRPCClient(PyonTestCase):
         mockce.assert_called_once_with(prpc, sentinel.to_name, None, process=sentinel.process)
 
 
+class LocalXN(BaseTransport, NameTrio):
+    pass
+
+class LocalService(LocalContextMixin):
+    process_type = 'service'
+    name = 'localsvc'
+    id = 'localsvc_id'
+
+    def __init__(self):
+        LocalContextMixin.__init__(self)
+        self.container = Mock(governance_controller=None)
+
+    def simple(self, named=None):
+        named.append(2)
+        return named
+
+    def failing(self):
+        raise NotFound("not here")
+
+class RecordingInterceptor(Interceptor):
+    def __init__(self):
+        self.seen = []
+
+    def outgoing(self, invocation):
+        self.seen.append(("out", invocation.headers["performative"], type(invocation.message)))
+        return invocation
+
+    def incoming(self, invocation):
+        self.seen.append(("in", invocation.headers["performative"], type(invocation.message)))
+        return invocation
+
+@attr('UNIT')
+class TestProcessRPCClientLocal(PyonTestCase):
+
+    def setUp(self):
+        self.proc_manager = ProcManager(Mock())
+        self.patch_cfg('pyon.ion.endpoint.CFG', {'container': {'messaging': {'rpc': {'local_shortcut': True}}}})
+        self.recorder = RecordingInterceptor()
+        encoder = EncodeInterceptor()
+        self.node = Mock()
+        self.node.interceptors = {'message_outgoing': [encoder], 'message_incoming': [encoder],
+                                  'process_outgoing': [self.recorder], 'process_incoming': [self.recorder]}
+
+        xn = LocalXN("sys.system", "sys.system.localsvc")
+        self.svc = LocalService()
+        self.server = ProcessRPCServer(process=self.svc, node=self.node, from_name=xn)
+        self.svc._process = Mock(listeners=[self.server], time_stats=(0, 0, 0, 1, 0))
+        self.proc_manager.procs = {self.svc.id: self.svc}
+        self.svc.container.proc_manager = self.proc_manager
+
+        self.client_proc = LocalService()
+        self.client_proc.container = self.svc.container
+        self.client = ProcessRPCClient(process=self.client_proc, node=self.node, to_name=xn)
+
+    @patch('pyon.ion.endpoint.BaseEndpoint._get_container_instance', Mock(return_value=Mock(id="cc_id")))
+    def test_request_local(self):
+        self.assertIs(self.client._get_local_server(), self.server)
+
+        arg = [1]
+        res = self.client.request({'named': arg}, op='simple')
+        self.assertEquals(res, [1, 2])
+        self.assertEquals(arg, [1])
+        self.assertFalse(self.node.channel.called)
+
+        # Process interceptors run on both sides, without message encoding
+        self.assertEquals(self.recorder.seen, [("out", "request", dict), ("in", "request", dict),
+                                               ("out", "inform-result", list), ("in", "inform-result", list)])
+
+        # Messages are copied with broker value types (tuple becomes list)
+        self.assertEquals(self.client.request({'named': (1,)}, op='simple'), [1, 2])
+
+        self.assertRaises(NotFound, self.client.request, {}, op='failing')
+        self.assertRaises(BadRequest, self.client.request, {}, op='unknown')
+
+    @patch('pyon.ion.endpoint.BaseEndpoint._get_container_instance', Mock(return_value=Mock(id="cc_id")))
+    def test_request_local_trace(self):
+        msg_in, msg_out = Mock(), Mock()
+        with patch('pyon.net.endpoint.callback_msg_in', msg_in), patch('pyon.net.endpoint.callback_msg_out', msg_out):
+            self.client.request({'named': [1]}, op='simple')
+
+        # Same-container requests and replies show up in message stats like brokered ones
+        self.assertEquals([c[0][1]['performative'] for c in msg_out.call_args_list], ["request", "inform-result"])
+        self.assertEquals([c[0][1]['performative'] for c in msg_in.call_args_list], ["request", "inform-result"])
+
+    def test_local_server_lookup(self):
+        xn = self.client._send_name
+        self.assertIs(self.proc_manager.get_local_rpc_server(xn.exchange, xn.queue), self.server)
+        self.assertIsNone(self.proc_manager.get_local_rpc_server(xn.exchange, "sys.system.othersvc"))
+
+        # Map is kept until processes change
+        self.proc_manager.procs = {}
+        self.assertIs(self.proc_manager.get_local_rpc_server(xn.exchange, xn.queue), self.server)
+        self.proc_manager._local_rpc_servers = None
+        self.assertIsNone(self.proc_manager.get_local_rpc_server(xn.exchange, xn.queue))
+
+        # Listeners removed from their process are not returned
+        self.proc_manager.procs = {self.svc.id: self.svc}
+        self.proc_manager._local_rpc_servers = None
+        self.assertIs(self.proc_manager.get_local_rpc_server(xn.exchange, xn.queue), self.server)
+        self.svc._process.listeners = []
+        self.assertIsNone(self.proc_manager.get_local_rpc_server(xn.exchange, xn.queue))
+
+    def test_no_local_server(self):
+        self.client._send_name = LocalXN("sys.system", "sys.system.othersvc")
+        self.assertIsNone(self.client._get_local_server())
+
+        self.patch_cfg('pyon.ion.endpoint.CFG', {'container': {'messaging': {'rpc': {'local_shortcut': False}}}})
+        with patch('pyon.net.endpoint.RPCClient.request') as mockreq:
+            self.client.request({}, op='simple')
+            mockreq.assert_called_once_with(self.client, {}, headers=None, op='simple', timeout=None)
+
+
 @attr('UNIT')
 class TestProcessRPCResponseEndpointUnit(PyonTestCase):
 
@@ -336,6 +497,14 @@ class TestProcessSubscriber(PyonTestCase):
         self.assertEquals(s._routing_call, sentinel.routing_call)
         mocks.assert_called_once_with(s, kw1=sentinel.kw1, kw2=sentinel.kw2)
 
+    @patch('pyon.ion.endpoint.Subscriber.__init__')
+    def test_init_prefetch_from_process_config(self, mocks):
+        procmock = Mock()
+        procmock.CFG = {'endpoint': {'adaptive_prefetch': {'enabled': True, 'max_count': 500}}}
+        s = ProcessSubscriber(process=procmock, kw1=sentinel.kw1)
+
+        mocks.assert_called_once_with(s, kw1=sentinel.kw1, prefetch={'enabled': True, 'max_count': 500})
+
     def test_routing_call_property(self):
         s = ProcessSubscriber(process=sentinel.process, routing_call=sentinel.routing_call)
 
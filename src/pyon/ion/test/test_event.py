@@ -18,7 +18,8 @@ from pyon.core import bootstrap
 from pyon.core.bootstrap import IonObject
 from pyon.core.exception import BadRequest, FilesystemError, StreamingError, CorruptionError
 from pyon.datastore.datastore import DatastoreManager, DataStore
-from pyon.ion.event import EventPublisher, EventSubscriber, EventRepository, handle_stream_exception, EventQuery, DQ
+from pyon.ion.event import EventPublisher, EventSubscriber, EventRepository, handle_stream_exception, EventQuery, DQ, \
+    local_event_bus, MSG_HEADER_LOCAL_BUS
 from pyon.ion.identifier import create_unique_event_id
 from pyon.ion.resource import OT
 from pyon.util.containers import get_ion_ts, DotDict
@@ -39,6 +40,93 @@ class TestEvents(IonUnitTestCase):
 
         self.assertEquals(ev._chan.queue_auto_delete, sentinel.auto_delete)
 
+    @patch('pyon.ion.event.BaseEndpoint._get_container_instance', Mock(return_value=None))
+    def test_event_subscriber_dispatch(self):
+        sub = EventSubscriber(event_type="ResourceEvent", callback=lambda m, h: None, node=Mock())
+        self.assertIsNone(sub._dispatcher)
+
+        sub = EventSubscriber(event_type="ResourceEvent", callback=lambda m, h: None, node=Mock(), dispatch_size=4)
+        self.assertEquals(sub._dispatcher.size, 4)
+        self.assertEquals(sub._dispatch_key(Mock(origin="res1"), {}), "res1")
+
+        sub = EventSubscriber(event_type="ResourceEvent", callback=lambda m, h: None, node=Mock(), dispatch_size=4,
+                              dispatch_key="stream_id")
+        self.assertEquals(sub._dispatch_key, "stream_id")
+
+    @patch('pyon.ion.event.BaseEndpoint._get_container_instance', Mock(return_value=None))
+    def test_local_event_bus(self):
+        self.patch_alt_cfg('pyon.ion.event.CFG', {'container': {'messaging': {'events': {
+            'local_delivery': True, 'local_only': ['ContainerLifecycleEvent']}}}})
+        mocknode = Mock()
+        mocknode.interceptors = {}
+        received = queue.Queue()
+
+        sub = EventSubscriber(event_type="ResourceLifecycleEvent", callback=lambda m, h: received.put((m, h)), node=mocknode)
+        sub._setup_listener = Mock()
+        sub.initialize()
+        sub.activate()
+        self.assertTrue(local_event_bus.is_registered(sub))
+
+        pub = EventPublisher(node=mocknode)
+        send_mock = mocknode.channel.return_value.send
+
+        evt = pub.publish_event(event_type="ResourceLifecycleEvent", origin="res1")
+        msg, headers = received.get(timeout=5)
+        self.assertEquals(msg._id, evt._id)
+        self.assertIsNot(msg, evt)
+        self.assertIn('ts', headers)
+        self.assertNotIn(MSG_HEADER_LOCAL_BUS, headers)
+
+        # Also published to broker, marked as already delivered locally
+        self.assertEquals(send_mock.call_count, 1)
+        self.assertEquals(send_mock.call_args[0][1][MSG_HEADER_LOCAL_BUS], local_event_bus.bus_id)
+
+        # Broker copy of locally delivered event is skipped, other events are passed through
+        sub._callback(msg, {MSG_HEADER_LOCAL_BUS: local_event_bus.bus_id})
+        self.assertTrue(received.empty())
+        sub._callback(msg, {})
+        self.assertEquals(received.get(timeout=5)[0], msg)
+
+        # Non matching event is only published to broker
+        pub.publish_event(event_type="ResourceOperatorEvent", origin="res1")
+        self.assertRaises(queue.Empty, received.get, timeout=0.1)
+        self.assertEquals(send_mock.call_count, 2)
+        self.assertNotIn(MSG_HEADER_LOCAL_BUS, send_mock.call_args[0][1])
+
+        # Local only event is not published to broker
+        pub.publish_event(event_type="ContainerLifecycleEvent", origin="cc1")
+        self.assertEquals(send_mock.call_count, 2)
+
+        sub.close()
+        self.assertFalse(local_event_bus.is_registered(sub))
+
+    @patch('pyon.ion.event.BaseEndpoint._get_container_instance', Mock(return_value=None))
+    def test_local_event_bus_named_queue(self):
+        self.patch_alt_cfg('pyon.ion.event.CFG', {'container': {'messaging': {'events': {'local_delivery': True}}}})
+        mocknode = Mock()
+        mocknode.interceptors = {}
+        received = queue.Queue()
+
+        # Named (possibly shared) queues get events only via the broker, to deliver each event once
+        sub = EventSubscriber(event_type="ResourceLifecycleEvent", queue_name="shared_queue",
+                              callback=lambda m, h: received.put((m, h)), node=mocknode)
+        sub._setup_listener = Mock()
+        sub.initialize()
+        sub.activate()
+        self.assertFalse(local_event_bus.is_registered(sub))
+
+        pub = EventPublisher(node=mocknode)
+        send_mock = mocknode.channel.return_value.send
+        pub.publish_event(event_type="ResourceLifecycleEvent", origin="res1")
+        self.assertRaises(queue.Empty, received.get, timeout=0.1)
+        self.assertEquals(send_mock.call_count, 1)
+        self.assertNotIn(MSG_HEADER_LOCAL_BUS, send_mock.call_args[0][1])
+
+        # Broker copies are never filtered
+        sub._callback(Mock(), {MSG_HEADER_LOCAL_BUS: local_event_bus.bus_id})
+        self.assertEquals(received.qsize(), 1)
+        sub.close()
+
 @attr('INT', group='event')
 class TestEventsInt(IonIntegrationTestCase):
 
@@ -39,12 +39,17 @@ is closed)
 
 from contextlib import contextmanager
 from gevent import queue as gqueue
+from gevent import sleep
 from gevent.lock import RLock
 from gevent.event import AsyncResult, Event
+import time
 import traceback
 
 from pyon.core.bootstrap import CFG
+from pyon.net.chunking import (MSG_HEADER_CHUNK_ID, ChunkError, ChunkReassembler, get_chunking_config,
+                               is_chunkable, split_message, combine_confirms)
 from pyon.net.transport import AMQPTransport, NameTrio
+from pyon.util.async import spawn
 from pyon.util.fsm import FSM
 from pyon.util.log import log
 
@@ -354,7 +359,16 @@ class SendChannel(BaseChannel):
 
     def send(self, data, headers=None):
         #log.debug("SendChannel.send")
-        self._send(self._send_name, data, headers=headers)
+        return self._send(self._send_name, data, headers=headers)
+
+    def enable_confirms(self):
+        """
+        Puts the transport in publisher confirm mode, if supported. Sends then return an AsyncResult
+        that is set when the broker confirms the message.
+        @retval True if confirm mode is supported by the transport
+        """
+        with self._ensure_transport():
+            return self._transport.enable_confirms()
 
     def _send(self, name, data, headers=None):
         #log.debug("SendChannel._send\n\tname: %s\n\tdata: %s\n\theaders: %s", name, "-", headers)
@@ -369,14 +383,72 @@ class SendChannel(BaseChannel):
         if hasattr(self._send_name, 'queue_durable'):
             durable_msg = self._send_name.queue_durable
 
+        # oversized messages are sent as sequence of fragments
+        messages = [(data, headers)]
+        if isinstance(data, str):
+            chunking_cfg = get_chunking_config()
+            if chunking_cfg and len(data) > chunking_cfg['chunk_size'] and is_chunkable(headers, chunking_cfg):
+                messages = split_message(data, headers, chunking_cfg['chunk_size'])
+
         with self._ensure_transport():
-            self._transport.publish_impl(exchange=exchange,
-                                         routing_key=routing_key,
-                                         body=data,
-                                         properties=headers,
-                                         immediate=False,
-                                         mandatory=False,
-                                         durable_msg=durable_msg)
+            results = []
+            for body, props in messages:
+                results.append(self._transport.publish_impl(exchange=exchange,
+                                                            routing_key=routing_key,
+                                                            body=body,
+                                                            properties=props,
+                                                            immediate=False,
+                                                            mandatory=False,
+                                                            durable_msg=durable_msg))
+            # a chunked message is confirmed when all its fragments are
+            return combine_confirms(results)
+
+
+class PrefetchController(object):
+    """
+    Adapts the prefetch count of a consuming channel within bounds, based on message processing
+    latency and the number of prefetched messages waiting locally.
+
+    Prefetch is doubled while the local buffer is mostly empty when a message is received (the consumer
+    waits on the broker), and reduced when prefetched messages would wait longer than max_wait locally
+    (they would not be available to other consumers of the queue in the meantime).
+    """
+    def __init__(self, min_count=1, max_count=100, max_wait=1.0, sample_size=20):
+        self.min_count = max(1, int(min_count))
+        self.max_count = max(self.min_count, int(max_count))
+        self.max_wait = float(max_wait)
+        self.sample_size = max(1, int(sample_size))
+        self.prefetch_count = self.min_count
+        self.latency = None     # moving average of message processing time
+
+        self._num_samples = 0
+        self._num_empty = 0
+
+    def add_sample(self, latency, depth):
+        """
+        Records the processing time of a message and the local queue depth when it was received.
+        Returns the new prefetch count if it should change, None otherwise.
+        """
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        self._num_samples += 1
+        if depth == 0:
+            self._num_empty += 1
+        if self._num_samples < self.sample_size:
+            return None
+
+        starved = self._num_empty * 2 > self._num_samples
+        self._num_samples = self._num_empty = 0
+
+        count = self.prefetch_count
+        if self.latency * count > self.max_wait:
+            count = max(self.min_count, int(self.max_wait / self.latency))
+        elif starved and self.latency * count * 2 <= self.max_wait:
+            count = min(self.max_count, count * 2)
+
+        if count == self.prefetch_count:
+            return None
+        self.prefetch_count = count
+        return count
 
 
 class RecvChannel(BaseChannel):
@@ -403,6 +475,18 @@ class RecvChannel(BaseChannel):
     # consuming flag (consuming is not a state, a property)
     _consuming          = False
 
+    # ack batching mode (0 = off)
+    _ack_batch_size     = 0
+    _ack_batch_interval = 0.1
+
+    # adaptive prefetch (PrefetchController, None = static prefetch)
+    _prefetch_ctrl      = None
+    _prefetch_count     = None      # prefetch count last set on the channel (None = not set)
+
+    # reassembly of chunked messages (ChunkReassembler, created on first fragment)
+    _reassembler        = None
+    _reassembly_gl      = None      # greenlet discarding incomplete messages after timeout
+
     class SizeNotifyQueue(gqueue.Queue):
         """
         Custom gevent-safe queue to allow us to be notified when queue reaches a threshold.
@@ -457,6 +541,12 @@ class RecvChannel(BaseChannel):
 
         self._setup_listener_called = False
 
+        self._ack_batch_size = CFG.get_safe('container.messaging.endpoint.ack_batch_size', 0) or 0
+        self._ack_batch_interval = CFG.get_safe('container.messaging.endpoint.ack_batch_interval', 0.1)
+        self._unsettled_tags = set()    # delivered, not yet acked or rejected (ack batching mode)
+        self._pending_acks = []         # acked, but not yet sent to the broker (ack batching mode)
+        self._ack_flush_gl = None
+
         BaseChannel.__init__(self, **kwargs)
 
     @property
@@ -691,6 +781,15 @@ class RecvChannel(BaseChannel):
         """
         #log.debug("RecvChannel.close_impl (%s)", self.get_channel_id())
 
+        if self._pending_acks:
+            try:
+                self.flush_acks()
+            except Exception:
+                log.exception("Error sending pending acks on close")
+
+        if self._reassembly_gl is not None:
+            self._reassembly_gl.kill()
+
         self._recv_queue.put(ChannelShutdownMessage())
 
         # if we were consuming, we aren't anymore
@@ -744,17 +843,85 @@ class RecvChannel(BaseChannel):
 
         header_frame.headers.update({'routing_key':routing_key})
 
+        if MSG_HEADER_CHUNK_ID in header_frame.headers:
+            msg = self._on_deliver_fragment(body, header_frame.headers, delivery_tag)
+            if msg is None:
+                return
+            body, header_frame.headers = msg
+
         #log.debug("RecvChannel._on_deliver, tag: %s, cur recv_queue len %s", delivery_tag, self._recv_queue.qsize())
 
+        if self._ack_batching(delivery_tag):
+            self._unsettled_tags.add(delivery_tag)
+
         # put body, headers, delivery tag (for acking) in the recv queue
         self._recv_queue.put((body, header_frame.headers, delivery_tag))
 
+    def _on_deliver_fragment(self, body, headers, delivery_tag):
+        """
+        Adds a received fragment of a chunked message to the reassembly buffer.
+        Fragments are settled when buffered so that the broker keeps delivering (prefetch), the
+        reassembled message is acked/rejected with the delivery tag of its last fragment.
+        Called from the transport's delivery callback, so settles without the channel lock.
+        Returns the tuple (body, headers) of the reassembled message or None.
+        """
+        if self._reassembler is None:
+            chunking_cfg = CFG.get_safe('container.messaging.chunking') or {}
+            self._reassembler = ChunkReassembler(max_size=int(chunking_cfg.get('max_buffer_size', 500000000)),
+                                                 timeout=float(chunking_cfg.get('reassembly_timeout', 60)))
+        try:
+            msg = self._reassembler.add(body, headers)
+        except ChunkError as ce:
+            log.error("Discarding chunked message on %s: %s", self._recv_name, ce)
+            if not self._consumer_no_ack:
+                self._transport.reject_impl(delivery_tag, requeue=False)
+            return None
+
+        if msg is None:
+            if not self._consumer_no_ack:
+                self._transport.ack_impl(delivery_tag)
+            if self._reassembly_gl is None:
+                self._reassembly_gl = spawn(self._expire_fragments)
+        return msg
+
+    def _expire_fragments(self):
+        """
+        Discards incomplete chunked messages after the reassembly timeout, also when no further
+        fragments arrive. Runs while partial messages are buffered.
+        """
+        try:
+            delay = self._reassembler.expire()
+            while delay is not None:
+                sleep(delay)
+                delay = self._reassembler.expire()
+        finally:
+            self._reassembly_gl = None
+
+    def _ack_batching(self, delivery_tag):
+        """
+        Returns True if acks for this delivery tag are coalesced. Only broker (integer) delivery tags
+        of a channel can be acked with the multiple flag.
+        """
+        return self._ack_batch_size > 1 and isinstance(delivery_tag, (int, long))
+
     def ack(self, delivery_tag):
         """
         Acks a message using the delivery tag.
         Should be called by the EP layer.
+
+        In ack batching mode, the ack is held back until the batch size is reached, the batch interval
+        expires, no more delivered messages are waiting in the recv queue or the channel closes.
         """
         #log.debug("RecvChannel.ack: %s", delivery_tag)
+        if self._ack_batching(delivery_tag):
+            self._unsettled_tags.discard(delivery_tag)
+            self._pending_acks.append(delivery_tag)
+            if len(self._pending_acks) >= self._ack_batch_size or self._recv_queue.qsize() == 0:
+                self.flush_acks()
+            elif self._ack_flush_gl is None:
+                self._ack_flush_gl = spawn(self._ack_flush_timer)
+            return
+
         with self._ensure_transport():
             self._transport.ack_impl(delivery_tag)
 
@@ -764,9 +931,68 @@ class RecvChannel(BaseChannel):
         Should be called by the EP layer.
         """
         #log.debug("RecvChannel.reject: %s", delivery_tag)
+        if self._pending_acks:
+            # Send acks while the rejected tag is still unsettled so that no multiple ack covers it
+            self.flush_acks()
+        self._unsettled_tags.discard(delivery_tag)
+
         with self._ensure_transport():
             self._transport.reject_impl(delivery_tag, requeue=requeue)
 
+    def flush_acks(self):
+        """
+        Sends all pending acks to the broker (ack batching mode).
+
+        Acks below the lowest unsettled delivery tag are coalesced into a single multiple ack,
+        the remaining ones are sent individually.
+        """
+        if not self._pending_acks:
+            return
+        pending = sorted(self._pending_acks)
+        self._pending_acks = []
+        min_unsettled = min(self._unsettled_tags) if self._unsettled_tags else None
+        num_coalesced = len([tag for tag in pending if min_unsettled is None or tag < min_unsettled])
+
+        with self._ensure_transport():
+            if num_coalesced > 1:
+                self._transport.ack_impl(pending[num_coalesced - 1], multiple=True)
+            elif num_coalesced == 1:
+                self._transport.ack_impl(pending[0])
+            for delivery_tag in pending[num_coalesced:]:
+                self._transport.ack_impl(delivery_tag)
+
+    def set_adaptive_prefetch(self, min_count=1, max_count=100, max_wait=1.0, sample_size=20):
+        """
+        Enables adaptive prefetch for this channel, starting at min_count.
+        The channel must have a transport attached.
+        """
+        self._prefetch_ctrl = PrefetchController(min_count=min_count, max_count=max_count,
+                                                 max_wait=max_wait, sample_size=sample_size)
+        self._set_prefetch(self._prefetch_ctrl.prefetch_count)
+
+    def _set_prefetch(self, prefetch_count):
+        #log.debug("RecvChannel._set_prefetch(%s): %s", self._recv_name, prefetch_count)
+        with self._ensure_transport():
+            self._transport.qos_impl(prefetch_count=prefetch_count)
+        self._prefetch_count = prefetch_count
+
+    def _record_prefetch_sample(self, latency, depth):
+        """
+        Feeds a message processing sample to the adaptive prefetch controller and applies a changed prefetch.
+        """
+        new_count = self._prefetch_ctrl.add_sample(latency, depth)
+        if new_count is not None:
+            log.debug("Adaptive prefetch for %s: %s (latency %.4fs)", self._recv_name, new_count, self._prefetch_ctrl.latency)
+            self._set_prefetch(new_count)
+
+    def _ack_flush_timer(self):
+        sleep(self._ack_batch_interval)
+        self._ack_flush_gl = None
+        try:
+            self.flush_acks()
+        except Exception:
+            log.exception("Error sending pending acks")
+
     def get_stats(self):
         """
         Returns a tuple of number of messages, number of consumers for this queue.
@@ -799,7 +1025,7 @@ class PublisherChannel(SendChannel):
         """
         assert self._send_name and self._send_name.exchange
         self._declare_exchange(self._send_name.exchange)
-        SendChannel.send(self, data, headers=headers)
+        return SendChannel.send(self, data, headers=headers)
 
 
 class BidirClientChannel(SendChannel, RecvChannel):
@@ -848,6 +1074,8 @@ class ListenChannel(RecvChannel):
             RecvChannel.__init__(self, name=name, binding=binding, **kwargs)
             self._delivery_tags = set()
             self._parent_channel = parent_channel
+            self._detached = False
+            self._accept_sample = None      # prefetch sample of the parent, recorded when detached messages are settled
 
         def close_impl(self):
             """
@@ -879,25 +1107,50 @@ class ListenChannel(RecvChannel):
             self._delivery_tags.remove(delivery_tag)
 
             if len(self._delivery_tags) == 0:
+                if not self._detached:
+                    self._parent_channel.exit_accept()
+                elif self._accept_sample is not None:
+                    sample, self._accept_sample = self._accept_sample, None
+                    self._parent_channel._record_accept_sample(sample)
+
+        def detach(self):
+            """
+            Transitions the parent channel out of ACCEPTED before the received messages are confirmed,
+            so the parent can accept further messages. The messages must still be acked or rejected
+            via this channel, before the parent channel closes. The adaptive prefetch sample is taken
+            when they are, so that it covers the message processing time.
+            """
+            if not self._detached:
+                self._detached = True
+                self._accept_sample, self._parent_channel._accept_sample = self._parent_channel._accept_sample, None
                 self._parent_channel.exit_accept()
 
         def ack(self, delivery_tag):
             """
             Acks a message - broker discards.
+            In ack batching mode, the parent channel tracks and sends acks.
             """
-            RecvChannel.ack(self, delivery_tag)
+            if self._parent_channel._ack_batching(delivery_tag):
+                self._parent_channel.ack(delivery_tag)
+            else:
+                RecvChannel.ack(self, delivery_tag)
             self._checkin(delivery_tag)
 
         def reject(self, delivery_tag, requeue=False):
             """
             Rejects a message - specify requeue=True to requeue for delivery later.
             """
-            RecvChannel.reject(self, delivery_tag, requeue=requeue)
+            if self._parent_channel._ack_batching(delivery_tag):
+                self._parent_channel.reject(delivery_tag, requeue=requeue)
+            else:
+                RecvChannel.reject(self, delivery_tag, requeue=requeue)
             self._checkin(delivery_tag)
 
     def __init__(self, name=None, binding=None, **kwargs):
         RecvChannel.__init__(self, name=name, binding=binding, **kwargs)
 
+        self._accept_sample = None      # (accept time, local queue depth, num msgs) for adaptive prefetch
+
         # setup ListenChannel specific state transitions
         self._fsm.add_transition(self.I_ENTER_ACCEPT,   self.S_ACTIVE,      None, self.S_ACCEPTED)
         self._fsm.add_transition(self.I_EXIT_ACCEPT,    self.S_ACCEPTED,    None, self.S_ACTIVE)
@@ -972,6 +1225,9 @@ class ListenChannel(RecvChannel):
 
         ms = [self.recv() for x in xrange(n)]
 
+        if self._prefetch_ctrl is not None and was_consuming:
+            self._accept_sample = (time.time(), self._recv_queue.qsize(), n)
+
         ch = self._create_accepted_channel(self._transport, ms)
         map(ch._recv_queue.put, ms)
 
@@ -987,8 +1243,23 @@ class ListenChannel(RecvChannel):
 
         Only should be used by a channel created by accept.
         """
+        if self._accept_sample is not None:
+            sample, self._accept_sample = self._accept_sample, None
+            if self._fsm.current_state == self.S_ACCEPTED:
+                self._record_accept_sample(sample)
+
         self._fsm.process(self.I_EXIT_ACCEPT)
 
+    def _record_accept_sample(self, sample):
+        """
+        Records the time since accept per message of an accept sample for adaptive prefetch.
+        """
+        accept_time, depth, num = sample
+        try:
+            self._record_prefetch_sample((time.time() - accept_time) / num, depth)
+        except Exception:
+            log.exception("Error adapting prefetch")
+
 
 class SubscriberChannel(ListenChannel):
     def close_impl(self):
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+"""
+Chunked transfer of oversized messages.
+Encoded message bodies larger than the chunk size are sent as sequenced fragments over the same
+channel and reassembled by the receiving channel before they are handed to the endpoint layer.
+"""
+
+from collections import OrderedDict
+import time
+import uuid
+
+from gevent.event import AsyncResult
+
+from pyon.core.bootstrap import CFG
+from pyon.util.log import log
+
+
+MSG_HEADER_CHUNK_ID = "chunk-id"
+MSG_HEADER_CHUNK_SEQ = "chunk-seq"
+MSG_HEADER_CHUNK_COUNT = "chunk-count"
+
+# Messages with these performatives (RPC replies) are sent to a queue with exactly one consumer
+REPLY_PERFORMATIVES = ("inform-result", "failure")
+
+
+class ChunkError(StandardError):
+    """
+    Error in a fragment sequence. The partial message is discarded.
+    """
+    pass
+
+
+def get_chunking_config():
+    """ Returns the chunking config if chunked transfer is enabled, None otherwise """
+    config = CFG.get_safe("container.messaging.chunking")
+    if config and config.get("enabled", False) is True:
+        return config
+    return None
+
+
+def is_chunkable(headers, config):
+    """
+    Returns True if a message with these headers may be sent in fragments. Fragments must be
+    received in sequence by a single consumer, so by default only RPC replies are chunked.
+    """
+    return config.get("chunk_all", False) is True or headers.get("performative", None) in REPLY_PERFORMATIVES
+
+
+def get_chunked_message_size(headers):
+    """
+    Returns the max size of an encoded message with these headers if it will be chunked, None otherwise.
+    """
+    config = get_chunking_config()
+    if config is None or not is_chunkable(headers, config):
+        return None
+    return int(config.get("max_message_size", 0))
+
+
+def split_message(body, headers, chunk_size):
+    """
+    Splits a message body into fragments of at most chunk_size bytes.
+    Yields (fragment, headers) with each fragment carrying all original headers, so that fragments
+    are only created as they are sent.
+    """
+    chunk_id = uuid.uuid4().hex
+    chunk_count = (len(body) + chunk_size - 1) // chunk_size
+    for seq in xrange(chunk_count):
+        frag_headers = dict(headers)
+        frag_headers.update({MSG_HEADER_CHUNK_ID: chunk_id,
+                             MSG_HEADER_CHUNK_SEQ: seq,
+                             MSG_HEADER_CHUNK_COUNT: chunk_count})
+        yield body[seq * chunk_size:(seq + 1) * chunk_size], frag_headers
+
+
+def combine_confirms(confirms):
+    """
+    Returns an AsyncResult that is set when all fragment confirms (AsyncResults) are set, or
+    fails with the first fragment failure. Returns the last result if not in confirm mode.
+    """
+    if len(confirms) == 1 or not all(isinstance(confirm, AsyncResult) for confirm in confirms):
+        return confirms[-1]
+
+    msg_confirm = AsyncResult()
+    remaining = [len(confirms)]
+
+    def on_confirm(confirm):
+        if msg_confirm.ready():
+            return
+        if not confirm.successful():
+            msg_confirm.set_exception(confirm.exception)
+            return
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            msg_confirm.set(True)
+
+    for confirm in confirms:
+        confirm.rawlink(on_confirm)
+    return msg_confirm
+
+
+class ChunkReassembler(object):
+    """
+    Reassembles fragmented messages received on one channel. Fragments of a message must arrive
+    in sequence. Partial messages are discarded after a timeout or when the total buffered size
+    would exceed the memory bound.
+    """
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.buffered_size = 0
+        self._partials = OrderedDict()      # chunk id -> (fragments, headers, start time)
+
+    def add(self, body, headers):
+        """
+        Adds a received fragment.
+        Returns the tuple (body, headers) of the reassembled message after the last fragment, None otherwise.
+        @raises ChunkError  If the fragment is out of sequence or exceeds the memory bound
+        """
+        self.expire()
+
+        chunk_id = headers[MSG_HEADER_CHUNK_ID]
+        seq, count = int(headers[MSG_HEADER_CHUNK_SEQ]), int(headers[MSG_HEADER_CHUNK_COUNT])
+        partial = self._partials.get(chunk_id, None)
+        if partial is None:
+            if seq != 0:
+                raise ChunkError("Fragment %s/%s of unknown or discarded message %s" % (seq, count, chunk_id))
+            partial = ([], headers, time.time())
+            self._partials[chunk_id] = partial
+
+        fragments = partial[0]
+        if seq != len(fragments):
+            self._discard(chunk_id)
+            raise ChunkError("Fragment %s/%s out of sequence for message %s" % (seq, count, chunk_id))
+        if self.buffered_size + len(body) > self.max_size:
+            self._discard(chunk_id)
+            raise ChunkError("Reassembly of message %s exceeds the buffer size of %s" % (chunk_id, self.max_size))
+
+        fragments.append(body)
+        self.buffered_size += len(body)
+        if len(fragments) < count:
+            return None
+
+        self._discard(chunk_id)
+        msg_headers = dict(partial[1])
+        for header in (MSG_HEADER_CHUNK_ID, MSG_HEADER_CHUNK_SEQ, MSG_HEADER_CHUNK_COUNT):
+            msg_headers.pop(header, None)
+        return "".join(fragments), msg_headers
+
+    def _discard(self, chunk_id):
+        fragments = self._partials.pop(chunk_id)[0]
+        self.buffered_size -= sum(len(frag) for frag in fragments)
+
+    def expire(self):
+        """
+        Discards partial messages older than the timeout.
+        Returns the seconds until the next partial message expires, None if there is none.
+        """
+        now = time.time()
+        while self._partials:
+            chunk_id, (fragments, headers, start_time) = next(self._partials.iteritems())
+            if start_time + self.timeout > now:
+                return start_time + self.timeout - now
+            log.warn("Discarding incomplete chunked message %s (%s/%s fragments) after timeout",
+                     chunk_id, len(fragments), headers[MSG_HEADER_CHUNK_COUNT])
+            self._discard(chunk_id)
+        return None
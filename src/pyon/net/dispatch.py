@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+"""
+Concurrent dispatch of received messages with per-key ordering.
+"""
+
+from collections import deque
+
+from gevent import getcurrent
+from gevent.lock import BoundedSemaphore
+from gevent.pool import Pool
+
+from pyon.util.log import log
+
+
+class KeyedDispatcher(object):
+    """
+    Runs tasks concurrently in a bounded greenlet pool. Tasks with the same key run one after the
+    other in dispatch order; tasks with key None are not ordered.
+
+    At most max_pending tasks are running or queued behind a running task of the same key, and at
+    most size tasks run at the same time. Dispatching blocks while either bound is reached.
+    """
+    def __init__(self, size, max_pending=None):
+        self.size = size
+        self.max_pending = max_pending or 2 * size
+        self._pool = Pool(size)
+        self._pending = BoundedSemaphore(self.max_pending)
+        self._queues = {}       # key -> deque of (func, args) for keys with a running task
+
+    @property
+    def pending(self):
+        """ Number of tasks running or queued """
+        return self.max_pending - self._pending.counter
+
+    def dispatch(self, key, func, *args):
+        """
+        Runs func(*args) in the pool, after all previously dispatched tasks with the same key completed.
+        Errors in func are logged.
+        """
+        self._pending.acquire()
+        if key is not None:
+            queue = self._queues.get(key, None)
+            if queue is not None:
+                queue.append((func, args))
+                return
+            queue = self._queues[key] = deque([(func, args)])
+        else:
+            queue = deque([(func, args)])
+        self._pool.spawn(self._run, key, queue)
+
+    def _run(self, key, queue):
+        try:
+            while queue:
+                func, args = queue[0]
+                try:
+                    func(*args)
+                except Exception:
+                    log.exception("Error in dispatched task (key=%s)", key)
+                finally:
+                    queue.popleft()
+                    self._pending.release()
+        finally:
+            if key is not None:
+                self._queues.pop(key, None)
+
+    def join(self, timeout=None):
+        """
+        Waits until all dispatched tasks completed. Does not wait when called from a dispatched task.
+        @retval True if all tasks completed
+        """
+        if getcurrent() in self._pool:
+            return False
+        return self._pool.join(timeout=timeout)
@@ -3,22 +3,31 @@
 """Provides the communication layer above channels."""
 
 from gevent import event
+from gevent.event import AsyncResult
 from gevent.lock import RLock
 from gevent.timeout import Timeout
+from gevent import sleep
 from zope import interface
 import uuid
 import inspect
+import time
 from types import MethodType
 import threading
 
 from pyon.core import bootstrap, exception
 from pyon.core.bootstrap import CFG, IonObject
 from pyon.core.exception import ExceptionFactory, IonException, BadRequest, Unauthorized
-from pyon.net.channel import ChannelClosedError, PublisherChannel, ListenChannel, SubscriberChannel, ServerChannel, BidirClientChannel
-from pyon.core.interceptor.interceptor import Invocation, process_interceptors
+from pyon.net.channel import ChannelClosedError, PublisherChannel, ListenChannel, SubscriberChannel, ServerChannel, BidirClientChannel, RecvChannel
+from pyon.core.interceptor.compress import CompressInterceptor
+from pyon.core.interceptor.encode import EncodeInterceptor
+from pyon.core.interceptor.interceptor import Invocation, process_interceptors, materialize_payload, \
+    compile_interceptors, process_pipeline
+from pyon.util.async import spawn
 from pyon.util.containers import get_ion_ts, get_ion_ts_millis
 from pyon.util.log import log
-from pyon.net.transport import NameTrio, BaseTransport, XOTransport
+from pyon.net.dispatch import KeyedDispatcher
+from pyon.net.spool import get_spool, get_spool_config
+from pyon.net.transport import NameTrio, BaseTransport, XOTransport, TransportError
 
 # create special logging category for RPC message tracking
 import logging
@@ -31,6 +40,12 @@ callback_msg_in = None
 MSG_HEADER_PROTOCOL_RPC = "rpc"
 MSG_HEADER_LANGUAGE_DEFAULT = "scioncc"
 MSG_HEADER_ENCODING_DEFAULT = "msgpack"
+MSG_HEADER_BATCH = "batch-size"     # Set on batch envelopes, whose body is a list of [msg, headers]
+
+# Publisher behavior while the broker blocks publishing (flow control)
+FLOW_POLICY_NONE = "none"       # Publish anyway (messages are buffered by the client library)
+FLOW_POLICY_BLOCK = "block"     # Wait until unblocked, fail after timeout
+FLOW_POLICY_FAIL = "fail"       # Fail immediately
 
 
 # -----------------------------------------------------------------------------
@@ -60,6 +75,7 @@ class EndpointUnit(object):
     channel = None
     _endpoint = None
     _interceptors = None
+    _pipelines = None
 
     def __init__(self, endpoint=None, interceptors=None):
         self._endpoint = endpoint
@@ -77,6 +93,22 @@ class EndpointUnit(object):
     @interceptors.setter
     def interceptors(self, value):
         self._interceptors = value
+        self._pipelines = None
+
+    def get_interceptor_pipeline(self, stack):
+        """
+        Returns the compiled interceptor pipeline for the named stack (e.g. message_incoming).
+        Uses the pipelines of the endpoint, unless this unit has its own interceptors.
+        """
+        if self._interceptors is None and self._endpoint is not None:
+            return self._endpoint.get_interceptor_pipeline(stack)
+
+        if self._pipelines is None:
+            self._pipelines = {}
+        pipeline = self._pipelines.get(stack, None)
+        if pipeline is None:
+            pipeline = self._pipelines[stack] = compile_interceptor_stack(self.interceptors, stack, self._endpoint)
+        return pipeline
 
     def attach_channel(self, channel):
         self.channel = channel
@@ -123,7 +155,7 @@ class EndpointUnit(object):
         @param inv      An Invocation instance.
         @returns        A processed Invocation instance.
         """
-        inv_prime = process_interceptors(self.interceptors["message_incoming"] if "message_incoming" in self.interceptors else [], inv)
+        inv_prime = process_pipeline(self.get_interceptor_pipeline("message_incoming"), inv)
         return inv_prime
 
     def message_received(self, msg, headers):
@@ -189,7 +221,7 @@ class EndpointUnit(object):
         @param  inv     An Invocation instance.
         @returns        A processed Invocation instance.
         """
-        inv_prime = process_interceptors(self.interceptors["message_outgoing"] if "message_outgoing" in self.interceptors else [], inv)
+        inv_prime = process_pipeline(self.get_interceptor_pipeline("message_outgoing"), inv)
         return inv_prime
 
     def close(self):
@@ -244,6 +276,8 @@ class BaseEndpoint(object):
     node = None     # connection to the broker, basically
 
     _interceptors = None
+    _pipelines = None
+    _pipelines_source = None     # interceptors the pipelines were compiled from
 
     def __init__(self, node=None, transport=None):
         self.node = node
@@ -287,6 +321,27 @@ class BaseEndpoint(object):
     @interceptors.setter
     def interceptors(self, value):
         self._interceptors = value
+        self._pipelines = None
+
+    def get_interceptor_pipeline(self, stack):
+        """
+        Returns the interceptor pipeline for the named stack (e.g. message_incoming), compiled once
+        per endpoint into a list of bound interceptor functions. Interceptors that declare themselves
+        not applicable to this endpoint are left out.
+        """
+        interceptors = self.interceptors
+        if self._pipelines is None or self._pipelines_source is not interceptors:
+            self._pipelines, self._pipelines_source = {}, interceptors
+        pipeline = self._pipelines.get(stack, None)
+        if pipeline is None:
+            pipeline = self._pipelines[stack] = compile_interceptor_stack(interceptors, stack, self)
+        return pipeline
+
+    def get_interceptor_pipelines(self):
+        """
+        Returns all compiled interceptor pipelines of this endpoint by stack name (for introspection).
+        """
+        return {stack: self.get_interceptor_pipeline(stack) for stack in self.interceptors}
 
     def create_endpoint(self, to_name=None, existing_channel=None, **kwargs):
         """
@@ -406,7 +461,7 @@ class MessageObject(object):
         self.endpoint = ep_unit    # Actually an EndpointUnit
 
         self.raw_body, self.raw_headers, self.delivery_tag = msgtuple
-        self.body = None
+        self._body = None
         self.headers = None
         self.error = None
 
@@ -418,7 +473,7 @@ class MessageObject(object):
         Runs received raw message through the endpoint's interceptors.
         """
         try:
-            self.body, self.headers = self.endpoint.intercept_in(self.raw_body, self.raw_headers)
+            self._body, self.headers = self.endpoint.intercept_in(self.raw_body, self.raw_headers)
         except Exception as ex:
             # This could be the policy interceptor raising Unauthorized
             if isinstance(ex, Unauthorized):
@@ -427,6 +482,18 @@ class MessageObject(object):
                 log.info("Error in inbound message interceptors", exc_info=True)
             self.error = ex
 
+    @property
+    def body(self):
+        """
+        The message body after the interceptors. A lazily decoded body is decoded on first access.
+        """
+        self._body = materialize_payload(self._body)
+        return self._body
+
+    @body.setter
+    def body(self, value):
+        self._body = value
+
     def ack(self):
         """
         Passthrough to underlying channel's ack.
@@ -456,7 +523,7 @@ class MessageObject(object):
             log.info("Refusing to deliver a MessageObject with an error")
             return
 
-        self.endpoint._message_received(self.body, self.headers)
+        self.endpoint._message_received(self._body, self.headers)
 
 
 class ListeningBaseEndpoint(BaseEndpoint):
@@ -465,7 +532,10 @@ class ListeningBaseEndpoint(BaseEndpoint):
     """
     channel_type = ListenChannel
 
-    def __init__(self, node=None, from_name=None, binding=None, transport=None, auto_delete=None):
+    def __init__(self, node=None, from_name=None, binding=None, transport=None, auto_delete=None, prefetch=None):
+        """
+        @param  prefetch    Optional dict overriding container.messaging.endpoint.adaptive_prefetch for this endpoint
+        """
         BaseEndpoint.__init__(self, node=node, transport=transport)
 
         # Set origin as NameTrio - can also be an XO
@@ -485,6 +555,9 @@ class ListeningBaseEndpoint(BaseEndpoint):
         self._active_event = event.Event()
         self._binding = binding
         self._chan = None
+        self._prefetch = prefetch
+        self._dispatcher = None     # KeyedDispatcher for concurrent message processing, set by derived classes
+        self._dispatch_key = None
 
     def _create_channel(self, **kwargs):
         """
@@ -535,7 +608,11 @@ class ListeningBaseEndpoint(BaseEndpoint):
             m = None
             try:
                 m = self.get_one_msg()
-                m.route()       # call default handler
+                if self._dispatcher is not None:
+                    self._dispatch_msg(m)
+                    m = None    # acked when processed
+                else:
+                    m.route()       # call default handler
 
             except ChannelClosedError as ex:
                 break
@@ -544,6 +621,30 @@ class ListeningBaseEndpoint(BaseEndpoint):
                 if m is not None:
                     m.ack()
 
+    def _dispatch_msg(self, m):
+        """
+        Hands a received message to the dispatcher, which routes it concurrently with other messages
+        (in order with messages of the same dispatch key) and acks it afterwards.
+        """
+        key = None
+        if m.error is None and self._dispatch_key is not None:
+            if callable(self._dispatch_key):
+                try:
+                    key = self._dispatch_key(m.body, m.headers)
+                except Exception:
+                    log.exception("Error getting dispatch key, dispatching message unordered")
+            else:
+                key = m.headers.get(self._dispatch_key, None)
+
+        m.endpoint.channel.detach()
+        self._dispatcher.dispatch(key, self._route_dispatched, m)
+
+    def _route_dispatched(self, m):
+        try:
+            m.route()
+        finally:
+            m.ack()
+
     def prepare_listener(self, binding=None, activate=True):
         """ Creates a channel, prepares it i.e. declares the queue and binding,
         and optionally creates a consumer on it. """
@@ -573,9 +674,29 @@ class ListeningBaseEndpoint(BaseEndpoint):
         Begins consuming. Can only be called after initialize.
         """
         assert self._chan
+        if self._chan._prefetch_ctrl is None:
+            self._setup_prefetch()
+            if self._dispatcher is not None and self._chan._prefetch_ctrl is None:
+                # Messages are unacked until processed, so the broker must deliver enough of them.
+                # A larger prefetch already set on the channel is kept
+                prefetch_count = max(self._chan._prefetch_count or 0, self._dispatcher.max_pending)
+                if prefetch_count != self._chan._prefetch_count:
+                    self._chan._set_prefetch(prefetch_count)
         self._chan.start_consume()
         self._active_event.set()
 
+    def _setup_prefetch(self):
+        """
+        Enables adaptive prefetch on the channel if configured, with endpoint specific overrides.
+        """
+        prefetch_cfg = dict(CFG.get_safe('container.messaging.endpoint.adaptive_prefetch') or {})
+        prefetch_cfg.update(self._prefetch or {})
+        if prefetch_cfg.pop('enabled', False) is True:
+            if self._dispatcher is not None:
+                # Adaptive prefetch stays at or above the dispatch_max_pending floor
+                prefetch_cfg['min_count'] = max(int(prefetch_cfg.get('min_count', 1)), self._dispatcher.max_pending)
+            self._chan.set_adaptive_prefetch(**prefetch_cfg)
+
     def deactivate(self):
         """
         Stops consuming. Can only be called after initialize and activate.
@@ -660,6 +781,8 @@ class ListeningBaseEndpoint(BaseEndpoint):
         return self._get_n_msgs(n, timeout=timeout)
 
     def close(self):
+        if self._dispatcher is not None and not self._dispatcher.join(timeout=10):
+            log.warn("Dispatched messages not processed before closing listen channel (%s)", self._recv_name)
         BaseEndpoint.close(self)
         ev = self._chan.close()
 
@@ -681,55 +804,295 @@ class ListeningBaseEndpoint(BaseEndpoint):
         return self._chan.get_stats()
 
 
+def compile_interceptor_stack(interceptors, stack, endpoint=None):
+    """
+    Compiles the named stack (e.g. message_incoming) of the given interceptor stacks into a pipeline.
+    The path (incoming/outgoing) is determined by the stack name suffix.
+    """
+    path = stack.rsplit("_", 1)[-1]
+    return compile_interceptors(interceptors[stack] if stack in interceptors else [], path, endpoint=endpoint)
+
+
+def get_local_interceptors(interceptors):
+    """
+    Returns interceptor stacks for same-container delivery, without message encoding interceptors.
+    """
+    return {stack: [i for i in stack_list if not isinstance(i, (EncodeInterceptor, CompressInterceptor))]
+            for stack, stack_list in interceptors.iteritems()}
+
+
 # -----------------------------------------------------------------------------
 # PUBLISH/SUBSCRIBE
 #
 
 class PublisherEndpointUnit(EndpointUnit):
-    pass
+
+    def _send(self, msg, headers=None, **kwargs):
+        """
+        Override to return the publish confirmation of the channel.
+
+        @returns    An AsyncResult set when the broker confirmed the message if the channel is in
+                    confirm mode, None otherwise.
+        """
+        new_msg, new_headers = self.intercept_out(msg, headers)
+
+        # Provide a hook for all outgoing messages before they hit transport
+        trigger_msg_out_callback(new_msg, new_headers, self)
+
+        if self._endpoint is not None and self._endpoint.spool is not None:
+            return self._endpoint._spool_send(self.channel, new_msg, new_headers)
+        return self.channel.send(new_msg, new_headers)
 
 
 class Publisher(SendingBaseEndpoint):
     """
     Simple publisher sends out broadcast messages.
+
+    Optionally batches messages: with batch_size > 1, messages are buffered per destination and
+    sent as one envelope message when batch_size messages are buffered or batch_interval seconds
+    have passed since the first one. Subscribers unpack envelopes and receive each message separately.
+
+    With confirm=True, the publish channel is put in publisher confirm mode (if supported by the
+    transport) and publish returns an AsyncResult that is set when the broker confirmed the message
+    (or its batch), or raises TransportError if the broker rejected it. Publishing does not wait.
+
+    With spool=True (default from config container.messaging.spool.enabled), encoded messages that
+    fail to publish are appended to a local disk spool and replayed in order in the background until
+    publishing succeeds again. While messages are spooled, new messages are spooled behind them.
+    Spooled messages are not confirmed (publish returns None). Publishing raises SpoolFullError if
+    the spool reached its max size.
+
+    With flow_policy block or fail (default from config container.messaging.flow_control), publish
+    waits up to flow_timeout seconds or fails immediately with TransportError while the broker blocks
+    publishing on the connection. With a spool, messages are spooled instead. Counters and
+    high-watermarks are available via get_flow_stats().
     """
 
     endpoint_unit_type = PublisherEndpointUnit
     channel_type = PublisherChannel
 
-    def __init__(self, **kwargs):
+    def __init__(self, batch_size=0, batch_interval=0.1, confirm=False, spool=None, flow_policy=None,
+                 flow_timeout=None, **kwargs):
         self._pub_ep = None   # A cached EndpointUnit for publishing to the default to_name
+        self._replay_ep = None
+        self._spool_enabled = spool
+        self.spool = None
+        self._batch_size = batch_size
+        self._batch_interval = batch_interval
+        self._batches = {}    # destination key -> (to_name, list of [msg, headers], batch confirm)
+        self._flush_gl = None
+        self._confirm = confirm
+        self._lock = RLock()
         SendingBaseEndpoint.__init__(self, **kwargs)
 
+        flow_cfg = CFG.get_safe("container.messaging.flow_control") or {}
+        self._flow_policy = flow_policy or flow_cfg.get("policy", FLOW_POLICY_NONE)
+        if self._flow_policy not in (FLOW_POLICY_NONE, FLOW_POLICY_BLOCK, FLOW_POLICY_FAIL):
+            raise BadRequest("Unknown flow control policy: %s" % self._flow_policy)
+        self._flow_timeout = flow_timeout if flow_timeout is not None else float(flow_cfg.get("timeout", 10.0))
+        self.flow_stats = dict(blocked=0, failed=0, waiting=0, max_waiting=0, wait_time=0.0, max_wait_time=0.0)
+
+        spool_cfg = get_spool_config()
+        if self._spool_enabled is not False and (spool_cfg or self._spool_enabled):
+            self.spool = get_spool(self._get_spool_name(), spool_cfg or CFG.get_safe("container.messaging.spool", {}))
+            if self.spool.pending:
+                self.spool.start_replay(self._replay_send)
+
+    def _get_spool_name(self):
+        if self._send_name is None:
+            return "default"
+        return ".".join(str(part) for part in (self._send_name.exchange, self._send_name.binding) if part)
+
     def publish(self, msg, to_name=None, headers=None):
+        """
+        Publishes a message to the given or default to_name.
+        @retval In confirm mode, an AsyncResult for the broker confirmation, otherwise None
+        """
         if to_name is not None:
             to_name = self._ensure_name_trio(to_name)
 
-        ep_unit = None
+        self._wait_flow()
+
+        if self._batch_size > 1:
+            return self._publish_batched(msg, to_name, headers)
+        else:
+            return self._publish(msg, to_name, headers)
+
+    def _get_pub_ep(self, to_name=None):
+        if self._pub_ep is None:         # Create the default publish EndpointUnit
+            # Check that we got a to_name (_send_name) in the constructor
+            send_name = self._send_name or to_name
+            if send_name is None:
+                raise EndpointError("Publisher has no address to send to")
+
+            self._pub_ep = self.create_endpoint(send_name)
+            self._pub_ep.channel.connect(send_name)
+            if self._confirm and not self._pub_ep.channel.enable_confirms():
+                log.warn("Publisher confirms not supported by transport, publishing unconfirmed")
+
+        return self._pub_ep
+
+    def _publish(self, msg, to_name=None, headers=None):
         if to_name is None:
             # We can use the default publish EndpointUnit
+            return self._get_pub_ep().send(msg, headers)
 
-            if self._pub_ep is None:         # Create the default publish EndpointUnit
-                # Check that we got a to_name (_send_name) in the constructor
-                if self._send_name is None:
-                    raise EndpointError("Publisher has no address to send to")
+        if self._confirm:
+            # Send over the default channel in confirm mode, keeping outstanding confirms
+            with self._lock:
+                ep_unit = self._get_pub_ep(to_name)
+                ep_unit.channel.connect(to_name)
+                try:
+                    return ep_unit.send(msg, headers)
+                finally:
+                    if self._send_name is not None:
+                        ep_unit.channel.connect(self._send_name)
+
+        ep_unit = self.create_endpoint(to_name)
+        ep_unit.channel.connect(to_name)
+        confirm = ep_unit.send(msg, headers)
+        ep_unit.close()
+        return confirm
+
+    def _flow_blocked(self):
+        if self._flow_policy == FLOW_POLICY_NONE:
+            return False
+        self._ensure_node()
+        return self.node.is_blocked()
+
+    def _wait_flow(self):
+        """
+        Applies the flow control policy while the broker blocks publishing.
+        @raises TransportError  If failing fast, or still blocked after the timeout
+        """
+        if self.spool is not None or not self._flow_blocked():
+            return
 
-                self._pub_ep = self.create_endpoint(self._send_name)
-                self._pub_ep.channel.connect(self._send_name)
+        stats = self.flow_stats
+        stats["blocked"] += 1
+        if self._flow_policy == FLOW_POLICY_FAIL:
+            stats["failed"] += 1
+            raise TransportError("Broker blocks publishing (flow control): %s" % self.node.flow_blocked)
 
-            ep_unit = self._pub_ep
-        else:
-            ep_unit = self.create_endpoint(to_name)
-            ep_unit.channel.connect(to_name)
+        stats["waiting"] += 1
+        stats["max_waiting"] = max(stats["max_waiting"], stats["waiting"])
+        start_time = time.time()
+        try:
+            unblocked = self.node.wait_unblocked(self._flow_timeout)
+        finally:
+            wait_time = time.time() - start_time
+            stats["waiting"] -= 1
+            stats["wait_time"] += wait_time
+            stats["max_wait_time"] = max(stats["max_wait_time"], wait_time)
+        if not unblocked:
+            stats["failed"] += 1
+            raise TransportError("Broker still blocks publishing after %s sec (flow control): %s" % (
+                self._flow_timeout, self.node.flow_blocked))
+
+    def get_flow_stats(self):
+        """ Returns a dict with flow control counters and high-watermarks of this publisher """
+        return dict(self.flow_stats)
+
+    def _spool_send(self, channel, body, headers):
+        """
+        Sends an encoded message over the given channel, or appends it to the spool if
+        publishing fails, the broker blocks publishing or earlier messages are still spooled.
+        """
+        name = channel._send_name
+        if not self.spool.pending and not self._flow_blocked():
+            try:
+                return channel.send(body, headers)
+            except Exception as ex:
+                log.warn("Publish to %s failed, spooling messages: %s", name, ex)
+                if self._pub_ep is not None and self._pub_ep.channel is channel:
+                    self._discard_ep(self._pub_ep)
+                    self._pub_ep = None
+
+        self.spool.append((name.exchange, name.queue, name.binding), body, headers)
+        self.spool.start_replay(self._replay_send)
+        return None
+
+    def _replay_send(self, name, body, headers):
+        """ Publishes a spooled message over a dedicated channel, without interceptors """
+        if self._flow_blocked():
+            raise TransportError("Broker blocks publishing (flow control)")
+        name = NameTrio(*name)
+        if self._replay_ep is None:
+            self._replay_ep = self.create_endpoint(name)
+        try:
+            self._replay_ep.channel.connect(name)
+            self._replay_ep.channel.send(body, headers)
+        except Exception:
+            self._discard_ep(self._replay_ep)
+            self._replay_ep = None
+            raise
 
-        ep_unit.send(msg, headers)
-        if ep_unit != self._pub_ep:
+    def _discard_ep(self, ep_unit):
+        try:
             ep_unit.close()
+        except Exception:
+            log.debug("Error closing failed publish channel", exc_info=True)
+
+    def _publish_batched(self, msg, to_name, headers):
+        key = (to_name.exchange, to_name.queue, to_name.binding) if to_name is not None else None
+        batch = self._batches.get(key, None)
+        if batch is None:
+            batch = self._batches[key] = (to_name, [], AsyncResult() if self._confirm else None)
+
+        msg_headers = dict(headers) if headers else {}
+        msg_headers.setdefault('ts', get_ion_ts())
+        batch[1].append([msg, msg_headers])
+
+        if len(batch[1]) >= self._batch_size:
+            self._flush_batch(key)
+        elif self._flush_gl is None:
+            self._flush_gl = spawn(self._flush_timer)
+        return batch[2]
+
+    def _flush_timer(self):
+        sleep(self._batch_interval)
+        self._flush_gl = None
+        try:
+            self.flush()
+        except Exception:
+            log.exception("Error publishing message batch")
+
+    def _flush_batch(self, key):
+        # Take the batch under the lock, so that concurrent flushes (timer, size, close) send it only once
+        with self._lock:
+            batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+        to_name, msgs, batch_confirm = batch
+        try:
+            confirm = self._publish(msgs, to_name, {MSG_HEADER_BATCH: len(msgs)})
+        except Exception as ex:
+            if batch_confirm is not None:
+                batch_confirm.set_exception(ex)
+            raise
+        if batch_confirm is not None:
+            if confirm is not None:
+                confirm.rawlink(batch_confirm)
+            else:
+                batch_confirm.set(True)
+
+    def flush(self):
+        """ Sends all buffered messages. """
+        for key in self._batches.keys():
+            self._flush_batch(key)
 
     def close(self):
         """ Closes the opened publishing channel, if we've opened it previously. """
+        if self._flush_gl is not None:
+            self._flush_gl.kill()
+            self._flush_gl = None
+        if self._batches:
+            self.flush()
         if self._pub_ep:
             self._pub_ep.close()
+        if self._replay_ep and not (self.spool and self.spool.pending):
+            self._replay_ep.close()
+            self._replay_ep = None
 
 
 class SubscriberEndpointUnit(EndpointUnit):
@@ -750,6 +1113,16 @@ class SubscriberEndpointUnit(EndpointUnit):
         EndpointUnit.message_received(self, msg, headers)
         assert self._callback, "No callback provided, cannot route subscribed message"
 
+        msg = materialize_payload(msg)
+        if MSG_HEADER_BATCH in headers:
+            # Unpack batch envelope, invoking callback for each message with its own headers
+            for batch_msg, batch_headers in msg:
+                msg_headers = headers.copy()
+                del msg_headers[MSG_HEADER_BATCH]
+                msg_headers.update(batch_headers)
+                self._make_routing_call(self._callback, None, batch_msg, msg_headers)
+            return
+
         self._make_routing_call(self._callback, None, msg, headers)
 
     def _make_routing_call(self, call, timeout, *op_args, **op_kwargs):
@@ -768,17 +1141,28 @@ class Subscriber(ListeningBaseEndpoint):
 
     Known queue:  name=(xp, thename), binding=None
     New queue:    name=None or (xp, None), binding=your binding
+
+    With dispatch_size > 1, callbacks run concurrently in a pool of that size, while messages with
+    the same dispatch key are processed in order. Messages are acked after their callback completed.
+    Callbacks routed into a process control thread (routing_call) are still executed one at a time.
     """
 
     endpoint_unit_type = SubscriberEndpointUnit
     channel_type = SubscriberChannel
 
-    def __init__(self, callback=None, **kwargs):
+    def __init__(self, callback=None, dispatch_size=0, dispatch_key=None, dispatch_max_pending=None, **kwargs):
         """
         @param  callback should be a callable with two args: msg, headers
+        @param  dispatch_size   Number of callbacks run concurrently (0 or 1 to run callbacks in the listen loop)
+        @param  dispatch_key    Header name or callable with args msg, headers returning the key of messages that
+                                must be processed in order. Messages without key (None) are not ordered.
+        @param  dispatch_max_pending  Max messages received but not processed (default 2 * dispatch_size)
         """
         self._callback = callback
         ListeningBaseEndpoint.__init__(self, **kwargs)
+        if dispatch_size > 1:
+            self._dispatcher = KeyedDispatcher(dispatch_size, max_pending=dispatch_max_pending)
+            self._dispatch_key = dispatch_key
 
     def create_endpoint(self, **kwargs):
         return ListeningBaseEndpoint.create_endpoint(self, callback=self._callback, **kwargs)
@@ -807,10 +1191,114 @@ class BidirectionalListeningEndpointUnit(EndpointUnit):
 #  REQUEST-RESPONSE and RPC
 #
 
+class ReplyListener(object):
+    """
+    Long-lived reply queue and consumer shared by all requests sent via a node.
+    Received responses are demultiplexed to the waiting requests by conv-id.
+    Avoids setting up and tearing down a reply consumer for every RPC call.
+    """
+
+    def __init__(self, node):
+        self.node = node
+        self.reply_to = None
+        self._chan = None
+        self._recv_gl = None
+        self._pending = {}      # conv-id -> AsyncResult
+
+    def start(self):
+        sys_ex = "%s.%s" % (bootstrap.get_sys_name(), CFG.get_safe('exchange.core.system_xs', 'system'))
+        self._chan = self.node.channel(RecvChannel)
+        self._chan.queue_auto_delete = True
+        self._chan._consumer_exclusive = True
+        self._chan.setup_listener(NameTrio(sys_ex, "rpc_reply_" + uuid.uuid4().hex))
+        self._chan.start_consume()
+        self.reply_to = "%s,%s" % (self._chan._recv_name.exchange, self._chan._recv_name.queue)
+        self._recv_gl = spawn(self._recv_loop)
+        log.debug("Shared RPC reply queue started: %s", self.reply_to)
+
+    def close(self):
+        if self._chan is not None:
+            self._chan.close()
+            self._chan = None
+        for ar in self._pending.itervalues():
+            ar.set_exception(ChannelClosedError("Shared reply queue closed"))
+        self._pending.clear()
+
+    def register(self, conv_id):
+        """
+        Registers interest in the response to a request with the given conv-id.
+        @return An AsyncResult set to the 3-tuple of raw response body, headers and delivery tag.
+        """
+        ar = AsyncResult()
+        self._pending[conv_id] = ar
+        return ar
+
+    def cancel(self, conv_id):
+        self._pending.pop(conv_id, None)
+
+    def _recv_loop(self):
+        chan = self._chan
+        try:
+            while True:
+                try:
+                    rmsg, rheaders, rdtag = chan.recv()
+                except ChannelClosedError:
+                    break
+                except Exception:
+                    log.exception("Shared RPC reply queue %s failed to receive", self.reply_to)
+                    break
+
+                try:
+                    chan.ack(rdtag)
+
+                    ar = self._pending.pop(rheaders.get('conv-id', None), None)
+                    if ar is None:
+                        log.warn("Discarding unknown message, likely from a previous timed out request (conv-id: %s, seq: %s, perf: %s)",
+                                 rheaders.get('conv-id', "unset"), rheaders.get('conv-seq', 'unset'), rheaders.get('performative', 'unset'))
+                        continue
+                    ar.set((rmsg, rheaders, rdtag))
+                except Exception:
+                    log.exception("Error handling message on shared RPC reply queue %s", self.reply_to)
+        finally:
+            self._stopped()
+
+    def _stopped(self):
+        """
+        Called when the receive loop exits. Detaches this listener from the node so that
+        the next request starts a new one, and fails all requests still waiting for a response.
+        """
+        with self.node._lock:
+            if self.node.reply_listener is self:
+                self.node.reply_listener = None
+        pending, self._pending = self._pending, {}
+        for ar in pending.itervalues():
+            ar.set_exception(ChannelClosedError("Shared reply queue stopped"))
+        if self._chan is not None:
+            try:
+                self._chan.close()
+            except Exception:
+                log.debug("Error closing shared reply queue channel", exc_info=True)
+            self._chan = None
+
+
+def get_reply_listener(node):
+    """
+    Returns the given node's shared reply listener, starting it on first use.
+    """
+    with node._lock:
+        if node.reply_listener is None:
+            reply_listener = ReplyListener(node)
+            reply_listener.start()
+            node.reply_listener = reply_listener
+    return node.reply_listener
+
+
 class RequestEndpointUnit(BidirectionalEndpointUnit):
     """
     A request-response interaction, requester side.
     """
+    _reply_listener = None
+    _reply_ar = None
 
     def _get_response(self, conv_id, timeout):
         """
@@ -819,6 +1307,9 @@ class RequestEndpointUnit(BidirectionalEndpointUnit):
         @raises Timeout
         @return A 2-tuple of the received message body and received message headers.
         """
+        if self._reply_ar is not None:
+            return self._get_shared_response(conv_id, timeout)
+
         with Timeout(seconds=timeout):
 
             # start consuming
@@ -839,14 +1330,70 @@ class RequestEndpointUnit(BidirectionalEndpointUnit):
 
                 # is this the message we are looking for?
                 if 'conv-id' in nh and nh['conv-id'] == conv_id:
-                    return nm, nh   # breaks loop
+                    return materialize_payload(nm), nh   # breaks loop
                 else:
                     log.warn("Discarding unknown message, likely from a previous timed out request (conv-id: %s, seq: %s, perf: %s)",
                              nh.get('conv-id', "unset"), nh.get('conv-seq', 'unset'), nh.get('performative', 'unset'))
 
+    def _get_shared_response(self, conv_id, timeout):
+        """
+        Gets a response message to the conv_id from the node's shared reply queue.
+        """
+        try:
+            rmsg, rheaders, rdtag = self._reply_ar.get(timeout=timeout)
+        except Timeout:
+            self._reply_listener.cancel(conv_id)
+            raise
+        finally:
+            self._reply_ar = None
+
+        # Provide a hook for any message received
+        trigger_msg_in_callback(rmsg, rheaders, rdtag, self)
+
+        nm, nh = self.intercept_in(rmsg, rheaders)
+        return materialize_payload(nm), nh
+
+    def _use_shared_reply_queue(self, headers):
+        return CFG.get_safe('container.messaging.rpc.shared_reply_queue', False) is True and \
+            'conv-id' in headers and self._endpoint is not None and self._endpoint.node is not None
+
     def _send(self, msg, headers=None, **kwargs):
         """ Handles an RPC send with response timeout """
+        timeout, sent_headers = self._send_request(msg, headers=headers, **kwargs)
+        return self._recv_response(headers, sent_headers, timeout)
+
+    def send_async(self, msg, headers=None, **kwargs):
+        """
+        Sends a request without waiting for the response, which is received in a separate greenlet.
+        Multiple requests can be pipelined this way. The endpoint unit is closed once the response
+        was received or the request timed out.
 
+        @return An AsyncResult that is set to the response message body or the error.
+        """
+        _msg, _header = self._build_msg(msg, headers)
+        if headers:
+            _header.update(headers)
+        timeout, sent_headers = self._send_request(_msg, _header, **kwargs)
+
+        ar = AsyncResult()
+        spawn(self._recv_response_async, ar, _header, sent_headers, timeout)
+        return ar
+
+    def _recv_response_async(self, ar, headers, sent_headers, timeout):
+        try:
+            result_data, _ = self._recv_response(headers, sent_headers, timeout)
+            ar.set(result_data)
+        except Exception as ex:
+            ar.set_exception(ex)
+        finally:
+            self.close()
+
+    def _send_request(self, msg, headers=None, **kwargs):
+        """
+        Sends the request and sets up the listener for the response.
+
+        @return A 2-tuple of the response timeout and the headers actually sent.
+        """
         # could have a specified timeout in kwargs
         if 'timeout' in kwargs and kwargs['timeout'] is not None:
             timeout = kwargs['timeout']
@@ -855,6 +1402,19 @@ class RequestEndpointUnit(BidirectionalEndpointUnit):
 
         # we have a timeout, update reply-by header
         headers['reply-by'] = str(int(headers['ts']) + int(timeout * 1000))
+        if self._use_shared_reply_queue(headers):
+            # Response arrives on the node's long-lived reply queue; no per-request listener needed
+            self._reply_listener = get_reply_listener(self._endpoint.node)
+            headers['reply-to'] = self._reply_listener.reply_to
+            self._reply_ar = self._reply_listener.register(headers['conv-id'])
+            try:
+                _, sent_headers = BidirectionalEndpointUnit._send(self, msg, headers=headers)
+            except Exception:
+                self._reply_listener.cancel(headers['conv-id'])
+                self._reply_ar = None
+                raise
+            return timeout, sent_headers
+
         if self.channel._recv_name is None:
             # Only set name when channel is new.
             # Create a name for the sender/queue for the response to arrive back
@@ -867,6 +1427,14 @@ class RequestEndpointUnit(BidirectionalEndpointUnit):
         # Call base _send, and get back the actual headers that were sent.
         # Extract the conv-id so we can tell the listener what is valid.
         _, sent_headers = BidirectionalEndpointUnit._send(self, msg, headers=headers)
+        return timeout, sent_headers
+
+    def _recv_response(self, headers, sent_headers, timeout):
+        """
+        Waits for the response to a sent request, correlated by conv-id.
+
+        @return A 2-tuple of the received message body and received message headers.
+        """
         try:
             result_data, result_headers = self._get_response(sent_headers['conv-id'], timeout)
         except Timeout:
@@ -903,6 +1471,19 @@ class RequestResponseClient(SendingBaseEndpoint):
             ep_unit.close()
         return retval
 
+    def request_async(self, msg, headers=None, timeout=None):
+        """
+        Sends a request and returns immediately without waiting for the response.
+
+        @return An AsyncResult for the response. Use get() or gather() to wait for it.
+        """
+        ep_unit = self.create_endpoint(self._send_name)
+        try:
+            return ep_unit.send_async(msg, headers=headers, timeout=timeout)
+        except Exception:
+            ep_unit.close()
+            raise
+
 
 class ResponseEndpointUnit(BidirectionalListeningEndpointUnit):
     """
@@ -940,13 +1521,16 @@ class RPCRequestEndpointUnit(RequestEndpointUnit):
     """
     exception_factory = ExceptionFactory()
 
-    def _send(self, msg, headers=None, **kwargs):
+    def _send_request(self, msg, headers=None, **kwargs):
         log_message("MESSAGE SEND >>> RPC-request", msg, headers, is_send=True)
 
+        return RequestEndpointUnit._send_request(self, msg, headers=headers, **kwargs)
+
+    def _recv_response(self, headers, sent_headers, timeout):
         ######
-        ###### THIS IS WHERE A BLOCKING RPC REQUEST IS PERFORMED ######
+        ###### THIS IS WHERE A BLOCKING RPC REQUEST WAITS FOR ITS RESPONSE ######
         ######
-        res, res_headers = RequestEndpointUnit._send(self, msg, headers=headers, **kwargs)
+        res, res_headers = RequestEndpointUnit._recv_response(self, headers, sent_headers, timeout)
 
         log_message("MESSAGE RECV >>> RPC-reply", res, res_headers, is_send=False)
 
@@ -1071,9 +1655,17 @@ class RPCClient(RequestResponseClient):
             ionobj = IonObject(in_obj, **kwargs)
             return self.request(ionobj, op=name, headers=headers)
 
+        def svcmethod_async(self, *args, **kwargs):
+            if args:
+                raise BadRequest("Illegal to use positional args when calling a dynamically generated remote method")
+            headers = kwargs.pop('headers', None)
+            ionobj = IonObject(in_obj, **kwargs)
+            return self.request_async(ionobj, op=name, headers=headers)
+
         newmethod = svcmethod
         newmethod.__doc__ = doc
         setattr(self.__class__, name, newmethod)
+        setattr(self.__class__, name + "_async", svcmethod_async)
 
     def request(self, msg, headers=None, op=None, timeout=None):
         """
@@ -1089,6 +1681,45 @@ class RPCClient(RequestResponseClient):
 
         return RequestResponseClient.request(self, msg, headers=headers, timeout=timeout)
 
+    def request_async(self, msg, headers=None, op=None, timeout=None):
+        """
+        Asynchronous request override for RPCClients. Returns an AsyncResult for the response.
+        """
+        assert op
+        assert headers is None or isinstance(headers, dict)
+
+        headers = headers.copy() if headers is not None else {}
+        headers['op'] = op
+
+        return RequestResponseClient.request_async(self, msg, headers=headers, timeout=timeout)
+
+
+def gather(async_results, timeout=None, raise_exception=True):
+    """
+    Waits for a list of AsyncResults, such as returned by request_async, with a shared timeout.
+
+    @param  async_results   List of AsyncResults
+    @param  timeout         Overall timeout in seconds for all results (None waits indefinitely)
+    @param  raise_exception If False, exceptions are returned in place of results instead of raised
+    @return List of results in the order of the given AsyncResults
+    @raises Timeout         If not all results are available within the timeout
+    """
+    start_time = get_ion_ts_millis()
+    results = []
+    for ar in async_results:
+        ar_timeout = None
+        if timeout is not None:
+            ar_timeout = max(timeout - (get_ion_ts_millis() - start_time) / 1000.0, 0)
+        try:
+            results.append(ar.get(timeout=ar_timeout))
+        except Timeout:
+            raise exception.Timeout("Timed out (%s sec) waiting for %s results" % (timeout, len(async_results)))
+        except Exception as ex:
+            if raise_exception:
+                raise
+            results.append(ex)
+    return results
+
 
 class RPCResponseEndpointUnit(ResponseEndpointUnit):
     def __init__(self, routing_obj=None, **kwargs):
@@ -1187,7 +1818,7 @@ class RPCResponseEndpointUnit(ResponseEndpointUnit):
         """
         assert self._routing_obj, "How did I get created without a routing object?"
 
-        cmd_arg_obj = msg
+        cmd_arg_obj = materialize_payload(msg)
         cmd_op = headers.get('op', None)
 
         # get timeout
@@ -3,6 +3,7 @@
 """AMQP messaging with Pika."""
 
 from collections import defaultdict
+import struct
 import gevent
 from gevent import event
 from gevent.lock import RLock
@@ -11,7 +12,9 @@ from pika.credentials import PlainCredentials
 from pika.connection import ConnectionParameters
 from pika.adapters import SelectConnection
 from pika import channel as pikachannel
+from pika import spec as pikaspec
 from pika.exceptions import NoFreeChannels
+import pika.object
 
 from pyon.core.bootstrap import CFG, get_sys_name
 from pyon.net import channel
@@ -34,6 +37,11 @@ class BaseNode(object):
         self._lock = RLock()
 
         self.interceptors = {}  # endpoint interceptors
+        self.reply_listener = None  # shared RPC reply queue, created on first use
+
+        self.flow_blocked = None    # reason while the broker blocks publishing (flow control), None otherwise
+        self._flow_ok = event.Event()
+        self._flow_ok.set()
 
     def on_connection_open(self, client):
         """
@@ -43,6 +51,8 @@ class BaseNode(object):
         log.debug("In Node.on_connection_open")
         log.debug("client: %s" % str(client))
         client.add_on_close_callback(self.on_connection_close)
+        if hasattr(client, "add_flow_callback"):
+            client.add_flow_callback(self.on_flow_control)
         self.client = client
         self.start_node()
 
@@ -53,6 +63,31 @@ class BaseNode(object):
         """
         log.debug("In Node.on_connection_close")
 
+        # Release publishers waiting for flow control, their publish fails now
+        self.on_flow_control(None)
+
+    def on_flow_control(self, reason):
+        """
+        Broker flow control event handler.
+        @param  reason  Reason given by the broker when it blocks publishing, None when unblocked
+        """
+        self.flow_blocked = reason
+        if reason is None:
+            self._flow_ok.set()
+        else:
+            self._flow_ok.clear()
+
+    def is_blocked(self):
+        """ Returns True while the broker blocks publishing on this node's connection """
+        return self.flow_blocked is not None
+
+    def wait_unblocked(self, timeout=None):
+        """
+        Waits until the broker no longer blocks publishing.
+        @retval True if not blocked, False if still blocked after timeout
+        """
+        return self._flow_ok.wait(timeout)
+
     def start_node(self):
         """
         This should only be called by on_connection_opened.
@@ -69,6 +104,11 @@ class BaseNode(object):
         log.debug("In Node.stop_node")
         self.running = False
 
+    def _close_reply_listener(self):
+        if self.reply_listener is not None:
+            self.reply_listener.close()
+            self.reply_listener = None
+
     def channel(self, ch_type):
         """
         Create a channel on current node.
@@ -157,6 +197,8 @@ class NodeB(BaseNode):
         log.info("Closing broker connection with %s pooled channels", len(self._bidir_pool))
 
         if self.running:
+            self._close_reply_listener()
+
             # clean up pooling before we shut connection
             self._destroy_pool()
             self.client.close()
@@ -328,6 +370,52 @@ def ioloop(connection, name=None):
         connection.ioloop.start()
 
 
+class ConnectionBlocked(pika.object.Method):
+    """
+    RabbitMQ extension method: the broker blocks publishing on the connection (memory or disk alarm).
+    """
+    INDEX = 0x000A003C  # 10, 60
+    NAME = 'Connection.Blocked'
+
+    def __init__(self, reason=''):
+        self.reason = reason
+
+    @property
+    def synchronous(self):
+        return False
+
+    def decode(self, encoded, offset=0):
+        length = struct.unpack_from('B', encoded, offset)[0]
+        offset += 1
+        self.reason = encoded[offset:offset + length]
+        return self
+
+    def encode(self):
+        return [struct.pack('B', len(self.reason)), self.reason]
+
+
+class ConnectionUnblocked(pika.object.Method):
+    """
+    RabbitMQ extension method: the broker accepts publishing on the connection again.
+    """
+    INDEX = 0x000A003D  # 10, 61
+    NAME = 'Connection.Unblocked'
+
+    @property
+    def synchronous(self):
+        return False
+
+    def decode(self, encoded, offset=0):
+        return self
+
+    def encode(self):
+        return []
+
+# Pika 0.9.5 does not know these methods, register them so their frames can be decoded
+for _method in (ConnectionBlocked, ConnectionUnblocked):
+    pikaspec.methods.setdefault(_method.INDEX, _method)
+
+
 class PyonSelectConnection(SelectConnection):
     """
     Custom-derived Pika SelectConnection to allow us to get around re-using failed channels.
@@ -335,13 +423,47 @@ class PyonSelectConnection(SelectConnection):
     When a Channel fails, if the channel number is reused again, sometimes Pika/Rabbit will
     choke. This class overrides the _next_channel_number method in Pika, to hand out channel
     numbers that we deem safe.
+
+    Also announces support for broker flow control notifications (connection.blocked) and keeps
+    the flow control state in blocked.
     """
     def __init__(self, parameters=None, on_open_callback=None, reconnection_strategy=None):
+        self.blocked = None     # reason while the broker blocks publishing, None otherwise
+        self._flow_callbacks = []
         SelectConnection.__init__(self, parameters=parameters, on_open_callback=on_open_callback,
                                   reconnection_strategy=reconnection_strategy)
         self._bad_channel_numbers = set()
         self._pending = set()
 
+    def _on_connection_open(self, frame):
+        self.callbacks.add(0, ConnectionBlocked, self._on_connection_blocked, False)
+        self.callbacks.add(0, ConnectionUnblocked, self._on_connection_unblocked, False)
+        SelectConnection._on_connection_open(self, frame)
+
+    def _send_method(self, channel_number, method, content=None):
+        if isinstance(method, pikaspec.Connection.StartOk):
+            method.client_properties.setdefault("capabilities", {})["connection.blocked"] = True
+        SelectConnection._send_method(self, channel_number, method, content)
+
+    def add_flow_callback(self, callback):
+        """
+        Adds a callback notified of broker flow control. Signature: def callback(reason),
+        with reason None when publishing is unblocked.
+        """
+        self._flow_callbacks.append(callback)
+
+    def _on_connection_blocked(self, frame):
+        self.blocked = frame.method.reason or "unknown"
+        log.warn("Broker blocked publishing on connection (flow control): %s", self.blocked)
+        for callback in self._flow_callbacks:
+            callback(self.blocked)
+
+    def _on_connection_unblocked(self, frame):
+        self.blocked = None
+        log.info("Broker unblocked publishing on connection")
+        for callback in self._flow_callbacks:
+            callback(None)
+
     def _next_channel_number(self):
         """
         Get the next available channel number.
@@ -421,7 +543,8 @@ class LocalNode(BaseNode):
             self._local_router = router
             self._own_router = False
         else:
-            self._local_router = LocalRouter(get_sys_name())
+            self._local_router = LocalRouter(get_sys_name(),
+                                             throughput_mode=CFG.get_safe("container.messaging.local_router.throughput_mode", False))
         self._channel_id_pool = IDPool()
 
     def start_node(self):
@@ -431,6 +554,7 @@ class LocalNode(BaseNode):
 
     def stop_node(self):
         if self.running:
+            self._close_reply_listener()
             if self._own_router:
                 self._local_router.stop()
         self.running = False
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+"""
+Local disk spool for outgoing messages.
+Encoded messages that cannot be published while the broker is unavailable are appended to a
+segmented log on local disk and replayed in order once publishing succeeds again.
+"""
+
+from collections import deque
+import os
+import re
+import struct
+
+from gevent import sleep
+from gevent.lock import RLock
+import msgpack
+
+from pyon.core.bootstrap import CFG
+from pyon.util.async import spawn
+from pyon.util.log import log
+
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".log"
+POSITION_FILE = "position"
+RECORD_HEADER = struct.Struct(">I")
+
+_spools = {}        # Spool directory -> MessageSpool, shared by all publishers in the process
+
+
+class SpoolFullError(StandardError):
+    """
+    The spool reached its max disk size. The message was not spooled.
+    """
+    pass
+
+
+def get_spool_config():
+    """ Returns the spool config if spooling is enabled, None otherwise """
+    config = CFG.get_safe("container.messaging.spool")
+    if config and config.get("enabled", False) is True:
+        return config
+    return None
+
+
+def get_spool(name, config):
+    """
+    Returns the spool for the given destination name, creating it (and loading messages spooled
+    by a previous run) if it does not exist yet.
+    """
+    spool_name = re.sub(r"[^\w.-]", "_", name) or "default"
+    path = os.path.abspath(os.path.join(config.get("path", "spool"), spool_name))
+    spool = _spools.get(path, None)
+    if spool is None:
+        spool = _spools[path] = MessageSpool(path,
+                                             max_size=int(config.get("max_size", 100000000)),
+                                             segment_size=int(config.get("segment_size", 10000000)),
+                                             retry_interval=float(config.get("retry_interval", 1.0)))
+    return spool
+
+
+class MessageSpool(object):
+    """
+    Append-only segment log of encoded messages with a single reader at the head.
+    Each record is the destination name (exchange, queue, binding), body and headers.
+    Fully replayed segments are deleted; appends fail when the total size exceeds max_size.
+    The replay position is persisted, so spooled messages survive a restart. Delivery is at least
+    once: a message replayed right before a crash may be replayed again.
+    """
+    def __init__(self, path, max_size=100000000, segment_size=10000000, retry_interval=1.0):
+        self.path = path
+        self.max_size = max_size
+        self.segment_size = segment_size
+        self.retry_interval = retry_interval
+        self.stats = dict(spooled=0, replayed=0, rejected=0, replay_errors=0)
+        self._segments = deque()    # [sequence number, size, record count] of each segment, oldest first
+        self._read_offset = 0       # Offset of the next record in the head segment
+        self._read_file = None
+        self._write_file = None
+        self._replay_gl = None
+        self._lock = RLock()
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self._load()
+
+    def _segment_path(self, seq):
+        return os.path.join(self.path, "%s%08d%s" % (SEGMENT_PREFIX, seq, SEGMENT_SUFFIX))
+
+    def _load(self):
+        head_seq, head_offset = None, 0
+        pos_path = os.path.join(self.path, POSITION_FILE)
+        if os.path.exists(pos_path):
+            with open(pos_path, "r") as f:
+                head_seq, head_offset = [int(val) for val in f.read().split()]
+
+        seqs = sorted(int(fn[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) for fn in os.listdir(self.path)
+                      if fn.startswith(SEGMENT_PREFIX) and fn.endswith(SEGMENT_SUFFIX))
+        for seq in seqs:
+            with open(self._segment_path(seq), "rb") as f:
+                data = f.read()
+            offset, count = 0, 0
+            while offset + RECORD_HEADER.size <= len(data):
+                rec_size = RECORD_HEADER.unpack_from(data, offset)[0]
+                if offset + RECORD_HEADER.size + rec_size > len(data):
+                    break
+                if seq == head_seq and offset == head_offset:
+                    self._read_offset, count = offset, 0      # Records before were replayed already
+                offset += RECORD_HEADER.size + rec_size
+                count += 1
+            if seq == head_seq and head_offset >= offset:
+                count = 0
+            if offset < len(data):
+                log.warn("Truncating incomplete record at end of spool segment %s", self._segment_path(seq))
+                with open(self._segment_path(seq), "r+b") as f:
+                    f.truncate(offset)
+            if count:
+                self._segments.append([seq, offset, count])
+            else:
+                os.remove(self._segment_path(seq))
+        if self._segments:
+            log.info("Loaded %s spooled messages from %s", self.pending, self.path)
+
+    @property
+    def pending(self):
+        """ Number of spooled messages not replayed yet """
+        return sum(seg[2] for seg in self._segments)
+
+    @property
+    def size(self):
+        """ Bytes of spooled messages on disk, including replayed records of the head segment """
+        return sum(seg[1] for seg in self._segments)
+
+    def append(self, name, body, headers):
+        """
+        Appends a message to the end of the spool.
+        @param  name    The destination name as tuple (exchange, queue, binding)
+        @raises SpoolFullError  If the spool would exceed its max size
+        """
+        record = msgpack.packb([list(name), body, headers])
+        with self._lock:
+            if self.size + RECORD_HEADER.size + len(record) > self.max_size:
+                self.stats["rejected"] += 1
+                raise SpoolFullError("Message spool %s full (%s bytes)" % (self.path, self.size))
+
+            if not self._segments or self._segments[-1][1] >= self.segment_size:
+                self._open_segment()
+            elif self._write_file is None:
+                # Tail segment loaded from a previous run
+                self._write_file = open(self._segment_path(self._segments[-1][0]), "ab")
+            self._write_file.write(RECORD_HEADER.pack(len(record)) + record)
+            self._write_file.flush()
+            segment = self._segments[-1]
+            segment[1] += RECORD_HEADER.size + len(record)
+            segment[2] += 1
+            self.stats["spooled"] += 1
+
+    def _open_segment(self):
+        if self._write_file is not None:
+            self._write_file.close()
+        seq = self._segments[-1][0] + 1 if self._segments else 0
+        self._write_file = open(self._segment_path(seq), "ab")
+        self._segments.append([seq, 0, 0])
+
+    def peek(self):
+        """
+        Returns the oldest spooled message as tuple (name, body, headers), None if the spool is empty.
+        """
+        with self._lock:
+            if not self._segments:
+                return None
+            if self._read_file is None:
+                self._read_file = open(self._segment_path(self._segments[0][0]), "rb")
+            self._read_file.seek(self._read_offset)
+            rec_size = RECORD_HEADER.unpack(self._read_file.read(RECORD_HEADER.size))[0]
+            name, body, headers = msgpack.unpackb(self._read_file.read(rec_size))
+            return tuple(name), body, headers
+
+    def pop(self):
+        """ Removes the oldest spooled message after it was replayed """
+        with self._lock:
+            if self._read_file is None:
+                self.peek()
+            self._read_offset = self._read_file.tell()
+            segment = self._segments[0]
+            segment[2] -= 1
+            if segment[2] == 0:
+                self._read_file.close()
+                self._read_file = None
+                self._read_offset = 0
+                if len(self._segments) == 1 and self._write_file is not None:
+                    self._write_file.close()
+                    self._write_file = None
+                os.remove(self._segment_path(segment[0]))
+                self._segments.popleft()
+            self._save_position()
+
+    def _save_position(self):
+        pos_path = os.path.join(self.path, POSITION_FILE)
+        if not self._segments:
+            if os.path.exists(pos_path):
+                os.remove(pos_path)
+            return
+        with open(pos_path + ".tmp", "w") as f:
+            f.write("%s %s" % (self._segments[0][0], self._read_offset))
+        os.rename(pos_path + ".tmp", pos_path)
+
+    def start_replay(self, send_func):
+        """
+        Starts replaying spooled messages in the background, if not already replaying.
+        @param  send_func   Function(name, body, headers) publishing a message, raising an error on failure
+        """
+        if self._replay_gl is None:
+            self._replay_gl = spawn(self._replay, send_func)
+
+    def _replay(self, send_func):
+        while True:
+            msg = self.peek()
+            if msg is None:
+                break
+            try:
+                send_func(*msg)
+            except Exception as ex:
+                self.stats["replay_errors"] += 1
+                log.debug("Replay of spooled message failed, retrying in %s sec: %s", self.retry_interval, ex)
+                sleep(self.retry_interval)
+                continue
+            self.pop()
+            self.stats["replayed"] += 1
+            if not self._segments:
+                log.info("Replayed all spooled messages from %s", self.path)
+        self._replay_gl = None
+
+    def get_stats(self):
+        """ Returns a dict with counters, pending messages and disk size """
+        stats = dict(self.stats)
+        stats.update(pending=self.pending, size=self.size, max_size=self.max_size)
+        return stats
+
+    def close(self):
+        """ Stops replaying and closes open files. Spooled messages remain on disk. """
+        if self._replay_gl is not None:
+            self._replay_gl.kill()
+            self._replay_gl = None
+        with self._lock:
+            for f in (self._read_file, self._write_file):
+                if f is not None:
+                    f.close()
+            self._read_file = self._write_file = None
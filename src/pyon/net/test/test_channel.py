@@ -4,8 +4,8 @@ __author__ = 'Dave Foster <dfoster@asascience.com>'
 
 
 from mock import Mock, sentinel, patch, MagicMock
-from gevent.event import Event
-from gevent import spawn
+from gevent.event import Event, AsyncResult
+from gevent import spawn, sleep
 from gevent.queue import Queue
 import Queue as PQueue
 import time
@@ -14,7 +14,8 @@ from nose.plugins.attrib import attr
 from pyon.util.unit_test import PyonTestCase
 from pyon.core import bootstrap
 from pyon.core.bootstrap import CFG
-from pyon.net.channel import BaseChannel, SendChannel, RecvChannel, BidirClientChannel, SubscriberChannel, ChannelClosedError, ServerChannel, ChannelError, ChannelShutdownMessage, ListenChannel, PublisherChannel
+from pyon.net.channel import BaseChannel, SendChannel, RecvChannel, BidirClientChannel, SubscriberChannel, ChannelClosedError, ServerChannel, ChannelError, ChannelShutdownMessage, ListenChannel, PublisherChannel, PrefetchController
+from pyon.net.chunking import split_message
 from pyon.net.transport import NameTrio, BaseTransport, AMQPTransport
 from pyon.util.int_test import IonIntegrationTestCase
 
@@ -173,6 +174,34 @@ class TestSendChannel(PyonTestCase):
         self.assertIn('custom', props)
         self.assertEquals(props['custom'], 'val')
 
+    @patch.dict(CFG, {'container': {'messaging': {'chunking': {'enabled': True, 'chunk_size': 4}}}})
+    def test__send_chunked(self):
+        transport = Mock()
+        self.ch.on_channel_open(transport)
+
+        # requests are not chunked by default
+        self.ch._send(NameTrio('xp', 'namen'), 'daten', headers={'performative': 'request'})
+        self.assertEquals(transport.publish_impl.call_count, 1)
+
+        transport.publish_impl.reset_mock()
+        transport.publish_impl.side_effect = [sentinel.res1, sentinel.res2]
+        res = self.ch._send(NameTrio('xp', 'namen'), 'daten', headers={'performative': 'inform-result'})
+        self.assertEquals(res, sentinel.res2)
+        self.assertEquals([c[1]['body'] for c in transport.publish_impl.call_args_list], ['date', 'n'])
+        props = [c[1]['properties'] for c in transport.publish_impl.call_args_list]
+        self.assertEquals([(p['chunk-seq'], p['chunk-count'], p['performative']) for p in props],
+                          [(0, 2, 'inform-result'), (1, 2, 'inform-result')])
+        self.assertEquals(props[0]['chunk-id'], props[1]['chunk-id'])
+
+        # in confirm mode, the message is confirmed when all fragments are
+        confirms = [AsyncResult(), AsyncResult()]
+        transport.publish_impl.side_effect = list(confirms)
+        res = self.ch._send(NameTrio('xp', 'namen'), 'daten', headers={'performative': 'inform-result'})
+        confirms[1].set(True)
+        self.assertFalse(res.ready())
+        confirms[0].set(True)
+        self.assertTrue(res.get(timeout=1))
+
 @attr('UNIT')
 class TestRecvChannel(PyonTestCase):
     def setUp(self):
@@ -536,6 +565,143 @@ class TestRecvChannel(PyonTestCase):
 
         transport.reject_impl.assert_called_once_with(sentinel.delivery_tag, requeue=True)
 
+    def _deliver_tags(self, tags):
+        for tag in tags:
+            m = Mock()
+            m.delivery_tag = tag
+            h = Mock()
+            h.headers = {}
+            self.ch._on_deliver(sentinel.chan, m, h, sentinel.body)
+
+    def test__on_deliver_chunked(self):
+        transport = Mock()
+        self.ch.on_channel_open(transport)
+
+        headers = {'performative': 'inform-result', 'conv-id': sentinel.conv_id}
+        fragments = list(split_message('abcdefghij', headers, 4))
+        for tag, (body, frag_headers) in enumerate(fragments):
+            m = Mock()
+            m.delivery_tag = tag
+            h = Mock()
+            h.headers = frag_headers
+            self.ch._on_deliver(sentinel.chan, m, h, body)
+
+        # buffered fragments are acked right away, the message is delivered with the last tag
+        self.assertEquals(transport.ack_impl.call_args_list, [((0,), {}), ((1,), {})])
+        self.assertEquals(self.ch._recv_queue.qsize(), 1)
+        body, msg_headers, tag = self.ch._recv_queue.get()
+        self.assertEquals(body, 'abcdefghij')
+        self.assertEquals(tag, 2)
+        self.assertNotIn('chunk-id', msg_headers)
+        self.assertEquals(msg_headers['conv-id'], sentinel.conv_id)
+
+        # fragment of a discarded message is rejected
+        m = Mock()
+        m.delivery_tag = 3
+        h = Mock()
+        h.headers = fragments[1][1]
+        self.ch._on_deliver(sentinel.chan, m, h, 'efgh')
+        transport.reject_impl.assert_called_once_with(3, requeue=False)
+        self.assertEquals(self.ch._recv_queue.qsize(), 0)
+
+    @patch.dict(CFG, {'container': {'messaging': {'chunking': {'reassembly_timeout': 0.05}}}})
+    def test__on_deliver_chunked_expire(self):
+        transport = Mock()
+        self.ch.on_channel_open(transport)
+
+        body, frag_headers = next(split_message('abcdefghij', {}, 4))
+        m = Mock()
+        m.delivery_tag = 0
+        h = Mock()
+        h.headers = frag_headers
+        self.ch._on_deliver(sentinel.chan, m, h, body)
+        self.assertEquals(self.ch._reassembler.buffered_size, 4)
+        self.assertIsNotNone(self.ch._reassembly_gl)
+
+        # partial message is discarded after the timeout without further fragments
+        sleep(0.1)
+        self.assertEquals(self.ch._reassembler.buffered_size, 0)
+        self.assertIsNone(self.ch._reassembly_gl)
+
+    def test_ack_batching(self):
+        transport = Mock()
+        self.ch.on_channel_open(transport)
+        self.ch._ack_batch_size = 3
+        self.ch._ack_batch_interval = 10
+        self._deliver_tags([1, 2, 3, 4, 5])
+        self.assertEquals(self.ch._unsettled_tags, {1, 2, 3, 4, 5})
+
+        # out of order acks are held back until the batch size is reached
+        map(self.ch._recv_queue.get, xrange(3))
+        self.ch.ack(2)
+        self.ch.ack(1)
+        self.assertEquals(transport.ack_impl.call_count, 0)
+        self.ch.ack(3)
+        transport.ack_impl.assert_called_once_with(3, multiple=True)
+        self.assertEquals(self.ch._pending_acks, [])
+
+        # tag 4 still unsettled, so tag 5 cannot be covered by a multiple ack
+        self.ch._recv_queue.get()
+        transport.ack_impl.reset_mock()
+        self.ch.ack(5)
+        self.assertEquals(transport.ack_impl.call_count, 0)
+        self.ch.flush_acks()
+        transport.ack_impl.assert_called_once_with(5)
+
+        # no messages waiting: flushes immediately
+        self.ch._recv_queue.get()
+        transport.ack_impl.reset_mock()
+        self.ch.ack(4)
+        transport.ack_impl.assert_called_once_with(4)
+        self.assertEquals(self.ch._unsettled_tags, set())
+
+    def test_ack_batching_reject(self):
+        transport = Mock()
+        self.ch.on_channel_open(transport)
+        self.ch._ack_batch_size = 10
+        self.ch._ack_batch_interval = 10
+        self._deliver_tags([1, 2, 3, 4])
+
+        self.ch.ack(1)
+        self.ch.ack(3)
+        self.ch.reject(2, requeue=True)
+
+        # ack for 1 sent before the reject, ack for 3 individually, never a multiple ack covering 2
+        self.assertEquals(transport.ack_impl.call_args_list, [((1,), {}), ((3,), {})])
+        transport.reject_impl.assert_called_once_with(2, requeue=True)
+        self.assertEquals(self.ch._unsettled_tags, {4})
+
+    def test_ack_batching_flush_on_timer_and_close(self):
+        transport = Mock()
+        self.ch.on_channel_open(transport)
+        self.ch._ack_batch_size = 10
+        self.ch._ack_batch_interval = 0.01
+        self._deliver_tags([1, 2, 3])
+
+        self.ch.ack(1)
+        self.ch.ack(2)
+        self.assertIsNotNone(self.ch._ack_flush_gl)
+        self.ch._ack_flush_gl.join(timeout=1)
+        transport.ack_impl.assert_called_once_with(2, multiple=True)
+
+        transport.ack_impl.reset_mock()
+        self.ch._recv_queue.put(sentinel.msg)   # pretend more messages are waiting
+        self.ch.ack(3)
+        self.assertEquals(transport.ack_impl.call_count, 0)
+        self.ch.close_impl()
+        transport.ack_impl.assert_called_once_with(3)
+        self.assertEquals(self.ch._pending_acks, [])
+
+    def test_ack_batching_ignores_non_amqp_tags(self):
+        transport = Mock()
+        self.ch.on_channel_open(transport)
+        self.ch._ack_batch_size = 10
+        self._deliver_tags(["zctag-1-1"])
+        self.assertEquals(self.ch._unsettled_tags, set())
+
+        self.ch.ack("zctag-1-1")
+        transport.ack_impl.assert_called_once_with("zctag-1-1")
+
     def test_reset(self):
         self.ch.reset()
         self.assertEquals(self.ch._fsm.current_state, self.ch.S_INIT)
@@ -664,6 +830,30 @@ class TestListenChannel(PyonTestCase):
         self.assertEquals(self.ch._fsm.current_state, self.ch.S_ACTIVE)
         self.assertTrue(self.ch._consuming)
 
+    def test_accept_detach(self):
+        transport = Mock()
+        self.ch.on_channel_open(transport)
+        self.ch._fsm.current_state = self.ch.S_ACTIVE
+        self.ch._consuming = True
+        self.ch._recv_queue.put((sentinel.body, {}, 1))
+        self.ch._recv_queue.put((sentinel.body, {}, 2))
+
+        newch = self.ch.accept()
+        newch.recv()
+        newch.detach()
+        self.assertEquals(self.ch._fsm.current_state, self.ch.S_ACTIVE)
+
+        # next message can be accepted before the first one is acked
+        newch2 = self.ch.accept()
+        newch2.recv()
+        self.assertEquals(self.ch._fsm.current_state, self.ch.S_ACCEPTED)
+
+        newch.ack(1)
+        self.assertEquals(self.ch._fsm.current_state, self.ch.S_ACCEPTED)
+        newch2.ack(2)
+        self.assertEquals(self.ch._fsm.current_state, self.ch.S_ACTIVE)
+        self.assertEquals(transport.ack_impl.call_count, 2)
+
     def test_close_while_accepted(self):
         rmock = Mock()
         rmock.return_value = sentinel.msg
@@ -743,6 +933,52 @@ class TestListenChannel(PyonTestCase):
         newch.close()
         self.assertEquals(transport.close.call_count, 0)
 
+    def test_adaptive_prefetch(self):
+        transport = Mock()
+        self.ch.on_channel_open(transport)
+        self.ch._fsm.current_state = self.ch.S_ACTIVE
+        self.ch._consuming = True
+        self.ch._recv_queue.await_n = MagicMock()
+        self.ch.recv = Mock(return_value=sentinel.msg)
+        self.ch._create_accepted_channel = Mock()
+
+        self.ch.set_adaptive_prefetch(min_count=2, max_count=10, max_wait=1.0, sample_size=2)
+        transport.qos_impl.assert_called_once_with(prefetch_count=2)
+
+        # fast consumer starving on an empty local queue: prefetch grows
+        for x in xrange(2):
+            self.ch.accept()
+            self.ch.exit_accept()
+        transport.qos_impl.assert_called_with(prefetch_count=4)
+        self.assertEquals(self.ch._fsm.current_state, self.ch.S_ACTIVE)
+
+        # accept without consuming sets its own qos and is not sampled
+        self.ch._consuming = False
+        self.ch.start_consume = Mock()
+        self.ch.stop_consume = Mock()
+        self.ch.accept()
+        self.assertIsNone(self.ch._accept_sample)
+        self.ch.exit_accept()
+
+    def test_prefetch_controller(self):
+        pc = PrefetchController(min_count=1, max_count=8, max_wait=1.0, sample_size=4)
+        self.assertEquals(pc.prefetch_count, 1)
+
+        # starved and fast: doubles up to max_count
+        counts = [pc.add_sample(0.001, 0) for x in xrange(16)]
+        self.assertEquals([c for c in counts if c is not None], [2, 4, 8])
+        self.assertEquals(pc.prefetch_count, 8)
+
+        # messages piling up locally with slow processing: reduced to fit max_wait
+        pc.latency = None
+        counts = [pc.add_sample(0.3, 5) for x in xrange(4)]
+        self.assertEquals(counts, [None, None, None, 3])
+
+        # very slow processing: never below min_count, no increase beyond max_wait
+        counts = [pc.add_sample(5.0, 0) for x in xrange(8)]
+        self.assertEquals(pc.prefetch_count, 1)
+        self.assertEquals(counts[-1], None)
+
 @attr('UNIT')
 class TestSubscriberChannel(PyonTestCase):
 
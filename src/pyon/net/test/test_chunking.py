@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+from types import GeneratorType
+
+from gevent.event import AsyncResult
+from mock import patch, sentinel
+from nose.plugins.attrib import attr
+
+from pyon.core.bootstrap import CFG
+from pyon.net.chunking import (ChunkError, ChunkReassembler, split_message, combine_confirms, is_chunkable,
+                               get_chunked_message_size, MSG_HEADER_CHUNK_SEQ, MSG_HEADER_CHUNK_COUNT)
+from pyon.net.transport import TransportError
+from pyon.util.unit_test import PyonTestCase
+
+
+@attr('UNIT')
+class TestChunking(PyonTestCase):
+
+    def test_split_and_reassemble(self):
+        body = "".join(chr(i % 256) for i in xrange(1000))
+        fragments = split_message(body, {'conv-id': 'c1'}, 300)
+        self.assertIsInstance(fragments, GeneratorType)
+        fragments = list(fragments)
+        self.assertEquals([len(frag) for frag, _ in fragments], [300, 300, 300, 100])
+        self.assertEquals([h[MSG_HEADER_CHUNK_SEQ] for _, h in fragments], [0, 1, 2, 3])
+        self.assertTrue(all(h[MSG_HEADER_CHUNK_COUNT] == 4 and h['conv-id'] == 'c1' for _, h in fragments))
+
+        ra = ChunkReassembler(max_size=10000, timeout=10)
+        results = [ra.add(frag, headers) for frag, headers in fragments]
+        self.assertEquals(results[:3], [None, None, None])
+        self.assertEquals(results[3], (body, {'conv-id': 'c1'}))
+        self.assertEquals(ra.buffered_size, 0)
+
+        # interleaved messages
+        frags1, frags2 = list(split_message("a" * 10, {}, 4)), list(split_message("b" * 10, {}, 4))
+        for f1, f2 in zip(frags1, frags2)[:-1]:
+            self.assertIsNone(ra.add(*f1))
+            self.assertIsNone(ra.add(*f2))
+        self.assertEquals(ra.add(*frags2[-1])[0], "b" * 10)
+        self.assertEquals(ra.add(*frags1[-1])[0], "a" * 10)
+
+    def test_reassemble_errors(self):
+        ra = ChunkReassembler(max_size=10, timeout=10)
+        fragments = list(split_message("x" * 12, {}, 4))
+
+        # out of sequence
+        self.assertIsNone(ra.add(*fragments[0]))
+        self.assertRaises(ChunkError, ra.add, *fragments[2])
+        self.assertEquals(ra.buffered_size, 0)
+        self.assertRaises(ChunkError, ra.add, *fragments[1])
+
+        # memory bound
+        self.assertIsNone(ra.add(*fragments[0]))
+        self.assertIsNone(ra.add(*fragments[1]))
+        self.assertRaises(ChunkError, ra.add, *fragments[2])
+        self.assertEquals(ra.buffered_size, 0)
+
+    def test_reassemble_timeout(self):
+        ra = ChunkReassembler(max_size=100, timeout=10)
+        fragments = list(split_message("x" * 8, {}, 4))
+        with patch('pyon.net.chunking.time.time', return_value=1000.0):
+            self.assertIsNone(ra.add(*fragments[0]))
+        with patch('pyon.net.chunking.time.time', return_value=1011.0):
+            self.assertRaises(ChunkError, ra.add, *fragments[1])
+        self.assertEquals(ra.buffered_size, 0)
+
+        # expire without further fragments returns the time until the next expiry
+        with patch('pyon.net.chunking.time.time', return_value=1000.0):
+            self.assertIsNone(ra.add(*fragments[0]))
+        with patch('pyon.net.chunking.time.time', return_value=1004.0):
+            self.assertEquals(ra.expire(), 6.0)
+        with patch('pyon.net.chunking.time.time', return_value=1010.0):
+            self.assertIsNone(ra.expire())
+        self.assertEquals(ra.buffered_size, 0)
+
+    def test_combine_confirms(self):
+        self.assertIs(combine_confirms([None]), None)
+        self.assertIs(combine_confirms([None, sentinel.res]), sentinel.res)
+
+        confirms = [AsyncResult(), AsyncResult()]
+        msg_confirm = combine_confirms(confirms)
+        confirms[1].set(True)
+        self.assertFalse(msg_confirm.ready())
+        confirms[0].set(True)
+        self.assertTrue(msg_confirm.get(timeout=1))
+
+        confirms = [AsyncResult(), AsyncResult()]
+        msg_confirm = combine_confirms(confirms)
+        confirms[0].set_exception(TransportError("nack"))
+        self.assertRaises(TransportError, msg_confirm.get, timeout=1)
+        confirms[1].set(True)
+
+    def test_is_chunkable(self):
+        self.assertTrue(is_chunkable({'performative': 'inform-result'}, {}))
+        self.assertTrue(is_chunkable({'performative': 'failure'}, {}))
+        self.assertFalse(is_chunkable({'performative': 'request'}, {}))
+        self.assertTrue(is_chunkable({'performative': 'request'}, {'chunk_all': True}))
+
+        self.assertIsNone(get_chunked_message_size({'performative': 'inform-result'}))
+        with patch.dict(CFG, {'container': {'messaging': {'chunking': {'enabled': True, 'max_message_size': 1000}}}}):
+            self.assertEquals(get_chunked_message_size({'performative': 'inform-result'}), 1000)
+            self.assertIsNone(get_chunked_message_size({'performative': 'request'}))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+from gevent import sleep, spawn
+from nose.plugins.attrib import attr
+
+from pyon.net.dispatch import KeyedDispatcher
+from pyon.util.unit_test import PyonTestCase
+
+
+@attr('UNIT')
+class TestKeyedDispatcher(PyonTestCase):
+
+    def test_dispatch_ordered_per_key(self):
+        disp = KeyedDispatcher(4)
+        self.assertEquals(disp.max_pending, 8)
+        processed = []
+        running = []
+        max_running = [0]
+
+        def task(key, num):
+            running.append(num)
+            max_running[0] = max(max_running[0], len(running))
+            sleep(0.01 if num % 2 else 0.001)
+            running.remove(num)
+            processed.append((key, num))
+
+        for num in xrange(12):
+            key = "k%s" % (num % 3)
+            disp.dispatch(key, task, key, num)
+        self.assertTrue(disp.join(timeout=5))
+
+        self.assertEquals(len(processed), 12)
+        for key in ("k0", "k1", "k2"):
+            self.assertEquals([num for k, num in processed if k == key], [n for n in xrange(12) if n % 3 == int(key[1])])
+        self.assertEquals(max_running[0], 3)        # one task per key at a time
+        self.assertEquals(disp.pending, 0)
+        self.assertEquals(disp._queues, {})
+
+    def test_dispatch_bounds(self):
+        disp = KeyedDispatcher(2, max_pending=3)
+        blocker = []
+
+        def task():
+            while not blocker:
+                sleep(0.001)
+
+        def task_error():
+            raise ValueError("callback failed")
+
+        disp.dispatch(None, task_error)     # errors are logged
+        disp.dispatch(None, task)
+        disp.dispatch(None, task)
+        sleep(0.01)
+        self.assertEquals(disp.pending, 2)
+
+        # pool is busy: dispatch blocks
+        gl = spawn(disp.dispatch, None, task)
+        sleep(0.01)
+        self.assertFalse(gl.ready())
+        self.assertFalse(disp.join(timeout=0.01))
+
+        blocker.append(True)
+        gl.get(timeout=1)
+        self.assertTrue(disp.join(timeout=1))
+        self.assertEquals(disp.pending, 0)
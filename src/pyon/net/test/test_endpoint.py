@@ -3,13 +3,19 @@
 __author__ = 'Dave Foster <dfoster@asascience.com>'
 
 
+import shutil
+import tempfile
+
 from nose.plugins.attrib import attr
 from mock import Mock, sentinel, patch, ANY, call, MagicMock
 from gevent import event, spawn
+from gevent.event import AsyncResult
 import unittest
 from zope.interface.declarations import implements
 from zope.interface.interface import Interface
 from gevent import sleep
+from gevent.lock import RLock
+from gevent.queue import Queue
 
 from pyon.util.int_test import IonIntegrationTestCase
 from pyon.util.unit_test import PyonTestCase
@@ -17,12 +23,12 @@ from pyon.core import exception
 from pyon.core.exception import BadRequest
 from pyon.core.bootstrap import get_sys_name, CFG
 from pyon.container.cc import Container
-from pyon.core.interceptor.interceptor import Invocation
+from pyon.core.interceptor.interceptor import Invocation, Interceptor
 from pyon.net.channel import BaseChannel, SendChannel, BidirClientChannel, SubscriberChannel, ChannelClosedError, ServerChannel, RecvChannel, ListenChannel
-from pyon.net.endpoint import EndpointUnit, BaseEndpoint, RPCServer, Subscriber, Publisher, RequestResponseClient, RequestEndpointUnit, RPCRequestEndpointUnit, RPCClient, RPCResponseEndpointUnit, EndpointError, SendingBaseEndpoint, ListeningBaseEndpoint
+from pyon.net.endpoint import EndpointUnit, BaseEndpoint, RPCServer, Subscriber, Publisher, RequestResponseClient, RequestEndpointUnit, RPCRequestEndpointUnit, RPCClient, RPCResponseEndpointUnit, EndpointError, SendingBaseEndpoint, ListeningBaseEndpoint, gather, MSG_HEADER_BATCH
 from pyon.net.messaging import NodeB
 from pyon.ion.service import BaseService
-from pyon.net.transport import NameTrio, BaseTransport
+from pyon.net.transport import NameTrio, BaseTransport, TransportError
 
 # NO INTERCEPTORS - we use these mock-like objects up top here which deliver received messages that don't go through the interceptor stack.
 no_interceptors = {'message_incoming': [],
@@ -187,6 +193,34 @@ Make sure our kwarg gets set.
 
         # well, it's just a pass, so nothing happens/there for us to test
 
+    def test_get_interceptor_pipeline(self):
+        class FakeInterceptor(Interceptor):
+            def __init__(self, applicable=True):
+                self.applicable = applicable
+                self.compiled = []
+            def is_applicable(self, endpoint, path):
+                self.compiled.append((endpoint, path))
+                return self.applicable
+
+        one, two = FakeInterceptor(), FakeInterceptor(applicable=False)
+        self._node.interceptors = {'message_incoming': [one, two], 'message_outgoing': [two, one]}
+
+        self.assertEquals(self._ef.get_interceptor_pipeline('message_incoming'), [one.incoming])
+        self.assertEquals(self._ef.get_interceptor_pipeline('message_outgoing'), [one.outgoing])
+        self.assertEquals(self._ef.get_interceptor_pipeline('process_incoming'), [])
+        self.assertEquals(one.compiled, [(self._ef, 'incoming'), (self._ef, 'outgoing')])
+
+        # compiled once per endpoint and shared by its endpoint units
+        e = self._ef.create_endpoint()
+        self.assertIs(e.get_interceptor_pipeline('message_incoming'), self._ef.get_interceptor_pipeline('message_incoming'))
+        self.assertEquals(len(one.compiled), 2)
+        self.assertEquals(set(self._ef.get_interceptor_pipelines()), {'message_incoming', 'message_outgoing'})
+
+        # recompiled when the interceptors change
+        self._node.interceptors = {'message_incoming': [two, one]}
+        self.assertEquals(self._ef.get_interceptor_pipeline('message_incoming'), [one.incoming])
+        self.assertEquals(len(one.compiled), 3)
+
 @attr('UNIT')
 class TestSendingBaseEndpoint(PyonTestCase):
     def test_init(self):
@@ -256,6 +290,129 @@ class TestListeningBaseEndpoint(PyonTestCase):
         ep = ListeningBaseEndpoint(node=Mock(spec=NodeB))
         self.assertEquals(ep.get_ready_event(), ep._ready_event)
 
+    def test_activate_adaptive_prefetch(self):
+        ep = ListeningBaseEndpoint(node=Mock(spec=NodeB))
+        ep._chan = Mock(spec=ListenChannel)
+        ep._chan._prefetch_ctrl = None
+        ep.activate()
+        self.assertFalse(ep._chan.set_adaptive_prefetch.called)
+        ep._chan.start_consume.assert_called_once_with()
+
+        with patch.dict(CFG.container.messaging.endpoint, adaptive_prefetch={'enabled': True, 'min_count': 2, 'max_count': 50}):
+            ep = ListeningBaseEndpoint(node=Mock(spec=NodeB), prefetch={'max_count': 20})
+            ep._chan = Mock(spec=ListenChannel)
+            ep._chan._prefetch_ctrl = None
+            ep.activate()
+            ep._chan.set_adaptive_prefetch.assert_called_once_with(min_count=2, max_count=20)
+
+            ep = ListeningBaseEndpoint(node=Mock(spec=NodeB), prefetch={'enabled': False})
+            ep._chan = Mock(spec=ListenChannel)
+            ep._chan._prefetch_ctrl = None
+            ep.activate()
+            self.assertFalse(ep._chan.set_adaptive_prefetch.called)
+
+    def test_listen_dispatch(self):
+        received = []
+        def callback(msg, headers):
+            sleep(0.02 if msg[1] == 0 else 0.001)
+            received.append(msg)
+
+        sub = Subscriber(node=Mock(spec=NodeB), callback=callback, dispatch_size=3, dispatch_key="key")
+        sub._chan = Mock(spec=ListenChannel)
+        sub._chan._prefetch_ctrl = None
+        sub._chan._prefetch_count = None
+        sub.activate()
+        sub._chan._set_prefetch.assert_called_once_with(6)
+
+        acked = []
+        msgs = []
+        for num in xrange(6):
+            mo = Mock(error=None, headers={'key': num % 2})
+            mo.ack.side_effect = lambda mo=mo: acked.append(mo)
+            mo.route.side_effect = lambda num=num: callback((num % 2, num), {})
+            msgs.append(mo)
+        def get_one_msg():
+            if not msgs:
+                raise ChannelClosedError()
+            return msgs.pop(0)
+        sub.get_one_msg = get_one_msg
+        sub.prepare_listener = Mock()
+
+        all_msgs = list(msgs)
+        sub.listen()
+        for mo in all_msgs:
+            mo.endpoint.channel.detach.assert_called_once_with()
+        self.assertTrue(sub._dispatcher.join(timeout=1))
+
+        # ordered per key, acked after processing
+        self.assertEquals([m for m in received if m[0] == 0], [(0, 0), (0, 2), (0, 4)])
+        self.assertEquals([m for m in received if m[0] == 1], [(1, 1), (1, 3), (1, 5)])
+        self.assertNotEquals(received[0], (0, 0))
+        self.assertEquals(len(acked), 6)
+
+    def test_listen_dispatch_adaptive_prefetch(self):
+        processed = []
+        def callback(msg, headers):
+            sleep(0.05)
+            processed.append(msg)
+
+        prefetch_cfg = {'enabled': True, 'min_count': 1, 'max_count': 50, 'max_wait': 1.0, 'sample_size': 2}
+        with patch.dict(CFG.container.messaging.endpoint, adaptive_prefetch=prefetch_cfg):
+            node = Mock(spec=NodeB)
+            node.interceptors = {}
+            sub = Subscriber(node=node, from_name=NameTrio("xp", "q"), callback=callback, dispatch_size=2,
+                             dispatch_max_pending=4)
+            transport = Mock()
+            sub._chan = ListenChannel()
+            sub._chan.on_channel_open(transport)
+            sub._chan._recv_name = NameTrio("xp", "q")
+            sub._chan._fsm.current_state = sub._chan.S_ACTIVE
+
+            # dispatch_max_pending is the lower bound of the adaptive prefetch
+            sub.activate()
+            self.assertEquals(sub._chan._prefetch_ctrl.min_count, 4)
+            transport.qos_impl.assert_called_once_with(prefetch_count=4)
+
+            for num in xrange(4):
+                sub._chan._recv_queue.put(("msg%s" % num, {}, num))
+            sub.prepare_listener = Mock()
+            listen_gl = spawn(sub.listen)
+            sleep(0.15)
+            listen_gl.kill()
+
+        # samples cover the callback time, not just the hand-off to the dispatcher
+        self.assertEquals(sorted(processed), ["msg0", "msg1", "msg2", "msg3"])
+        self.assertGreaterEqual(sub._chan._prefetch_ctrl.latency, 0.04)
+        self.assertEquals(transport.ack_impl.call_count, 4)
+
+    def test_listen_dispatch_errors(self):
+        # a larger prefetch set on the channel is kept
+        sub = Subscriber(node=Mock(spec=NodeB), callback=Mock(), dispatch_size=3, dispatch_key="key")
+        sub._chan = Mock(spec=ListenChannel)
+        sub._chan._prefetch_ctrl = None
+        sub._chan._prefetch_count = 10
+        sub.activate()
+        self.assertFalse(sub._chan._set_prefetch.called)
+
+        # a failing dispatch key function does not stop the listener, the message is dispatched without key
+        def dispatch_key(msg, headers):
+            if msg == "bad":
+                raise ValueError("no key")
+            return msg
+        sub = Subscriber(node=Mock(spec=NodeB), callback=Mock(), dispatch_size=3, dispatch_key=dispatch_key)
+        sub._dispatcher = Mock()
+        msgs = [Mock(error=None, body=body, headers={}) for body in ("bad", "good")]
+        def get_one_msg():
+            if not msgs:
+                raise ChannelClosedError()
+            return msgs.pop(0)
+        sub.get_one_msg = get_one_msg
+        sub.prepare_listener = Mock()
+        sub._active_event.set()
+
+        sub.listen()
+        self.assertEquals([c[0][0] for c in sub._dispatcher.dispatch.call_args_list], [None, "good"])
+
     def test_close(self):
         ep = ListeningBaseEndpoint(node=Mock(soec=NodeB))
         ep._chan = Mock()
@@ -418,6 +575,142 @@ class TestPublisher(PyonTestCase):
         self._pub.close()
         self._pub._pub_ep.close.assert_called_once_with()
 
+    def test_publish_confirm(self):
+        pub = Publisher(node=self._node, to_name="testpub", confirm=True)
+        self._ch.send.side_effect = lambda *args: AsyncResult()
+
+        confirm = pub.publish("pub")
+        self._ch.enable_confirms.assert_called_once_with()
+        self.assertIsInstance(confirm, AsyncResult)
+
+        # other destinations are sent via the same channel in confirm mode
+        pub.publish("pub2", to_name="otherpub")
+        self.assertEquals(self._node.channel.call_count, 1)
+        self.assertEquals([c[0][0].queue for c in self._ch.connect.call_args_list], ["testpub", "testpub", "otherpub", "testpub"])
+
+        # batch confirm follows the confirm of the envelope
+        self._ch.send.side_effect = None
+        self._ch.send.return_value = AsyncResult()
+        pub = Publisher(node=self._node, to_name="testpub", confirm=True, batch_size=2)
+        batch_confirm = pub.publish("m1")
+        self.assertIs(pub.publish("m2"), batch_confirm)
+        self.assertFalse(batch_confirm.ready())
+        self._ch.send.return_value.set(True)
+        self.assertTrue(batch_confirm.get(timeout=1))
+
+    def test_publish_spooled(self):
+        spool_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_path)
+        spool_cfg = dict(enabled=True, path=spool_path, retry_interval=0.01)
+        with patch.dict(CFG, {'container': {'messaging': {'spool': spool_cfg}}}):
+            pub = Publisher(node=self._node, to_name="testpub")
+        self.assertIsNotNone(pub.spool)
+        self.addCleanup(pub.spool.close)
+
+        # broker unavailable: messages are spooled, later messages queue behind them
+        self._ch._send_name = NameTrio("xp", "testpub")
+        self._ch.send.side_effect = IOError("connection lost")
+        self.assertIsNone(pub.publish("m1"))
+        self._ch.send.side_effect = None
+        pub.publish("m2")
+        self.assertEquals(pub.spool.pending, 2)
+        self.assertEquals(self._ch.send.call_count, 1)
+        self.assertEquals(self._node.channel.call_count, 2)    # failed publish channel was replaced
+
+        # replayed in order over a dedicated channel once publishing succeeds
+        sleep(0.05)
+        self.assertEquals(pub.spool.pending, 0)
+        self.assertEquals([c[0][0] for c in self._ch.send.call_args_list[1:]], ["m1", "m2"])
+        self.assertEquals(self._ch.connect.call_args[0][0].queue, "testpub")
+
+        pub.publish("m3")
+        self.assertEquals(pub.spool.get_stats()['spooled'], 2)
+        self.assertEquals(self._ch.send.call_args[0][0], "m3")
+
+        # disabled explicitly
+        pub = Publisher(node=self._node, to_name="testpub", spool=False)
+        self.assertIsNone(pub.spool)
+
+    def test_publish_flow_control(self):
+        self._node.flow_blocked = "low on memory"
+        self._node.is_blocked.return_value = True
+        self._node.wait_unblocked.return_value = False
+
+        # default policy publishes anyway
+        self._pub.publish("m1")
+        self.assertEquals(self._ch.send.call_count, 1)
+        self.assertFalse(self._node.is_blocked.called)
+
+        pub = Publisher(node=self._node, to_name="testpub", flow_policy="fail")
+        self.assertRaises(TransportError, pub.publish, "m2")
+        self.assertFalse(self._node.wait_unblocked.called)
+
+        pub = Publisher(node=self._node, to_name="testpub", flow_policy="block", flow_timeout=0.5)
+        self.assertRaises(TransportError, pub.publish, "m3")
+        self._node.wait_unblocked.assert_called_once_with(0.5)
+        self.assertEquals(self._ch.send.call_count, 1)
+
+        self._node.wait_unblocked.side_effect = lambda timeout: sleep(0.01) or True
+        gls = [spawn(pub.publish, "m%s" % i) for i in xrange(3)]
+        for gl in gls:
+            gl.get(timeout=1)
+        self.assertEquals(self._ch.send.call_count, 4)
+        stats = pub.get_flow_stats()
+        self.assertEquals((stats['blocked'], stats['failed'], stats['waiting'], stats['max_waiting']), (4, 1, 0, 3))
+        self.assertGreater(stats['max_wait_time'], 0)
+
+        self.assertRaises(BadRequest, Publisher, node=self._node, to_name="testpub", flow_policy="drop")
+
+    def test_publish_batched(self):
+        pub = Publisher(node=self._node, to_name="testpub", batch_size=3, batch_interval=0.05)
+
+        pub.publish("m1")
+        pub.publish("m2", headers={'h': 2})
+        pub.publish("other", to_name="otherpub")
+        self.assertEquals(self._ch.send.call_count, 0)
+
+        # batch size reached
+        pub.publish("m3")
+        self.assertEquals(self._ch.send.call_count, 1)
+        body, headers = self._ch.send.call_args[0]
+        self.assertEquals(headers[MSG_HEADER_BATCH], 3)
+        self.assertEquals([m for m, h in body], ["m1", "m2", "m3"])
+        self.assertEquals(body[1][1]['h'], 2)
+        self.assertIn('ts', body[0][1])
+
+        # remaining batch sent after interval
+        sleep(0.1)
+        self.assertEquals(self._ch.send.call_count, 2)
+        body, headers = self._ch.send.call_args[0]
+        self.assertEquals(headers[MSG_HEADER_BATCH], 1)
+        self.assertEquals(body[0][0], "other")
+
+        # close flushes
+        pub.publish("m4")
+        pub.close()
+        self.assertEquals(self._ch.send.call_count, 3)
+        self.assertIsNone(pub._flush_gl)
+
+    def test_publish_batched_interleaved_flush(self):
+        pub = Publisher(node=self._node, to_name="testpub", batch_size=10, batch_interval=10)
+        self._ch.send.side_effect = lambda body, headers: sleep(0.01)
+
+        pub.publish("m1")
+        pub.publish("m2", to_name="otherpub")
+        pub.publish("m3", to_name="thirdpub")
+
+        # Both flushes yield while sending and see batches the other one already took
+        gl1, gl2 = spawn(pub.flush), spawn(pub.flush)
+        gl1.join(timeout=1)
+        gl2.join(timeout=1)
+        self.assertTrue(gl1.successful())
+        self.assertTrue(gl2.successful())
+        self.assertEquals(self._ch.send.call_count, 3)
+        self.assertEquals(sorted(call_args[0][0][0][0] for call_args in self._ch.send.call_args_list),
+                          ["m1", "m2", "m3"])
+        self.assertEquals(pub._batches, {})
+        pub.close()
+
 
 class RecvMockMixin(object):
     """
@@ -483,6 +776,14 @@ class TestSubscriber(PyonTestCase, RecvMockMixin):
         # make sure we got our message
         cbmock.assert_called_once_with('subbed', {'conv-id': sentinel.conv_id, 'status_code':200, 'error_message':'', 'op': None})
 
+    def test_subscribe_batch(self):
+        cbmock = Mock()
+        sub = Subscriber(node=self._node, from_name="testsub", callback=cbmock)
+        e = sub.create_endpoint(existing_channel=Mock())
+
+        e.message_received([["m1", {'ts': '1'}], ["m2", {'ts': '2', 'h': 2}]], {MSG_HEADER_BATCH: 2, 'ts': '3', 'h': 1})
+        self.assertEquals(cbmock.call_args_list, [call("m1", {'ts': '1', 'h': 1}), call("m2", {'ts': '2', 'h': 2})])
+
 @attr('UNIT')
 @patch('pyon.net.endpoint.BidirectionalEndpointUnit._send', Mock(return_value=(sentinel.body, {'conv-id':sentinel.conv_id})))
 class TestRequestResponse(PyonTestCase, RecvMockMixin):
@@ -592,6 +893,131 @@ class TestRPCClient(PyonTestCase, RecvMockMixin):
         rpcc = RPCClient(to_name="simply", iface=ISimpleInterface)
         self.assertRaises(BadRequest, rpcc.simple, "zap", "zip")
 
+    @patch('pyon.net.endpoint.IonObject')
+    @patch('pyon.net.endpoint.RPCRequestEndpointUnit._build_conv_id', Mock(return_value=sentinel.conv_id))
+    def test_rpc_client_async(self, iomock):
+        node = Mock(spec=NodeB)
+
+        rpcc = RPCClient(node=node, to_name="simply", iface=ISimpleInterface)
+        rpcc.node.channel.side_effect = lambda *args, **kwargs: self._setup_mock_channel()
+        rpcc.node.interceptors = {}
+
+        self.assertTrue(hasattr(rpcc, 'simple_async'))
+
+        ars = [rpcc.simple_async(one="zap", two="zip") for i in xrange(3)]
+        self.assertEquals(iomock.call_count, 3)
+        self.assertEquals(gather(ars, timeout=5), ["bidirmsg"] * 3)
+
+    @patch('pyon.net.endpoint.RPCRequestEndpointUnit._build_conv_id', Mock(return_value=sentinel.conv_id))
+    def test_rpc_client_async_error(self):
+        node = Mock(spec=NodeB)
+
+        rpcc = RPCClient(node=node, to_name="simply")
+        rpcc.node.channel.return_value = self._setup_mock_channel(status_code=404, error_message="not here")
+        rpcc.node.interceptors = {}
+
+        ar = rpcc.request_async({}, op="simple")
+        self.assertRaises(exception.NotFound, ar.get, timeout=5)
+        self.assertTrue(rpcc.node.channel.return_value.close.called)
+
+    def test_rpc_client_shared_reply_queue(self):
+        self.patch_cfg('pyon.net.endpoint.CFG', {'container': {'messaging': {'rpc': {'shared_reply_queue': True}}}})
+
+        replies = Queue()
+        recv_ch = MagicMock(spec=RecvChannel())
+        recv_ch._recv_name = NameTrio('xs', 'xs.rpc_reply_1')
+        recv_ch.recv.side_effect = replies.get
+
+        def send(msg, headers):
+            # reply asynchronously, echoing the conv-id
+            spawn(replies.put, (headers['conv-id'], {'conv-id': headers['conv-id'], 'status_code': 200, 'error_message': ''}, 1))
+        send_chs = []
+        def new_channel(ch_type, transport=None):
+            if ch_type is RecvChannel:
+                return recv_ch
+            ch = MagicMock(spec=BidirClientChannel())
+            ch._send_name = NameTrio('', '')
+            ch.send.side_effect = send
+            send_chs.append(ch)
+            return ch
+
+        node = Mock(spec=NodeB)
+        node._lock = RLock()
+        node.reply_listener = None
+        node.interceptors = {}
+        node.channel.side_effect = new_channel
+
+        rpcc = RPCClient(node=node, to_name="simply")
+        ars = [rpcc.request_async({}, op="simple") for i in xrange(3)]
+        sent_headers = [ch.send.call_args[0][1] for ch in send_chs]
+        self.assertEquals(gather(ars, timeout=5), [hdrs['conv-id'] for hdrs in sent_headers])
+
+        # One reply listener for all requests, no per-request listeners
+        self.assertEquals(recv_ch.setup_listener.call_count, 1)
+        self.assertEquals(recv_ch.start_consume.call_count, 1)
+        for ch, hdrs in zip(send_chs, sent_headers):
+            self.assertEquals(hdrs['reply-to'], "xs,xs.rpc_reply_1")
+            self.assertFalse(ch.setup_listener.called)
+            self.assertFalse(ch.start_consume.called)
+
+        # Blocking requests use the shared reply queue as well
+        res = rpcc.request({}, op="simple")
+        self.assertEquals(res, send_chs[-1].send.call_args[0][1]['conv-id'])
+        self.assertEquals(node.reply_listener._pending, {})
+
+    def test_reply_listener_errors(self):
+        from pyon.net.endpoint import ReplyListener
+
+        replies = Queue()
+        recv_ch = MagicMock(spec=RecvChannel())
+        recv_ch._recv_name = NameTrio('xs', 'xs.rpc_reply_1')
+        def recv():
+            item = replies.get()
+            if isinstance(item, Exception):
+                raise item
+            return item
+        def ack(dtag):
+            if dtag == 1:
+                raise TestError("ack failed")
+        recv_ch.recv.side_effect = recv
+        recv_ch.ack.side_effect = ack
+
+        node = Mock(spec=NodeB)
+        node._lock = RLock()
+        node.channel.return_value = recv_ch
+        listener = ReplyListener(node)
+        listener.start()
+        node.reply_listener = listener
+
+        # A failing ack does not end the receive loop
+        ar1, ar2, ar3 = listener.register("c1"), listener.register("c2"), listener.register("c3")
+        replies.put(("m1", {'conv-id': "c1"}, 1))
+        replies.put(("m2", {'conv-id': "c2"}, 2))
+        self.assertEquals(ar2.get(timeout=5), ("m2", {'conv-id': "c2"}, 2))
+        self.assertFalse(ar1.ready())
+
+        # A receive error ends the loop, detaches the listener and fails waiting requests
+        replies.put(TestError("recv failed"))
+        self.assertRaises(ChannelClosedError, ar1.get, timeout=5)
+        self.assertRaises(ChannelClosedError, ar3.get, timeout=5)
+        self.assertIsNone(node.reply_listener)
+        self.assertEquals(listener._pending, {})
+        self.assertTrue(recv_ch.close.called)
+
+    def test_gather(self):
+        ar1, ar2, ar3 = event.AsyncResult(), event.AsyncResult(), event.AsyncResult()
+        ar1.set(1)
+        ar2.set_exception(BadRequest("bad"))
+
+        self.assertRaises(exception.Timeout, gather, [ar1, ar3], timeout=0.1)
+        self.assertRaises(BadRequest, gather, [ar1, ar2])
+
+        spawn(ar3.set, 3)
+        res = gather([ar1, ar2, ar3], timeout=1, raise_exception=False)
+        self.assertEquals(res[0], 1)
+        self.assertIsInstance(res[1], BadRequest)
+        self.assertEquals(res[2], 3)
+
 @attr('UNIT')
 class TestRPCResponseEndpoint(PyonTestCase, RecvMockMixin):
 
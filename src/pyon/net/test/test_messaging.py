@@ -3,7 +3,7 @@
 __author__ = 'Dave Foster <dfoster@asascience.com>'
 
 
-from pyon.net.messaging import NodeB, ioloop, make_node, PyonSelectConnection
+from pyon.net.messaging import NodeB, ioloop, make_node, PyonSelectConnection, ConnectionBlocked, ConnectionUnblocked
 from pyon.net.channel import BaseChannel, BidirClientChannel, RecvChannel
 from pyon.util.unit_test import PyonTestCase
 from mock import Mock, sentinel, patch
@@ -16,6 +16,7 @@ from gevent import event, queue
 import time
 from pyon.util.containers import DotDict
 from pika.exceptions import NoFreeChannels
+from pika import frame as pikaframe, spec as pikaspec
 from interface.services.agent.icontainer_agent import ContainerAgentClient
 
 @attr('UNIT')
@@ -28,6 +29,24 @@ class TestNodeB(PyonTestCase):
         self.assertEquals(self._node.running, 1)
         self.assertTrue(self._node.ready.is_set())
 
+    def test_flow_control(self):
+        self.assertFalse(self._node.is_blocked())
+        self.assertTrue(self._node.wait_unblocked(timeout=0))
+
+        self._node.on_flow_control("low on memory")
+        self.assertTrue(self._node.is_blocked())
+        self.assertFalse(self._node.wait_unblocked(timeout=0.01))
+
+        waiter = spawn(self._node.wait_unblocked, timeout=1)
+        self._node.on_flow_control(None)
+        self.assertTrue(waiter.get(timeout=1))
+        self.assertFalse(self._node.is_blocked())
+
+        # connection close releases waiting publishers
+        self._node.on_flow_control("low on memory")
+        self._node.on_connection_close()
+        self.assertFalse(self._node.is_blocked())
+
     def test_on_channel_request_close_not_in_map(self):
         chm = Mock(spec=BaseChannel)
 
@@ -362,6 +381,31 @@ class TestPyonSelectConnection(PyonTestCase):
 
         self.assertRaises(NoFreeChannels, self.conn._next_channel_number)
 
+    def test_flow_control(self):
+        self.assertIsNone(self.conn.blocked)
+        flow_cb = Mock()
+        self.conn.add_flow_callback(flow_cb)
+
+        # frames decode with the registered extension methods
+        blocked_frame = pikaframe.Method(0, ConnectionBlocked("low on memory"))
+        consumed, frame = pikaframe.decode_frame(blocked_frame.marshal())
+        self.assertIsInstance(frame.method, ConnectionBlocked)
+        self.conn._on_connection_blocked(frame)
+        self.assertEquals(self.conn.blocked, "low on memory")
+        flow_cb.assert_called_once_with("low on memory")
+
+        consumed, frame = pikaframe.decode_frame(pikaframe.Method(0, ConnectionUnblocked()).marshal())
+        self.conn._on_connection_unblocked(frame)
+        self.assertIsNone(self.conn.blocked)
+        flow_cb.assert_called_with(None)
+
+    @patch('pyon.net.messaging.SelectConnection')
+    def test_send_start_ok_capabilities(self, scmock):
+        start_ok = pikaspec.Connection.StartOk(client_properties={"product": "test"})
+        self.conn._send_method(0, start_ok)
+        self.assertEquals(start_ok.client_properties["capabilities"], {"connection.blocked": True})
+        scmock._send_method.assert_called_once_with(self.conn, 0, start_ok, None)
+
     def text__next_channel_number_adds_to_pending(self):
         ch = self.conn._next_channel_number()
         self.assertIn(ch, self.conn._pending)
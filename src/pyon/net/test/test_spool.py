@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+
+from gevent import sleep
+from mock import Mock
+from nose.plugins.attrib import attr
+
+from pyon.net.spool import MessageSpool, SpoolFullError
+from pyon.util.unit_test import PyonTestCase
+
+
+@attr('UNIT')
+class TestMessageSpool(PyonTestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def _segment_files(self):
+        return sorted(os.listdir(self.path))
+
+    def test_append_replay_order(self):
+        spool = MessageSpool(self.path, max_size=100000, segment_size=100)
+        self.assertIsNone(spool.peek())
+        for i in xrange(10):
+            spool.append(("xp", "q", "key"), "body%s" % i, {'i': i})
+        self.assertEquals(spool.pending, 10)
+        self.assertGreater(len(self._segment_files()), 1)
+
+        msgs = []
+        while spool.peek() is not None:
+            msgs.append(spool.peek())
+            spool.pop()
+        self.assertEquals(msgs, [(("xp", "q", "key"), "body%s" % i, {'i': i}) for i in xrange(10)])
+        self.assertEquals(spool.pending, 0)
+        self.assertEquals(spool.size, 0)
+        self.assertEquals(self._segment_files(), [])
+
+        # appending after the spool was drained starts a new segment
+        spool.append(("xp", "q", "key"), "again", {})
+        self.assertEquals(spool.peek()[1], "again")
+        spool.close()
+
+    def test_reload(self):
+        spool = MessageSpool(self.path, max_size=100000, segment_size=100)
+        for i in xrange(6):
+            spool.append(("xp", "q", "key"), "body%s" % i, {})
+        spool.pop()
+        spool.close()
+
+        # an incomplete record (crash during append) is truncated
+        last_segment = os.path.join(self.path, self._segment_files()[-1])
+        with open(last_segment, "ab") as f:
+            f.write("\x00\x00\x01")
+
+        spool = MessageSpool(self.path, max_size=100000, segment_size=100)
+        self.assertEquals(spool.pending, 5)
+        self.assertEquals(spool.peek()[1], "body1")
+
+        # appends after the reload continue the loaded tail segment
+        num_segments = len(self._segment_files())
+        spool.append(("xp", "q", "key"), "body6", {})
+        spool.append(("xp", "q", "key"), "body7", {})
+        self.assertEquals(spool.pending, 7)
+        self.assertEquals(len(self._segment_files()), num_segments)
+        spool.close()
+
+        spool = MessageSpool(self.path, max_size=100000, segment_size=100)
+        self.assertEquals(spool.pending, 7)
+        bodies = []
+        while spool.pending:
+            bodies.append(spool.peek()[1])
+            spool.pop()
+        self.assertEquals(bodies, ["body%s" % i for i in xrange(1, 8)])
+        spool.close()
+
+    def test_max_size(self):
+        spool = MessageSpool(self.path, max_size=200, segment_size=100)
+        with self.assertRaises(SpoolFullError):
+            for i in xrange(10):
+                spool.append(("xp", "q", "key"), "x" * 40, {})
+        self.assertLessEqual(spool.size, 200)
+        stats = spool.get_stats()
+        self.assertEquals(stats['rejected'], 1)
+        self.assertEquals(stats['spooled'], spool.pending)
+        spool.close()
+
+    def test_replay(self):
+        spool = MessageSpool(self.path, retry_interval=0.01)
+        for i in xrange(3):
+            spool.append(("xp", "q", "key"), "body%s" % i, {})
+
+        def send_side_effect(name, body, headers):
+            if send_func.call_count == 1:
+                raise IOError("broker down")
+        send_func = Mock(side_effect=send_side_effect)
+        spool.start_replay(send_func)
+        spool.start_replay(send_func)
+        sleep(0.1)
+
+        self.assertEquals(spool.pending, 0)
+        self.assertEquals([c[0][1] for c in send_func.call_args_list], ["body0", "body0", "body1", "body2"])
+        stats = spool.get_stats()
+        self.assertEquals((stats['replayed'], stats['replay_errors']), (3, 1))
+        self.assertIsNone(spool._replay_gl)
+        spool.close()
@@ -7,11 +7,13 @@ from pyon.util.unit_test import PyonTestCase
 from pyon.util.int_test import IonIntegrationTestCase
 from pyon.net.transport import NameTrio, BaseTransport, AMQPTransport, TransportError, TopicTrie, LocalRouter, ComposableTransport, LocalTransport
 from pyon.core.bootstrap import get_sys_name
-from pika import BasicProperties
+from pika import BasicProperties, spec
 
 from nose.plugins.attrib import attr
 from mock import Mock, MagicMock, sentinel, patch, call, ANY
 from gevent.event import Event
+from gevent import sleep
+from gevent.timeout import Timeout
 import time
 
 @attr('UNIT')
@@ -64,7 +66,8 @@ class TestComposableTransport(PyonTestCase):
                                         'stop_consume_impl'    : right.stop_consume_impl,
                                         'get_stats_impl'       : right.get_stats_impl,
                                         'qos_impl'             : right.qos_impl,
-                                        'publish_impl'         : right.publish_impl, })
+                                        'publish_impl'         : right.publish_impl,
+                                        'enable_confirms'      : right.enable_confirms, })
 
     def test_overlay(self):
         left = Mock()
@@ -121,7 +124,7 @@ class TestComposableTransport(PyonTestCase):
         left.purge_impl.assert_called_once_with(sentinel.queue)
         left.setup_listener.assert_called_once_with(sentinel.binding, sentinel.callback)
 
-        right.ack_impl.assert_called_once_with(sentinel.dtag)
+        right.ack_impl.assert_called_once_with(sentinel.dtag, multiple=False)
         right.reject_impl.assert_called_once_with(sentinel.dtag, requeue=False)
         right.start_consume_impl.assert_called_once_with(sentinel.callback, sentinel.queue, no_ack=False, exclusive=False)
         right.stop_consume_impl.assert_called_once_with(sentinel.ctag)
@@ -338,6 +341,15 @@ class TestAMQPTransport(PyonTestCase):
 
         self.assertEquals(tp._close_callbacks, [sentinel.one, sentinel.two])
 
+    def test_is_blocked(self):
+        tp = AMQPTransport(Mock())
+        tp._client.connection.blocked = None
+        self.assertFalse(tp.is_blocked())
+
+        tp._client.connection.blocked = "low on memory"
+        self.assertTrue(tp.is_blocked())
+        self.assertTrue(ComposableTransport(Mock(spec=BaseTransport, is_blocked=Mock(return_value=False)), tp).is_blocked())
+
 @attr('UNIT')
 class TestAMQPTransportCommonMethods(PyonTestCase):
 
@@ -402,7 +414,7 @@ class TestAMQPTransportCommonMethods(PyonTestCase):
     def test_ack_impl(self):
         self.tp.ack_impl(sentinel.dtag)
 
-        self.tp._client.basic_ack.assert_called_once_with(sentinel.dtag)
+        self.tp._client.basic_ack.assert_called_once_with(sentinel.dtag, multiple=False)
 
     def test_reject_impl(self):
         self.tp.reject_impl(sentinel.dtag)
@@ -498,6 +510,32 @@ class TestAMQPTransportCommonMethods(PyonTestCase):
                                                               immediate=False,
                                                               mandatory=False)
 
+    @patch('pyon.net.transport.BasicProperties', Mock())
+    def test_publish_confirms(self):
+        self.assertIsNone(self.tp.publish_impl(sentinel.exchange, sentinel.routing_key, sentinel.body, {}))
+
+        self.assertTrue(self.tp.enable_confirms())
+        self.tp._client.confirm_delivery.assert_called_once_with(callback=self.tp._on_confirm)
+        self.tp._client.callbacks.add.assert_called_once_with(self.tp._client.channel_number, spec.Basic.Nack,
+                                                              self.tp._on_confirm, False)
+
+        confirms = [self.tp.publish_impl(sentinel.exchange, sentinel.routing_key, sentinel.body, {}) for i in xrange(5)]
+        self.assertEquals(self.tp._confirms.keys(), [1, 2, 3, 4, 5])
+
+        # multiple ack confirms all up to delivery tag, single nack rejects one
+        self.tp._on_confirm(Mock(method=spec.Basic.Ack(delivery_tag=2, multiple=True)))
+        self.tp._on_confirm(Mock(method=spec.Basic.Nack(delivery_tag=4, multiple=False)))
+        self.assertTrue(confirms[0].get(timeout=1))
+        self.assertTrue(confirms[1].get(timeout=1))
+        self.assertRaises(TransportError, confirms[3].get, timeout=1)
+        self.assertEquals(self.tp._confirms.keys(), [3, 5])
+
+        # close of underlying channel fails outstanding messages
+        self.tp._on_underlying_close(320, "CONNECTION_FORCED")
+        self.assertRaises(TransportError, confirms[2].get, timeout=1)
+        self.assertRaises(TransportError, confirms[4].get, timeout=1)
+        self.tp.wait_for_confirms(timeout=1)
+
 @attr('UNIT')
 class TestNameTrio(PyonTestCase):
     def test_init(self):
@@ -571,6 +609,63 @@ class TestTopicTrie(PyonTestCase):
         self.assertEquals({sentinel.wild},
                           set(self.tt.get_all_matches('a.b.b.b.b.b.b')))
 
+    def test_hash_wildcards(self):
+        self.tt.add_topic_tree('#', sentinel.all)
+        self.tt.add_topic_tree('#.c', sentinel.end_c)
+        self.tt.add_topic_tree('#.b.#', sentinel.any_b)
+        self.tt.add_topic_tree('a.#.#.c', sentinel.double)
+
+        self.assertEquals({sentinel.all, sentinel.end_c, sentinel.any_b, sentinel.double},
+                          set(self.tt.get_all_matches('a.b.c')))
+        self.assertEquals({sentinel.all, sentinel.end_c, sentinel.double}, set(self.tt.get_all_matches('a.c')))
+        self.assertEquals({sentinel.all, sentinel.any_b}, set(self.tt.get_all_matches('b')))
+        self.assertEquals({sentinel.all, sentinel.any_b}, set(self.tt.get_all_matches('.'.join(['b'] * 50))))
+
+    def test_trailing_hash(self):
+        # As in AMQP topic exchanges, a trailing # matches zero or more words
+        self.tt.add_topic_tree('a.#', sentinel.a_any)
+        self.tt.add_topic_tree('a.b.#', sentinel.ab_any)
+        self.tt.add_topic_tree('a.*.#', sentinel.a_one_any)
+
+        self.assertEquals({sentinel.a_any}, set(self.tt.get_all_matches('a')))
+        self.assertEquals({sentinel.a_any, sentinel.ab_any, sentinel.a_one_any}, set(self.tt.get_all_matches('a.b')))
+        self.assertEquals({sentinel.a_any, sentinel.ab_any, sentinel.a_one_any}, set(self.tt.get_all_matches('a.b.c.d')))
+        self.assertEquals(set(), set(self.tt.get_all_matches('b')))
+
+    def test_match_cache(self):
+        self.tt = TopicTrie(cache_size=2)
+        self.tt.add_topic_tree('a.*', sentinel.p1)
+
+        self.assertEquals({sentinel.p1}, self.tt.get_all_matches('a.b'))
+        self.assertIn('a.b', self.tt._match_cache)
+
+        # cache is invalidated on add and remove
+        self.tt.add_topic_tree('a.b', sentinel.p2)
+        self.assertEquals({sentinel.p1, sentinel.p2}, self.tt.get_all_matches('a.b'))
+        self.tt.remove_topic_tree('a.*', sentinel.p1)
+        self.assertEquals({sentinel.p2}, self.tt.get_all_matches('a.b'))
+
+        # least recently used topic is evicted
+        self.tt.get_all_matches('a.c')
+        self.tt.get_all_matches('a.b')
+        self.tt.get_all_matches('a.d')
+        self.assertEquals(['a.b', 'a.d'], list(self.tt._match_cache))
+
+    def test_remove_prunes_nodes(self):
+        self.tt.add_topic_tree('a.b.c', sentinel.p1)
+        self.tt.add_topic_tree('a.b', sentinel.p2)
+
+        self.tt.remove_topic_tree('x.y', sentinel.p1)
+        self.assertNotIn('x', self.tt.root.children)
+
+        self.tt.remove_topic_tree('a.b.c', sentinel.p1)
+        self.assertEquals({}, self.tt.root.children['a'].children['b'].children)
+        self.assertEquals({sentinel.p2}, self.tt.get_all_matches('a.b'))
+
+        self.tt.remove_topic_tree('a.b', sentinel.p2)
+        self.assertEquals({}, self.tt.root.children)
+        self.assertEquals(set(), self.tt.get_all_matches('a.b'))
+
 @attr('UNIT')
 class TestLocalRouter(PyonTestCase):
 
@@ -723,6 +818,40 @@ class TestLocalRouter(PyonTestCase):
     def test__connect_addr(self):
         self.assertEquals(self.lr._connect_addr, "inproc://%s" % get_sys_name())
 
+    def test_throughput_mode(self):
+        lr = LocalRouter(get_sys_name(), throughput_mode=True)
+        lr.start()
+        self.addCleanup(lr.stop)
+
+        lr.declare_exchange('known')
+        lr.declare_queue('q1')
+        lr.bind('known', 'q1', 'a.*')
+        lr.declare_queue('q2')
+        lr.bind('known', 'q2', 'a.b')
+
+        with patch('pyon.net.transport.sleep') as sleepmock:
+            for i in xrange(250):
+                lr.publish('known', 'a.b', i, {})
+            self.assertEquals(sleepmock.call_count, 2)     # no sleep per message, yields every 100 publishes
+
+        lr.publish('unknown', 'a.b', 'body', {})
+        with Timeout(5):
+            while lr._queues['q2'].qsize() < 250 or not lr.errors:
+                sleep(0.01)
+
+        # routed in publish order to all matching queues
+        self.assertEquals([m[2] for m in lr._queues['q1'].queue], range(250))
+        self.assertEquals([m[2] for m in lr._queues['q2'].queue], range(250))
+        self.assertEquals(len(lr.errors), 1)
+
+        # routing tables snapshot follows declares and binds
+        lr.delete_queue('q1')
+        self.assertNotIn('q1', lr._route_tables[1])
+        lr.unbind('known', 'q2', 'a.b')
+        lr.publish('known', 'a.b', 'body', {})
+        sleep(0.05)
+        self.assertEquals(lr._queues['q2'].qsize(), 250)
+
     def test__child_failed(self):
         self.lr.gl_ioloop = Mock()
 
@@ -950,6 +1079,10 @@ class TestLocalTransport(PyonTestCase):
         self.broker.transport_close.assert_called_once_with(self.lt)
         self.assertFalse(self.lt._active)
 
+    def test_ack_multiple(self):
+        self.assertRaises(AssertionError, self.lt.ack_impl, sentinel.delivery_tag, multiple=True)
+        self.assertFalse(self.broker.ack.called)
+
     def test_close_with_callbacks(self):
         m = Mock()
         self.lt.add_on_close_callback(m)
@@ -12,8 +12,8 @@ __author__ = 'Dave Foster <dfoster@asascience.com>'
 import os
 from contextlib import contextmanager
 from uuid import uuid4
-from collections import defaultdict
-from pika import BasicProperties
+from collections import defaultdict, OrderedDict
+from pika import BasicProperties, spec
 from gevent.event import AsyncResult, Event
 from gevent.queue import Queue
 from gevent import sleep
@@ -88,7 +88,7 @@ class BaseTransport(object):
     def unbind_impl(self, exchange, queue, binding):
         raise NotImplementedError()
 
-    def ack_impl(self, delivery_tag):
+    def ack_impl(self, delivery_tag, multiple=False):
         raise NotImplementedError()
 
     def reject_impl(self, delivery_tag, requeue=False):
@@ -115,6 +115,20 @@ class BaseTransport(object):
     def publish_impl(self, exchange, routing_key, body, properties, immediate=False, mandatory=False, durable_msg=False):
         raise NotImplementedError()
 
+    def enable_confirms(self):
+        """
+        Puts this transport in publisher confirm mode, if supported.
+        In confirm mode, publish_impl returns an AsyncResult that is set when the broker confirms the message.
+        @retval True if confirm mode is supported
+        """
+        return False
+
+    def is_blocked(self):
+        """
+        Returns True while the broker blocks publishing on the underlying connection (flow control).
+        """
+        return False
+
     def close(self):
         raise NotImplementedError()
 
@@ -150,7 +164,8 @@ class ComposableTransport(BaseTransport):
                       'stop_consume_impl',
                       'qos_impl',
                       'get_stats_impl',
-                      'publish_impl']
+                      'publish_impl',
+                      'enable_confirms']
 
     def __init__(self, left, right, *methods):
         self._transports = [left]
@@ -171,7 +186,8 @@ class ComposableTransport(BaseTransport):
                           'get_stats_impl'       : left.get_stats_impl,
                           'purge_impl'           : left.purge_impl,
                           'qos_impl'             : left.qos_impl,
-                          'publish_impl'         : left.publish_impl, }
+                          'publish_impl'         : left.publish_impl,
+                          'enable_confirms'      : left.enable_confirms, }
 
         if right is not None:
             self.overlay(right, *methods)
@@ -209,9 +225,9 @@ class ComposableTransport(BaseTransport):
         m = self._methods['unbind_impl']
         return m(exchange, queue, binding)
 
-    def ack_impl(self, delivery_tag):
+    def ack_impl(self, delivery_tag, multiple=False):
         m = self._methods['ack_impl']
-        return m(delivery_tag)
+        return m(delivery_tag, multiple=multiple)
 
     def reject_impl(self, delivery_tag, requeue=False):
         m = self._methods['reject_impl']
@@ -245,6 +261,13 @@ class ComposableTransport(BaseTransport):
         m = self._methods['publish_impl']
         return m(exchange, routing_key, body, properties, immediate=immediate, mandatory=mandatory, durable_msg=durable_msg)
 
+    def enable_confirms(self):
+        m = self._methods['enable_confirms']
+        return m()
+
+    def is_blocked(self):
+        return any(t.is_blocked() for t in self._transports)
+
     def close(self):
         for t in self._transports:
             t.close()
@@ -280,6 +303,9 @@ class AMQPTransport(BaseTransport):
         self._close_callbacks = []
         self.lock = False
 
+        self._confirms = None       # In confirm mode: delivery tag -> AsyncResult, in publish order
+        self._confirm_seq = 0
+
     def _on_underlying_close(self, code, text):
         if not (code == 0 or code == 200):
             log.error("AMQPTransport.underlying closed:\n\tchannel number: %s\n\tcode: %d\n\ttext: %s", self.channel_number, code, text)
@@ -299,6 +325,9 @@ class AMQPTransport(BaseTransport):
         #stro = pprint.pformat(callbacks._callbacks)
         #log.error(str(stro))
 
+        if self._confirms:
+            self._fail_confirms(TransportError("Channel closed before publish was confirmed (%s: %s)" % (code, text)))
+
         for cb in self._close_callbacks:
             cb(self, code, text)
 
@@ -420,12 +449,12 @@ class AMQPTransport(BaseTransport):
                         exchange=exchange,
                         routing_key=binding)
 
-    def ack_impl(self, delivery_tag):
+    def ack_impl(self, delivery_tag, multiple=False):
         """
-        Acks a message.
+        Acks a message. With multiple=True, acks all unacked messages up to and including delivery_tag.
         """
         #log.debug("AMQPTransport.ack(%s): %s", self._client.channel_number, delivery_tag)
-        self._client.basic_ack(delivery_tag)
+        self._client.basic_ack(delivery_tag, multiple=multiple)
 
     def reject_impl(self, delivery_tag, requeue=False):
         """
@@ -528,6 +557,69 @@ class AMQPTransport(BaseTransport):
                                    immediate=immediate,     # todo
                                    mandatory=mandatory)     # todo
 
+        if self._confirms is not None:
+            # The broker numbers published messages per channel from 1 on, after confirm select
+            self._confirm_seq += 1
+            confirm = AsyncResult()
+            self._confirms[self._confirm_seq] = confirm
+            return confirm
+
+    def enable_confirms(self):
+        """
+        Puts the channel in publisher confirm mode. Does not wait for the broker's select-ok.
+        Outstanding messages are tracked by delivery tag and resolved by broker acks and nacks.
+        """
+        if self._confirms is None:
+            self._confirms = OrderedDict()
+            self._confirm_seq = 0
+            self._client.confirm_delivery(callback=self._on_confirm)
+            self._client.callbacks.add(self._client.channel_number, spec.Basic.Nack, self._on_confirm, False)
+        return True
+
+    def _on_confirm(self, frame):
+        """
+        Handles broker Basic.Ack and Basic.Nack, which may confirm all messages up to the delivery tag at once.
+        """
+        method = frame.method
+        ack = isinstance(method, spec.Basic.Ack)
+        if method.multiple:
+            confirmed = []
+            while self._confirms:
+                tag = next(iter(self._confirms))
+                if tag > method.delivery_tag:
+                    break
+                confirmed.append(self._confirms.pop(tag))
+        else:
+            confirm = self._confirms.pop(method.delivery_tag, None)
+            confirmed = [confirm] if confirm is not None else []
+
+        for confirm in confirmed:
+            if ack:
+                confirm.set(True)
+            else:
+                confirm.set_exception(TransportError("Message publish was rejected (nack) by broker"))
+
+    def _fail_confirms(self, exc):
+        confirms, self._confirms = self._confirms, OrderedDict()
+        for confirm in confirms.itervalues():
+            confirm.set_exception(exc)
+
+    def wait_for_confirms(self, timeout=None):
+        """
+        Waits until all messages published so far are confirmed.
+        @raises TransportError  If any message was rejected or the channel closed
+        @raises Timeout         If not all messages are confirmed within the timeout
+        """
+        if not self._confirms:
+            return
+        with Timeout(timeout):
+            for confirm in self._confirms.values():
+                confirm.get()
+
+    def is_blocked(self):
+        # Flow control state is kept by the pyon connection (see PyonSelectConnection)
+        return getattr(self._client.connection, "blocked", None) is not None
+
 
 class TopicTrie(object):
     """
@@ -535,6 +627,9 @@ class TopicTrie(object):
 
     Used for events/pubsub in our system with the local transport. Efficiently stores all registered
     subscription topic trees in a trie structure, handling wildcards * and #.
+    Matching is iterative over (node, token index) states, so that # wildcards do not re-expand
+    suffixes. Match results are kept in an LRU cache by topic, cleared on any add or remove.
+    As in AMQP, # matches zero or more words anywhere, including at the end (a.# matches a).
 
     See:
         http://www.zeromq.org/whitepapers:message-matching      (doesn't handle # so scrapped)
@@ -549,6 +644,8 @@ class TopicTrie(object):
         Stores two data points: a token (literal string, '*', or '#', or None if used as root element),
                                 and a set of "patterns" aka a ref to an object representing a bind.
         """
+        __slots__ = ('token', 'patterns', 'children')
+
         def __init__(self, token, patterns=None):
             self.token = token
             self.patterns = patterns or []
@@ -560,96 +657,112 @@ class TopicTrie(object):
 
             If it doesn't already exist, it is created, otherwise the existing one is returned.
             """
-            if token in self.children:
-                return self.children[token]
-
-            new_node = TopicTrie.Node(token)
-            self.children[token] = new_node
+            node = self.children.get(token, None)
+            if node is None:
+                node = TopicTrie.Node(token)
+                self.children[token] = node
 
-            return new_node
-
-        def get_all_matches(self, topics):
-            """
-            Given a list of topic tokens, returns all patterns stored in child nodes/self that match the topic tokens.
+            return node
 
-            This is a depth-first search pruned by token, with special handling for both wildcard types.
-            """
-            results = []
-
-            if len(topics) == 0:
-                # terminal point, return any pattern we have here
-                return self.patterns
-
-            cur_token = topics[0]
-            rem_tokens = topics[1:]     # will always be a list, even if empty or 1-len
-            #log.debug('get_all_matches(%s): cur_token %s, rem_tokens %s', self.token, cur_token, rem_tokens)
-
-            # child node direct matching
-            if cur_token in self.children:
-                results.extend(self.children[cur_token].get_all_matches(rem_tokens))
-
-            # now '*' wildcard
-            if '*' in self.children:
-                results.extend(self.children['*'].get_all_matches(rem_tokens))
-
-            # '#' means any number of tokens - naive method of descent, we'll feed it nothing to start. Then chop the full
-            # topics all the way down, put the results in a set to remove duplicates, and also any patterns on self.
-            if '#' in self.children:
-                # keep popping off and descend, make a set out of results
-                all_wild_childs = set()
-                for i in xrange(len(topics)):
-                    res = self.children['#'].get_all_matches(topics[i:])
-                    map(all_wild_childs.add, res)
-
-                results.extend(all_wild_childs)
-                results.extend(self.children['#'].patterns)     # any patterns defined in # are legal too
-
-            return results
-
-    def __init__(self):
+    def __init__(self, cache_size=1000):
         """
         Creates a dummy root node that all topic trees hang off of.
+        @param  cache_size  Max number of topics with cached matches (0 to disable)
         """
         self.root = self.Node(None)
+        self.cache_size = cache_size
+        self._match_cache = OrderedDict()   # topic -> frozenset of patterns, least recently used first
 
     def add_topic_tree(self, topic_tree, pattern):
         """
-        Splits a string topic_tree into tokens (by .) and recursively adds them to the trie.
+        Splits a string topic_tree into tokens (by .) and adds them to the trie.
         Adds the pattern at the terminal node for later retrieval.
         """
-        topics = topic_tree.split(".")
-
         curnode = self.root
-
-        for topic in topics:
+        for topic in topic_tree.split("."):
             curnode = curnode.get_or_create_child(topic)
 
         if not pattern in curnode.patterns:
             curnode.patterns.append(pattern)
+            self._match_cache.clear()
 
     def remove_topic_tree(self, topic_tree, pattern):
         """
         Splits a string topic_tree into tokens (by .) and removes the pattern from the terminal node.
-        @TODO should remove empty nodes
+        Nodes left without patterns and children are removed.
         """
-        topics = topic_tree.split(".")
-
-        curnode = self.root
-
-        for topic in topics:
-            curnode = curnode.get_or_create_child(topic)
+        path = [self.root]
+        for topic in topic_tree.split("."):
+            node = path[-1].children.get(topic, None)
+            if node is None:
+                return
+            path.append(node)
+
+        curnode = path[-1]
+        if pattern not in curnode.patterns:
+            return
+        curnode.patterns.remove(pattern)
+        self._match_cache.clear()
 
-        if pattern in curnode.patterns:
-            curnode.patterns.remove(pattern)
+        # prune empty nodes bottom up
+        for i in xrange(len(path) - 1, 0, -1):
+            node = path[i]
+            if node.patterns or node.children:
+                break
+            del path[i - 1].children[node.token]
 
     def get_all_matches(self, topic_tree):
         """
-        Returns a list of all matches for a given topic tree string.
-        Creates a set out of the matching patterns, so multiple binds matching on the same pattern only
-        return once.
+        Returns a set of all matches for a given topic tree string.
+        Multiple binds matching on the same pattern only return once.
+        """
+        cache = self._match_cache
+        matches = cache.pop(topic_tree, None)
+        if matches is None:
+            matches = self._match(topic_tree)
+            if self.cache_size <= 0:
+                return matches
+            if len(cache) >= self.cache_size:
+                cache.popitem(last=False)
+        cache[topic_tree] = matches
+        return matches
+
+    def _match(self, topic_tree):
         """
-        topics = topic_tree.split(".")
-        return set(self.root.get_all_matches(topics))
+        Walks the trie for the given topic. A state is a node and the index of the next token to match.
+        A # node matches zero tokens by entering it and any further token by staying in it.
+        """
+        tokens = topic_tree.split(".")
+        num_tokens = len(tokens)
+        results = set()
+        seen = set()
+        stack = [(self.root, 0)]
+        while stack:
+            state = stack.pop()
+            state_key = (id(state[0]), state[1])
+            if state_key in seen:
+                continue
+            seen.add(state_key)
+            node, idx = state
+            children = node.children
+
+            if idx == num_tokens:
+                results.update(node.patterns)
+            else:
+                child = children.get(tokens[idx], None)
+                if child is not None:
+                    stack.append((child, idx + 1))
+                child = children.get('*', None)
+                if child is not None:
+                    stack.append((child, idx + 1))
+                if node.token == '#':
+                    stack.append((node, idx + 1))
+
+            child = children.get('#', None)
+            if child is not None:
+                stack.append((child, idx))
+
+        return frozenset(results)
 
 
 class LocalRouter(object):
@@ -657,7 +770,14 @@ class LocalRouter(object):
     A RabbitMQ-like routing device implemented with gevent mechanisms for an in-memory broker.
     Using LocalTransport, can handle topic-exchange-like communication in ION within the context
     of a single container.
+
+    In throughput mode, messages are routed in batches against a snapshot of the exchange and queue
+    tables without taking the declarables lock, and publish does not sleep after every message.
+    The snapshot is replaced on declare/delete. Bindings change the exchange TopicTrie in place,
+    which is atomic with respect to greenlets.
     """
+    BATCH_SIZE = 100                # Max messages routed per pass in throughput mode
+    PUBLISH_YIELD_INTERVAL = 100    # Number of publishes between cooperative yields in throughput mode
 
     class ConsumerClosedMessage(object):
         """
@@ -665,15 +785,18 @@ class LocalRouter(object):
         """
         pass
 
-    def __init__(self, sysname):
+    def __init__(self, sysname, throughput_mode=False):
         self._sysname = sysname
         self.ready = Event()
+        self.throughput_mode = throughput_mode
 
         # exchange/queues/bindings
         self._exchanges = {}                            # names -> { subscriber, topictrie(queue name) }
         self._queues = {}                               # names -> gevent queue
         self._bindings_by_queue = defaultdict(list)     # queue name -> [(ex, binding)]
         self._lock_declarables = RLock()                # exchanges, queues, bindings, routing method
+        self._route_tables = ({}, {})                   # snapshot of (exchanges, queues) for throughput mode
+        self._publish_count = 0
 
         # consumers
         self._consumers = defaultdict(list)             # queue name -> [ctag, channel._on_deliver]
@@ -713,6 +836,9 @@ class LocalRouter(object):
 
     def _run_gl_msgs(self):
         self.ready.set()
+        if self.throughput_mode:
+            return self._run_gl_msgs_batched()
+
         while True:
             ex, rkey, body, props = self._queue_incoming.get()
             try:
@@ -722,21 +848,48 @@ class LocalRouter(object):
                 self.errors.append(e)
                 log.exception("Routing message")
 
-    def _route(self, exchange, routing_key, body, props):
+    def _run_gl_msgs_batched(self):
+        """
+        Routing loop for throughput mode. Drains up to BATCH_SIZE incoming messages at a time,
+        routes them against the current tables snapshot and then yields to other greenlets.
+        """
+        queue_incoming = self._queue_incoming
+        while True:
+            batch = [queue_incoming.get()]
+            while len(batch) < self.BATCH_SIZE and not queue_incoming.empty():
+                batch.append(queue_incoming.get_nowait())
+
+            tables = self._route_tables
+            for ex, rkey, body, props in batch:
+                try:
+                    self._route(ex, rkey, body, props, tables=tables)
+                except Exception as e:
+                    self.errors.append(e)
+                    log.exception("Routing message")
+            sleep(0)
+
+    def _route(self, exchange, routing_key, body, props, tables=None):
         """
         Delivers incoming messages into queues based on known routes.
-        This entire method runs in a lock (likely pretty slow).
+        Runs in the declarables lock, unless given a (exchanges, queues) tables snapshot.
         """
-        assert exchange in self._exchanges, "Unknown exchange %s" % exchange
+        exchanges, queue_table = tables or (self._exchanges, self._queues)
+        assert exchange in exchanges, "Unknown exchange %s" % exchange
 
-        queues = self._exchanges[exchange].get_all_matches(routing_key)
+        queues = exchanges[exchange].get_all_matches(routing_key)
         log.debug("route: ex %s, rkey %s,  matched %s routes", exchange, routing_key, len(queues))
 
         # deliver to each queue
         for q in queues:
-            assert q in self._queues
+            assert q in queue_table
             log.debug("deliver -> %s", q)
-            self._queues[q].put((exchange, routing_key, body, props))
+            queue_table[q].put((exchange, routing_key, body, props))
+
+    def _update_route_tables(self):
+        """
+        Replaces the routing tables snapshot used in throughput mode. Call with the declarables lock held.
+        """
+        self._route_tables = (dict(self._exchanges), dict(self._queues))
 
     def _child_failed(self, gproc):
         """
@@ -757,17 +910,24 @@ class LocalRouter(object):
 
     def publish(self, exchange, routing_key, body, properties, immediate=False, mandatory=False):
         self._queue_incoming.put((exchange, routing_key, body, properties))
-        sleep(0.0001)      # really wish switch would work instead of a sleep, seems wrong
+        if self.throughput_mode:
+            self._publish_count += 1
+            if self._publish_count % self.PUBLISH_YIELD_INTERVAL == 0:
+                sleep(0)
+        else:
+            sleep(0.0001)      # really wish switch would work instead of a sleep, seems wrong
 
     def declare_exchange(self, exchange, **kwargs):
         with self._lock_declarables:
             if not exchange in self._exchanges:
                 self._exchanges[exchange] = TopicTrie()
+                self._update_route_tables()
 
     def delete_exchange(self, exchange, **kwargs):
         with self._lock_declarables:
             if exchange in self._exchanges:
                 del self._exchanges[exchange]
+                self._update_route_tables()
 
     def declare_queue(self, queue, **kwargs):
         with self._lock_declarables:
@@ -781,6 +941,7 @@ class LocalRouter(object):
 
             if not queue in self._queues:
                 self._queues[queue] = Queue()
+                self._update_route_tables()
 
             return queue
 
@@ -795,6 +956,7 @@ class LocalRouter(object):
                         self._exchanges[ex].remove_topic_tree(binding, queue)
 
                 self._bindings_by_queue.pop(queue)
+                self._update_route_tables()
 
     def bind(self, exchange, queue, binding):
         log.info("Bind: ex %s, q %s, b %s", exchange, queue, binding)
@@ -988,7 +1150,9 @@ class LocalTransport(BaseTransport):
     def stop_consume_impl(self, consumer_tag):
         self._broker.stop_consume(consumer_tag)
 
-    def ack_impl(self, delivery_tag):
+    def ack_impl(self, delivery_tag, multiple=False):
+        # RecvChannel only coalesces acks of integer (broker) delivery tags, local tags are strings
+        assert not multiple, "LocalTransport does not support multiple ack"
         self._broker.ack(delivery_tag)
 
     def reject_impl(self, delivery_tag, requeue=False):
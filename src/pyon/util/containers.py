@@ -358,6 +358,9 @@ def is_valid_identifier(name, valid_chars=BASIC_VALID, dot_sub=None, ws_sub=None
 
 #Used by json encoder
 def ion_object_encoder(obj):
+    from pyon.core.object import IonObjectBase
+    if isinstance(obj, IonObjectBase):
+        return obj._get_fields()
     return obj.__dict__
 
 def make_json(data):